@@ -1,22 +1,134 @@
-from typing import List
+import asyncio
+import bisect
+import difflib
+from json import loads, dumps
+from typing import List, Optional
 
 import discord
 from aiohttp import ClientSession
+from logbook import Logger
+
+from metrics import UPSTREAM_SECONDS
+from redis_utils import db
 
 DECRONYM = "http://decronym.xyz/acronyms/Space.json"
+DECRONYM_CACHE_KEY = "cache-decronym"
+DECRONYM_TIMEOUT_SECONDS = 30  # A hung request would otherwise hold up every caller waiting on the refresh
+
+log = Logger('Acronym Utils')
+
+
+class AcronymDictionary:
+    """
+    In-memory index of the decronym dictionary.  Refreshed with conditional
+    requests so an unchanged dictionary costs a 304, and persisted to Redis
+    so a restart doesn't need to download it before answering.
+    """
+
+    def __init__(self, acronyms: dict = None, refresh_timeout: float = DECRONYM_TIMEOUT_SECONDS):
+        self.refresh_timeout = refresh_timeout
+        self.etag = None
+        self.last_modified = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._set_acronyms(acronyms or {})
+
+    def _set_acronyms(self, acronyms: dict) -> None:
+        self.acronyms = acronyms
+        self._sorted_acronyms = sorted(acronyms)
+
+    async def load_from_redis(self) -> bool:
+        db_data = await db.get(DECRONYM_CACHE_KEY)
+        if not db_data:
+            return False
+        cached = loads(db_data)
+        self.etag = cached["etag"]
+        self.last_modified = cached["last_modified"]
+        self._set_acronyms(cached["acronyms"])
+        return True
+
+    async def refresh(self, session: ClientSession) -> None:
+        # Concurrent callers share the same request
+        if self._refresh_task is None:
+            task = asyncio.ensure_future(asyncio.wait_for(self._refresh(session), self.refresh_timeout))
+            task.add_done_callback(self._refresh_done)
+            self._refresh_task = task
+        await asyncio.shield(self._refresh_task)
+
+    def _refresh_done(self, task: asyncio.Task) -> None:
+        # Only the task that finished, a newer refresh may already have started
+        if self._refresh_task is task:
+            self._refresh_task = None
+
+    async def _refresh(self, session: ClientSession) -> None:
+        headers = {}
+        if self.acronyms:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+
+        with UPSTREAM_SECONDS.time(endpoint="decronym", status="error") as labels:
+            async with session.get(DECRONYM, headers=headers) as response:
+                labels["status"] = response.status
+                if response.status == 304:
+                    return
+                if response.status != 200:
+                    log.warning(f"[status={response.status}] error fetching decronym dictionary")
+                    return
+                acronyms = await response.json(content_type=None)
+                self.etag = response.headers.get("ETag")
+                self.last_modified = response.headers.get("Last-Modified")
+
+        self._set_acronyms(acronyms)
+        await db.set(DECRONYM_CACHE_KEY, dumps({"etag": self.etag,
+                                                "last_modified": self.last_modified,
+                                                "acronyms": acronyms}))
+
+    async def ensure_loaded(self, session: ClientSession) -> None:
+        if not self.acronyms and not await self.load_from_redis():
+            await self.refresh(session)
+
+    def lookup(self, acronym: str) -> List[str]:
+        return self.acronyms.get(acronym.upper(), [])
+
+    def prefix_lookup(self, prefix: str, limit: int = 5) -> List[str]:
+        """Acronyms starting with prefix, in alphabetical order."""
+        prefix = prefix.upper()
+        matches = []
+        for acronym in self._sorted_acronyms[bisect.bisect_left(self._sorted_acronyms, prefix):]:
+            if not acronym.startswith(prefix) or len(matches) == limit:
+                break
+            matches.append(acronym)
+        return matches
+
+    def fuzzy_lookup(self, acronym: str, limit: int = 5) -> List[str]:
+        """Acronyms that are spelled close to the given one."""
+        return difflib.get_close_matches(acronym.upper(), self._sorted_acronyms, n=limit)
+
+    def suggest(self, acronym: str, limit: int = 5) -> List[str]:
+        suggestions = self.prefix_lookup(acronym, limit)
+        for match in self.fuzzy_lookup(acronym, limit):
+            if match not in suggestions:
+                suggestions.append(match)
+        return suggestions[:limit]
+
+    async def run(self, session: ClientSession, refresh_interval: int) -> None:
+        while True:
+            try:
+                if not self.acronyms:
+                    await self.load_from_redis()
+                await self.refresh(session)
+            except Exception as e:
+                log.exception("Error refreshing decronym dictionary: {}".format(e))
+            await asyncio.sleep(refresh_interval)
+
+
+acronym_dictionary = AcronymDictionary()
 
 
 async def acronym_lookup(session: ClientSession, acronym: str) -> List[str]:
-    async with session.get(DECRONYM) as response:
-        if response.status == 200:
-            decronyms = await response.json()
-        else:
-            return []
-
-    if acronym.upper() in decronyms:
-        return decronyms[acronym.upper()]
-    else:
-        return []
+    await acronym_dictionary.ensure_loaded(session)
+    return acronym_dictionary.lookup(acronym)
 
 
 def get_acronym_embed(acronym: str, definitions: List[str]):
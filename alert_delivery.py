@@ -0,0 +1,98 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List
+
+from logbook import Logger
+
+from alert_outbox import OutboxAlert
+from metrics import ALERTS_SENT, ALERT_LATENCY_SECONDS
+
+log = Logger('Alert Delivery')
+
+
+class AlertDelivery:
+    """
+    Sends alerts from the outbox concurrently, up to `concurrency` sends at a time.
+
+    Every channel is its own Discord rate-limit bucket for messages, and
+    discord.py already waits on per-bucket and global limits.  Alerts for the
+    same channel are handed to `send` together, up to `alerts_per_send` at a
+    time, so they can go out in one message instead of each using up the
+    bucket.  Sends to the same channel happen one after another so they queue
+    here in order instead of racing each other for that bucket, while other
+    channels are sent in parallel.
+    """
+
+    def __init__(self, send: Callable[[List[OutboxAlert]], Awaitable[None]], concurrency: int,
+                 alerts_per_send: int = 10, latency_samples: int = 1000):
+        self.send = send
+        self.alerts_per_send = alerts_per_send
+        self.sent = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=latency_samples)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._channel_locks: Dict[str, asyncio.Lock] = {}
+        self._channel_lock_users: Dict[str, int] = {}  # Sends holding or waiting on each channel's lock
+
+    async def deliver(self, alerts: List[OutboxAlert]) -> List[bool]:
+        """
+        Send every alert, recording each one's latency from when it was claimed as due.
+
+        :returns: Whether each alert was sent
+        """
+        started_at = time.time()
+        by_channel: Dict[str, List[int]] = {}
+        for i, alert in enumerate(alerts):
+            by_channel.setdefault(alert.channel, []).append(i)
+        batches = [indexes[start:start + self.alerts_per_send] for indexes in by_channel.values()
+                   for start in range(0, len(indexes), self.alerts_per_send)]
+        batch_results = await asyncio.gather(*(self._deliver([alerts[i] for i in batch]) for batch in batches))
+
+        results = [False] * len(alerts)
+        for batch, sent in zip(batches, batch_results):
+            for i in batch:
+                results[i] = sent
+        if alerts:
+            log.info(f"Delivered {sum(results)}/{len(alerts)} alerts in {len(batches)} sends "
+                     f"in {time.time() - started_at:.2f}s")
+        return results
+
+    async def _deliver(self, alerts: List[OutboxAlert]) -> bool:
+        channel = alerts[0].channel
+        channel_lock = self._channel_locks.setdefault(channel, asyncio.Lock())
+        self._channel_lock_users[channel] = self._channel_lock_users.get(channel, 0) + 1
+        try:
+            async with channel_lock, self._semaphore:
+                log.info(f"[channel={channel}, slugs={','.join(alert.launch for alert in alerts)}] "
+                         f"sending {len(alerts)} alerts")
+                try:
+                    await self.send(alerts)
+                except Exception as e:
+                    self.failed += len(alerts)
+                    ALERTS_SENT.inc(len(alerts), result="failed")
+                    log.exception("Error sending launch alerts: {}".format(e))
+                    return False
+                self.sent += len(alerts)
+                ALERTS_SENT.inc(len(alerts), result="sent")
+                now = time.time()
+                for alert in alerts:
+                    latency = now - alert.claimed_at
+                    self.latencies.append(latency)
+                    ALERT_LATENCY_SECONDS.observe(latency)
+                return True
+        finally:
+            # The lock is unlocked for a moment before the next waiter takes it, so it's kept until nobody uses it
+            self._channel_lock_users[channel] -= 1
+            if not self._channel_lock_users[channel]:
+                del self._channel_lock_users[channel]
+                del self._channel_locks[channel]
+
+    def stats(self) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Collection, Dict, List, Optional
+
+from logbook import Logger
+from redis.exceptions import RedisError, ResponseError
+
+from launch_monitor import LaunchMonitor
+from metrics import OUTBOX_DEPTH, OUTBOX_LAG_SECONDS, OUTBOX_DEAD_LETTERS, OUTBOX_RETRIES
+from redis_utils import db, blocking_db
+from sharding import get_shard_id
+
+OUTBOX_STREAM_KEY = "alert-outbox"  # Legacy single outbox for every shard
+OUTBOX_STREAM_KEY_PREFIX = "alert-outbox"  # One stream per Discord shard
+OUTBOX_GROUP = "alert-delivery"
+OUTBOX_ATTEMPTS_KEY = "alert-outbox-attempts"  # Hash of stream entry id -> failed delivery attempts
+DEAD_LETTERS_KEY = "alert-dead-letters"
+DEAD_LETTERS_MAX = 1000
+
+ALERT = "alert"
+LAUNCH_MOVED = "launch_moved"
+
+log = Logger('Alert Outbox')
+
+
+class OutboxAlert:
+    """An alert waiting in the outbox to be sent to one channel or user."""
+    __slots__ = ("entry_id", "stream_key", "kind", "server", "channel", "launch", "launch_win_open", "alert_time",
+                 "claimed_at", "moved_from")
+
+    def __init__(self, kind: str, server: Optional[str], channel: str, launch: str, launch_win_open: int,
+                 alert_time: int, claimed_at: float, moved_from: int = None, entry_id: str = None,
+                 stream_key: str = None):
+        self.entry_id = entry_id
+        self.stream_key = stream_key  # Outbox the entry was read from
+        self.kind = kind
+        self.server = server
+        self.channel = channel
+        self.launch = launch
+        self.launch_win_open = launch_win_open
+        self.alert_time = alert_time  # Scheduled time of the alert, used to record it as sent
+        self.claimed_at = claimed_at
+        self.moved_from = moved_from  # Window the launch moved from, for LAUNCH_MOVED notices
+
+    @classmethod
+    def from_launch_monitor(cls, lm: LaunchMonitor, kind: str, alert_time: int, claimed_at: float,
+                            moved_from: int = None) -> "OutboxAlert":
+        return cls(kind, lm.server, lm.channel, lm.launch, int(lm.launch_win_open.timestamp()), alert_time, claimed_at,
+                   moved_from)
+
+    def dump(self) -> Dict[str, str]:
+        return {"kind": self.kind, "server": self.server or "", "channel": self.channel, "launch": self.launch,
+                "launch_win_open": self.launch_win_open, "alert_time": self.alert_time,
+                "claimed_at": self.claimed_at, "moved_from": self.moved_from or ""}
+
+    @classmethod
+    def load(cls, entry_id: str, data: Dict[str, str], stream_key: str = None) -> "OutboxAlert":
+        return cls(data["kind"], data["server"] or None, data["channel"], data["launch"], int(data["launch_win_open"]),
+                   int(data["alert_time"]), float(data["claimed_at"]),
+                   int(data["moved_from"]) if data["moved_from"] else None, entry_id, stream_key)
+
+
+def get_outbox_key(shard_id: int) -> str:
+    return "{}-{}".format(OUTBOX_STREAM_KEY_PREFIX, shard_id)
+
+
+def queue_alerts(pipe, alerts: List[OutboxAlert], shard_count: int = 1) -> None:
+    """
+    Queue appending the alerts on a pipeline, so they can be added in the same
+    transaction as other changes.  Each alert goes to the outbox of the shard
+    that owns its guild, which only the processes running that shard read.
+    """
+    for alert in alerts:
+        pipe.xadd(get_outbox_key(get_shard_id(alert.server, shard_count)), alert.dump())
+
+
+async def append_alerts(alerts: List[OutboxAlert], shard_count: int = 1) -> None:
+    if alerts:
+        pipe = db.pipeline()
+        queue_alerts(pipe, alerts, shard_count)
+        await pipe.execute()
+
+
+async def migrate_outbox_to_shards(shard_count: int) -> int:
+    """
+    One-time migration of the alerts left in the single outbox into the shard outboxes.
+
+    :returns: The number of alerts migrated
+    """
+    entries = await db.xrange(OUTBOX_STREAM_KEY)
+    if not entries:
+        return 0
+
+    pipe = db.pipeline()
+    queue_alerts(pipe, [OutboxAlert.load(entry_id, data) for entry_id, data in entries], shard_count)
+    pipe.delete(OUTBOX_STREAM_KEY)
+    await pipe.execute()
+    return len(entries)
+
+
+class AlertOutbox:
+    """
+    Delivers alerts from the outbox streams of the shards one process runs.
+    Every process running a shard reads from the same consumer group, so each
+    alert goes to one of them.  Delivered alerts are acknowledged and deleted.
+    Failed ones stay pending and are claimed again once they've been idle for
+    retry_after seconds, by any process, until max_attempts have failed and
+    they're moved to the dead letter list.
+
+    New alerts are read from every stream in one blocking XREADGROUP on the
+    blocking Redis client, so waiting for them holds one connection however
+    many shards there are.  While a batch is being sent its alerts are claimed
+    again every third of retry_after, so a slow send isn't taken over and
+    sent again by another consumer, or lost if it then fails.
+
+    Only batch_size alerts are read at a time and the next batch waits for
+    the last one to be delivered, so a backlog waits in Redis, where it can be
+    seen, rather than in memory.
+    """
+
+    def __init__(self, deliver: Callable[[List[OutboxAlert]], Awaitable[List[bool]]], consumer: str,
+                 shard_ids: Collection[int] = (0,), batch_size: int = 100, retry_after: float = 60,
+                 max_attempts: int = 5, stats_interval: int = 15, block_ms: Optional[int] = 1000):
+        self.deliver = deliver
+        self.consumer = consumer
+        self.stream_keys = {get_outbox_key(shard_id): shard_id for shard_id in shard_ids}
+        self.batch_size = batch_size
+        self.retry_after = retry_after
+        self.max_attempts = max_attempts
+        self.stats_interval = stats_interval
+        self.block_ms = block_ms  # How long a read waits for new alerts, None to return straight away
+        self.depth = 0
+        self.lag = 0.0
+        self.dead_letters = 0
+        self._stats_updated_at = 0.0
+
+    async def ensure_groups(self) -> None:
+        for stream_key in self.stream_keys:
+            try:
+                await db.xgroup_create(stream_key, OUTBOX_GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def run(self) -> None:
+        await self.ensure_groups()
+        while True:
+            try:
+                await self.process_batch()
+                if time.time() - self._stats_updated_at > self.stats_interval:
+                    await self.update_stats()
+            except RedisError as e:
+                log.error(f"[shards={','.join(map(str, self.stream_keys.values()))}] error reading alert outbox: {e}")
+                await asyncio.sleep(5)
+            except Exception as e:
+                log.exception("Error delivering from alert outbox: {}".format(e))
+                await asyncio.sleep(5)
+
+    async def process_batch(self) -> int:
+        """
+        Delivers one batch, retries first.
+
+        :returns: The number of alerts delivered or attempted
+        """
+        alerts = await self._claim_retries() or await self._read_new()
+        if alerts:
+            await self._deliver(alerts)
+        return len(alerts)
+
+    async def _read_new(self) -> List[OutboxAlert]:
+        streams = await blocking_db.xreadgroup(OUTBOX_GROUP, self.consumer,
+                                               {stream_key: ">" for stream_key in self.stream_keys},
+                                               count=self.batch_size, block=self.block_ms)
+        return [OutboxAlert.load(entry_id, data, stream_key)
+                for stream_key, entries in streams or [] for entry_id, data in entries]
+
+    async def _claim_retries(self) -> List[OutboxAlert]:
+        """Take over alerts that failed, or whose consumer died, retry_after seconds ago."""
+        count = -(-self.batch_size // len(self.stream_keys))  # The batch split between the streams, rounded up
+        pipe = db.pipeline(transaction=False)
+        for stream_key in self.stream_keys:
+            pipe.xautoclaim(stream_key, OUTBOX_GROUP, self.consumer, int(self.retry_after * 1000),
+                            start_id="0-0", count=count)
+        alerts = []
+        for stream_key, entries in zip(self.stream_keys, await pipe.execute()):
+            stream_alerts = [OutboxAlert.load(entry_id, data, stream_key) for entry_id, data in entries if data]
+            if stream_alerts:
+                shard_id = self.stream_keys[stream_key]
+                OUTBOX_RETRIES.inc(len(stream_alerts), shard=shard_id)
+                log.info(f"[shard={shard_id}] retrying {len(stream_alerts)} alerts")
+                alerts += stream_alerts
+        return alerts
+
+    async def _deliver(self, alerts: List[OutboxAlert]) -> None:
+        # Nothing to keep when retries can claim alerts straight away
+        keep_claimed = asyncio.ensure_future(self._keep_claimed(alerts)) if self.retry_after else None
+        try:
+            results = await self.deliver(alerts)
+        finally:
+            if keep_claimed:
+                keep_claimed.cancel()
+
+        sent = [alert for alert, result in zip(alerts, results) if result]
+        failed = [alert for alert, result in zip(alerts, results) if not result]
+        pipe = db.pipeline()
+        for alert in sent:
+            pipe.xack(alert.stream_key, OUTBOX_GROUP, alert.entry_id)
+            pipe.xdel(alert.stream_key, alert.entry_id)
+            pipe.hdel(OUTBOX_ATTEMPTS_KEY, alert.entry_id)
+        for alert in failed:
+            pipe.hincrby(OUTBOX_ATTEMPTS_KEY, alert.entry_id, 1)
+        # The failed attempt counts come last
+        attempts = (await pipe.execute())[len(sent) * 3:]
+
+        dead = [alert for alert, attempt in zip(failed, attempts) if attempt >= self.max_attempts]
+        if dead:
+            await self._dead_letter(dead)
+
+    async def _keep_claimed(self, alerts: List[OutboxAlert]) -> None:
+        """Resets the idle time of alerts being sent, so _claim_retries elsewhere leaves them alone."""
+        entry_ids: Dict[str, List[str]] = {}
+        for alert in alerts:
+            entry_ids.setdefault(alert.stream_key, []).append(alert.entry_id)
+        while True:
+            await asyncio.sleep(self.retry_after / 3)
+            pipe = db.pipeline(transaction=False)
+            for stream_key, stream_entry_ids in entry_ids.items():
+                pipe.xclaim(stream_key, OUTBOX_GROUP, self.consumer, 0, stream_entry_ids, justid=True)
+            try:
+                await pipe.execute()
+            except RedisError as e:
+                log.warning(f"Couldn't keep {len(alerts)} alerts being sent claimed: {e}")
+
+    async def _dead_letter(self, alerts: List[OutboxAlert]) -> None:
+        pipe = db.pipeline()
+        for alert in alerts:
+            log.error(f"[channel={alert.channel}, slug={alert.launch}] giving up on alert after "
+                      f"{self.max_attempts} attempts")
+            pipe.lpush(DEAD_LETTERS_KEY, json.dumps({"entry_id": alert.entry_id, "failed_at": int(time.time()),
+                                                     **alert.dump()}))
+            pipe.xack(alert.stream_key, OUTBOX_GROUP, alert.entry_id)
+            pipe.xdel(alert.stream_key, alert.entry_id)
+            pipe.hdel(OUTBOX_ATTEMPTS_KEY, alert.entry_id)
+        pipe.ltrim(DEAD_LETTERS_KEY, 0, DEAD_LETTERS_MAX - 1)
+        await pipe.execute()
+
+    async def update_stats(self) -> None:
+        pipe = db.pipeline(transaction=False)
+        for stream_key in self.stream_keys:
+            pipe.xlen(stream_key)
+            pipe.xrange(stream_key, "-", "+", count=1)
+        pipe.llen(DEAD_LETTERS_KEY)
+        *stream_stats, self.dead_letters = await pipe.execute()
+        now = time.time()
+        self.depth, self.lag = 0, 0.0
+        for i, shard_id in enumerate(self.stream_keys.values()):
+            depth, oldest = stream_stats[i * 2:i * 2 + 2]
+            # Entry ids start with the millisecond they were added, so the oldest one shows how far behind delivery is
+            lag = max(now - int(oldest[0][0].split("-")[0]) / 1000, 0.0) if oldest else 0.0
+            self.depth += depth
+            self.lag = max(self.lag, lag)
+            OUTBOX_DEPTH.set(depth, shard=shard_id)
+            OUTBOX_LAG_SECONDS.set(lag, shard=shard_id)
+        self._stats_updated_at = now
+        OUTBOX_DEAD_LETTERS.set(self.dead_letters)
+
+    def stats(self) -> Dict[str, float]:
+        return {"depth": self.depth, "lag": round(self.lag, 2), "dead_letters": self.dead_letters}
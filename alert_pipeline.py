@@ -0,0 +1,277 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+import pytz
+from logbook import Logger
+
+from alert_outbox import OutboxAlert, ALERT, queue_alerts
+from config import ChannelConfig, UserConfig, get_alert_subscriber_keys
+from launch import Launch
+from launch_monitor import LaunchMonitor
+from launch_monitor_utils import get_stored_launch_monitors, save_launch_monitors, get_launch_monitor_field, \
+    get_stored_due_times, get_due_launch_monitors, get_launch_monitors, get_due_times
+from launch_sync import LaunchDiff, diff_launches, get_known_launches, save_known_launches, get_moved_seconds, \
+    merge_diffs
+from metrics import ALERTS_DUE
+from partitions import all_partitions, get_subscriber_partition
+from redis_utils import db
+from utils import get_config_from_db_key
+
+log = Logger('Alert Pipeline')
+
+# Reconciling and claiming due alerts both read-modify-write the launch monitors
+launch_monitors_lock = asyncio.Lock()
+# Set whenever due times change so the alert scheduler can re-check the earliest one
+schedule_changed = asyncio.Event()
+
+
+def get_due_time(lm: LaunchMonitor) -> Optional[int]:
+    next_alert_datetime = lm.next_alert_datetime
+    if next_alert_datetime:
+        return int(next_alert_datetime.timestamp())
+
+
+async def save_launch_alerts(upcoming_launches: List[Launch], partitions: Collection[int] = None) -> int:
+    """
+    Get all configurations with launch alerts turned on.  Update with last alert times and save to DB.
+
+    :param partitions: Only reconcile the monitors in these partitions, all of them if None
+    :returns: The number of launch monitors reconciled
+    """
+    launch_win_opens = []
+    for upcoming_launch in upcoming_launches:
+        if upcoming_launch.win_open:
+            launch_win_opens.append((upcoming_launch.slug, int(upcoming_launch.win_open.timestamp())))
+
+    async with launch_monitors_lock:
+        # Index stored monitors by hash field so each new monitor is matched in O(1)
+        current_lms = await get_stored_launch_monitors(partitions)
+        current_due_times = await get_stored_due_times(partitions)
+
+        launch_monitors_to_save = {}
+        due_times = {}
+        for key in await get_alert_subscriber_keys():
+            if partitions is not None and get_subscriber_partition(key) not in partitions:
+                continue
+            if key.startswith(ChannelConfig.KEY_PREFIX) or key.startswith(UserConfig.KEY_PREFIX):
+                config = await get_config_from_db_key(str(key))
+                if config.receive_alerts == "true":
+                    server = config.server_id if hasattr(config, "server_id") else None
+                    channel = config.channel_id if hasattr(config, "channel_id") else config.user_id
+                    for launch_slug, launch_win_open in launch_win_opens:
+                        field = get_launch_monitor_field(channel, launch_slug)
+                        current_lm = current_lms.get(field)
+
+                        # Create clean list for all launch monitors, keeping last_alert from the times in the DB
+                        new_lm = LaunchMonitor()
+                        new_lm.load_compact([server, channel, launch_slug, launch_win_open,
+                                             current_lm[4] if current_lm else None], config.alert_times)
+                        launch_monitors_to_save[field] = new_lm.dump_compact()
+                        due_times[field] = get_due_time(new_lm)
+        changed = await save_launch_monitors(launch_monitors_to_save, current_lms, due_times, current_due_times)
+
+    log.info(f"Saved {changed} changed launch monitors")
+    if changed:
+        schedule_changed.set()
+    return len(launch_monitors_to_save)
+
+
+async def reconcile_launch_monitors(subscriber_keys: Iterable[str], launches: List[Launch],
+                                    removed_slugs: Iterable[str] = ()) -> Tuple[int, List[LaunchMonitor]]:
+    """
+    Like save_launch_alerts, but only for the monitors of the given subscribers
+    and launches.  Monitors for subscribers that no longer receive alerts, for
+    launches without a window and for removed_slugs are deleted.
+
+    :returns: The number of monitors and due times changed, and the monitors that were saved
+    """
+    slugs = [launch.slug for launch in launches] + list(removed_slugs)
+    async with launch_monitors_lock:
+        configs = [await get_config_from_db_key(str(key)) for key in subscriber_keys]
+        fields = [get_launch_monitor_field(config.channel_id if hasattr(config, "channel_id") else config.user_id, slug)
+                  for config in configs for slug in slugs]
+        current_lms = await get_launch_monitors(fields)
+        current_due_times = await get_due_times(fields)
+
+        launch_monitors_to_save = {}
+        due_times = {}
+        lms = []
+        for config in configs:
+            if config.receive_alerts != "true":
+                continue
+            server = config.server_id if hasattr(config, "server_id") else None
+            channel = config.channel_id if hasattr(config, "channel_id") else config.user_id
+            for launch in launches:
+                if not launch.win_open:
+                    continue
+                field = get_launch_monitor_field(channel, launch.slug)
+                current_lm = current_lms.get(field)
+                lm = LaunchMonitor()
+                lm.load_compact([server, channel, launch.slug, int(launch.win_open.timestamp()),
+                                 current_lm[4] if current_lm else None], config.alert_times)
+                launch_monitors_to_save[field] = lm.dump_compact()
+                due_times[field] = get_due_time(lm)
+                lms.append(lm)
+        changed = await save_launch_monitors(launch_monitors_to_save, current_lms, due_times, current_due_times)
+
+    if changed:
+        schedule_changed.set()
+    return changed, lms
+
+
+class LaunchMonitorSync:
+    """
+    Keeps launch monitors in step with the upcoming launches by diffing them
+    against the launches seen last time, so a tick only touches the monitors
+    of launches that were added, removed or moved, and of subscribers whose
+    config changed.  Everything is rebuilt with save_launch_alerts on the first
+    run, when config changes may have been missed, when the partitions this
+    process owns change, and every full_reconcile_interval seconds as a
+    safety net.
+
+    The launches seen last time are kept per partition in Redis, so a process
+    that restarts or takes over a partition still notices moves that the
+    partition's subscribers haven't been told about.
+    """
+
+    def __init__(self, full_reconcile_interval: int, moved_notify_seconds: int):
+        self.full_reconcile_interval = full_reconcile_interval
+        self.moved_notify_seconds = moved_notify_seconds
+        self.known_launches: Dict[int, Dict[str, Launch]] = {}  # Partition -> slug -> launch, loaded as needed
+        self.changed_subscribers: Set[str] = set()
+        self.full_reconcile_needed = True
+        self.full_reconciled_at = 0.0
+        self.partitions: Optional[Set[int]] = None  # All of them
+
+    def set_partitions(self, partitions: Collection[int]) -> None:
+        """Only sync the monitors in these partitions from now on."""
+        self.partitions = set(partitions)
+        self.full_reconcile_needed = True
+        # Partitions that were released may be changed by another process before they come back
+        self.known_launches = {partition: known_launches for partition, known_launches in self.known_launches.items()
+                               if partition in self.partitions}
+
+    def _owns(self, key_name: str) -> bool:
+        return self.partitions is None or get_subscriber_partition(key_name) in self.partitions
+
+    def config_changed(self, key_name: Optional[str]) -> None:
+        """Called with the DB key of every changed config, or None if changes may have been missed."""
+        if key_name is None:
+            self.full_reconcile_needed = True
+        elif key_name.startswith(ChannelConfig.KEY_PREFIX) or key_name.startswith(UserConfig.KEY_PREFIX):
+            self.changed_subscribers.add(key_name)
+
+    async def sync(self, upcoming_launches: List[Launch]) \
+            -> Tuple[LaunchDiff, List[Tuple[LaunchMonitor, Optional[int]]]]:
+        """
+        :returns: What changed in the upcoming launches in any partition, and the
+                  monitors of launches that moved far enough to notify their
+                  subscribers, with the epoch each one's window moved from
+        """
+        partitions = all_partitions() if self.partitions is None else sorted(self.partitions)
+        if not partitions:
+            return LaunchDiff([], [], [], []), []
+        unloaded = [partition for partition in partitions if partition not in self.known_launches]
+        if unloaded:
+            self.known_launches.update(await get_known_launches(unloaded))
+        diffs = {partition: diff_launches(self.known_launches[partition], upcoming_launches)
+                 for partition in partitions}
+        full_reconcile = (self.full_reconcile_needed
+                          or not all(self.known_launches[partition] for partition in partitions)
+                          or time.time() - self.full_reconciled_at > self.full_reconcile_interval)
+
+        # Partitions are usually all in step, so their monitors are reconciled together
+        partitions_by_change = {}
+        for partition, diff in diffs.items():
+            # With nothing to compare against, nothing has moved
+            if self.known_launches[partition] and (diff.added or diff.moved or diff.removed):
+                change = (tuple(launch.slug for launch in diff.added),
+                          tuple((new.slug, old.win_open, new.win_open) for old, new in diff.moved),
+                          tuple(launch.slug for launch in diff.removed))
+                partitions_by_change.setdefault(change, []).append(partition)
+
+        moved = []
+        if partitions_by_change:
+            subscriber_keys = await get_alert_subscriber_keys()
+            for changed_partitions in partitions_by_change.values():
+                diff = diffs[changed_partitions[0]]
+                changed_launches = diff.added + [new for _, new in diff.moved]
+                partition_subscriber_keys = [key for key in subscriber_keys
+                                             if get_subscriber_partition(key) in changed_partitions]
+                _, lms = await reconcile_launch_monitors(partition_subscriber_keys, changed_launches,
+                                                         [launch.slug for launch in diff.removed])
+                moved_from = {new.slug: int(old.win_open.timestamp()) if old.win_open else None
+                              for old, new in diff.moved if self._is_notable_move(old, new)}
+                moved += [(lm, moved_from[lm.launch]) for lm in lms if lm.launch in moved_from]
+
+        changed_subscribers = [key for key in self.changed_subscribers if self._owns(key)]
+        self.changed_subscribers = set()
+        if full_reconcile:
+            self.full_reconcile_needed = False
+            self.full_reconciled_at = time.time()
+            await save_launch_alerts(upcoming_launches, self.partitions)
+        elif changed_subscribers:
+            await reconcile_launch_monitors(changed_subscribers, upcoming_launches)
+
+        changed_diffs = {partition: diff for partition, diff in diffs.items() if diff}
+        diff = merge_diffs(changed_diffs.values())
+        if changed_diffs:
+            await save_known_launches(changed_diffs)
+            for partition in changed_diffs:
+                self.known_launches[partition] = {launch.slug: launch for launch in upcoming_launches}
+            log.info(f"Synced upcoming launches: {diff}")
+        return diff, moved
+
+    def _is_notable_move(self, old: Launch, new: Launch) -> bool:
+        moved_seconds = get_moved_seconds(old.win_open, new.win_open)
+        if moved_seconds is None or new.win_open < datetime.now(pytz.utc):
+            return False
+        return abs(moved_seconds) >= self.moved_notify_seconds
+
+
+async def claim_due_launch_alerts(partitions: Collection[int] = None, shard_count: int = 1) -> List[OutboxAlert]:
+    """
+    Get the launch monitors with an alert due now, schedule their next alert and
+    append the due alerts to the outbox.  Only due monitors are loaded.  The
+    monitors are saved and the alerts appended in one transaction, so an alert
+    is never marked as done without being queued for delivery.
+
+    :param partitions: Only claim monitors in these partitions, all of them if None
+    :param shard_count: Number of Discord shards, each alert goes to the outbox of its guild's shard
+    :returns: The alerts appended to the outbox
+    """
+    now = datetime.now(pytz.utc)
+    alerts = []
+    async with launch_monitors_lock:
+        due_lms, current_due_times = await get_due_launch_monitors(int(now.timestamp()), partitions)
+        launch_monitors_to_save = {}
+        due_times = {}
+        for field, launch_monitor in due_lms.items():
+            if launch_monitor is None:
+                due_times[field] = None
+                continue
+            server, channel = launch_monitor[0], launch_monitor[1]
+            if server:
+                config = await ChannelConfig.create(server, channel)
+            else:
+                config = await UserConfig.create(channel)
+
+            lm = LaunchMonitor()
+            lm.load_compact(launch_monitor, config.alert_times)
+            if lm.is_alert_due():
+                lm.last_alert = now
+                launch_monitors_to_save[field] = lm.dump_compact()
+                alert_time = int((lm.last_alert_datetime or lm.last_alert).timestamp())
+                alerts.append(OutboxAlert.from_launch_monitor(lm, ALERT, alert_time, now.timestamp()))
+            # Alert times may have changed since the monitor was scheduled
+            due_times[field] = get_due_time(lm)
+
+        pipe = db.pipeline()
+        await save_launch_monitors(launch_monitors_to_save, {}, due_times, current_due_times, pipe=pipe)
+        queue_alerts(pipe, alerts, shard_count)
+        await pipe.execute()
+
+    ALERTS_DUE.inc(len(alerts))
+    return alerts
@@ -0,0 +1,209 @@
+"""
+Offline benchmark of one alert tick at scale.
+
+Runs against an in-process fakeredis server and synthetic rocketlaunch.live
+payloads, so it needs no Redis, Discord or network access.  For each size it
+stores that many channel and user configs with alerts turned on, then times
+each stage of the alert pipeline and reports throughput, Redis round-trips
+and peak Python memory.  Use --json to save results and compare commits.
+
+    python bench_alerts.py --sizes 1000 10000 100000 --launches 5 --json bench_output.json
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pytz
+from logbook import NullHandler
+
+import redis_utils
+from alert_pipeline import LaunchMonitorSync, save_launch_alerts, claim_due_launch_alerts
+from config import ALERT_SUBSCRIBERS_KEY, ChannelConfig, UserConfig, config_cache
+from fake_redis import use_fake_redis
+from launch import Launch
+from launch_monitor import LaunchMonitor
+from launch_monitor_utils import get_stored_launch_monitors
+from utils import get_launch_embed, launch_embed_cache
+
+SERVER_ID = "360523650912223253"
+
+
+def get_api_launch(number: int, win_open: datetime) -> dict:
+    return {
+        "slug": f"bench-launch-{number}",
+        "name": f"Bench Launch {number}",
+        "t0": None,
+        "win_open": win_open.strftime("%Y-%m-%dT%H:%MZ"),
+        "date_str": win_open.strftime("%b %d"),
+        "media": [{"ldfeatured": True, "media_url": None, "youtube_vidid": f"video{number}"}],
+        "missions": [{"name": f"Bench Mission {number}", "description": "Synthetic launch for benchmarks"}],
+        "vehicle": {"id": number, "name": "Falcon 9"},
+        "provider": {"name": "SpaceX", "slug": "spacex"},
+        "pad": {"name": "SLC-40", "location": {"name": "Cape Canaveral SFS"}},
+    }
+
+
+def get_api_launches(launches: int) -> List[dict]:
+    """The first launch is 30 minutes out, so every subscriber has an alert due for it."""
+    now = datetime.now(pytz.utc)
+    return [get_api_launch(number, now + timedelta(minutes=30) + timedelta(hours=6 * number))
+            for number in range(launches)]
+
+
+def store_configs(subscribers: int) -> None:
+    """Half channel configs and half user configs, all with alerts turned on."""
+    pipe = redis_utils.sync_db.pipeline(transaction=False)
+    for subscriber in range(subscribers):
+        if subscriber % 2:
+            key_name = "{}-{}-{}".format(ChannelConfig.KEY_PREFIX, SERVER_ID, subscriber)
+        else:
+            key_name = "{}-{}".format(UserConfig.KEY_PREFIX, subscriber)
+        pipe.set(key_name, json.dumps({"receive_alerts": "true"}))
+        pipe.sadd(ALERT_SUBSCRIBERS_KEY, key_name)
+    pipe.execute()
+
+
+class Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.items = 0
+        self.round_trips = 0
+
+    def __enter__(self):
+        self._round_trips = redis_utils.db.round_trips
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        self.round_trips = redis_utils.db.round_trips - self._round_trips
+
+    def result(self) -> Dict:
+        return {
+            "seconds": round(self.seconds, 4),
+            "items": self.items,
+            "items_per_second": round(self.items / self.seconds) if self.seconds else None,
+            "redis_round_trips": self.round_trips,
+        }
+
+
+async def run_tick(subscribers: int, launches: int) -> Dict[str, Stage]:
+    use_fake_redis()
+    config_cache.clear()
+    launch_embed_cache.clear()
+    store_configs(subscribers)
+    api_launches = get_api_launches(launches)
+
+    stages = {}
+    with Stage("parse launches") as stage:
+        upcoming_launches = [Launch.from_api(api_launch) for api_launch in api_launches]
+        stage.items = len(upcoming_launches)
+    stages[stage.name] = stage
+
+    with Stage("reconcile (cold)") as stage:
+        stage.items = await save_launch_alerts(upcoming_launches)
+    stages[stage.name] = stage
+
+    with Stage("reconcile (steady)") as stage:
+        stage.items = await save_launch_alerts(upcoming_launches)
+    stages[stage.name] = stage
+
+    launch_monitor_sync = LaunchMonitorSync(full_reconcile_interval=3600, moved_notify_seconds=900)
+    await launch_monitor_sync.sync(upcoming_launches)
+    with Stage("sync (steady)") as stage:
+        diff, _ = await launch_monitor_sync.sync(upcoming_launches)
+        stage.items = len(diff.added) + len(diff.removed) + len(diff.moved) + len(diff.updated)
+    stages[stage.name] = stage
+
+    moved_launches = [Launch.from_api(api_launch) for api_launch in api_launches]
+    moved_launches[-1].win_open += timedelta(hours=1)
+    with Stage("sync (one launch moved)") as stage:
+        _, moved_lms = await launch_monitor_sync.sync(moved_launches)
+        stage.items = len(moved_lms)
+    stages[stage.name] = stage
+    await launch_monitor_sync.sync(upcoming_launches)
+
+    stored_lms = [lm for lm in (await get_stored_launch_monitors()).values() if lm]
+    with Stage("monitor load + is_alert_due") as stage:
+        for stored_lm in stored_lms:
+            lm = LaunchMonitor()
+            lm.load_compact(stored_lm, "24h, 12h, 6h, 3h, 1h, 15m")
+            lm.is_alert_due()
+        stage.items = len(stored_lms)
+    stages[stage.name] = stage
+
+    with Stage("claim due") as stage:
+        due_alerts = await claim_due_launch_alerts()
+        stage.items = len(due_alerts)
+    stages[stage.name] = stage
+
+    launches_by_slug = {launch.slug: launch for launch in upcoming_launches}
+    with Stage("render embeds") as stage:
+        for alert in due_alerts:
+            get_launch_embed(launches_by_slug[alert.launch], "UTC")
+        stage.items = len(due_alerts)
+    stages[stage.name] = stage
+
+    tick = Stage("tick (steady sync + claim + render)")
+    for name in ("sync (steady)", "claim due", "render embeds"):
+        tick.seconds += stages[name].seconds
+        tick.round_trips += stages[name].round_trips
+    tick.items = stages["claim due"].items
+    stages[tick.name] = tick
+    return stages
+
+
+async def measure_peak_memory(subscribers: int, launches: int) -> int:
+    tracemalloc.start()
+    await run_tick(subscribers, launches)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main(sizes: List[int], launches: int, memory: bool) -> Dict:
+    results = {"commit": get_commit(), "launches": launches, "sizes": {}}
+    for subscribers in sizes:
+        stages = await run_tick(subscribers, launches)
+        size_results = {"stages": {name: stage.result() for name, stage in stages.items()}}
+        if memory:
+            size_results["peak_memory_bytes"] = await measure_peak_memory(subscribers, launches)
+        results["sizes"][subscribers] = size_results
+
+        print(f"\n{subscribers} subscribers x {launches} launches")
+        print(f"{'stage':<42}{'seconds':>10}{'items':>10}{'items/s':>12}{'redis':>8}")
+        for name, result in size_results["stages"].items():
+            print(f"{name:<42}{result['seconds']:>10.3f}{result['items']:>10}"
+                  f"{result['items_per_second'] or 0:>12}{result['redis_round_trips']:>8}")
+        if memory:
+            print(f"peak memory: {size_results['peak_memory_bytes'] / 1024 / 1024:.1f} MiB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Numbers of subscribers to benchmark")
+    parser.add_argument("--launches", type=int, default=5, help="Number of upcoming launches")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the slower traced run for peak memory")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    with NullHandler().applicationbound():
+        bench_results = asyncio.run(main(args.sizes, args.launches, not args.no_memory))
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(bench_results, json_file, indent=2)
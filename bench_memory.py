@@ -0,0 +1,53 @@
+"""
+Memory and allocation benchmark for the objects built on every alert tick.
+
+Builds one config per subscriber and one launch monitor per subscriber and
+launch, the same as save_launch_alerts, and reports what they allocate.
+Needs no Redis or network access.
+
+    python bench_memory.py [subscribers] [launches]
+"""
+import sys
+import time
+import tracemalloc
+
+from config import ChannelConfig
+from launch_monitor import LaunchMonitor
+
+ALERT_TIMES = "24h, 12h, 6h, 3h, 1h, 15m"
+
+
+def build_objects(subscribers: int, launches: int) -> list:
+    objects = []
+    for subscriber in range(subscribers):
+        config = ChannelConfig("360523650912223253", str(subscriber), load=False)
+        config._load_config_data({"receive_alerts": "true"})
+        objects.append(config)
+        for launch in range(launches):
+            lm = LaunchMonitor()
+            lm.load_compact(["360523650912223253", str(subscriber), f"launch-{launch}", 1518444000 + launch * 3600,
+                             None], config.alert_times)
+            objects.append(lm)
+            # Touch the options the alert loop reads
+            config.receive_alerts, config.alert_times
+    return objects
+
+
+def main(subscribers: int = 10000, launches: int = 5) -> None:
+    start = time.perf_counter()
+    build_objects(subscribers, launches)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    objects = build_objects(subscribers, launches)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"subscribers={subscribers} launches={launches} objects={len(objects)}")
+    print(f"build time: {elapsed:.3f}s")
+    print(f"retained: {current / 1024 / 1024:.2f} MiB ({current / len(objects):.0f} B/object)")
+    print(f"peak: {peak / 1024 / 1024:.2f} MiB")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import OrderedDict
+from json import loads, dumps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from logbook import Logger
+from redis.exceptions import RedisError
+
+from redis_utils import db
+
+log = Logger('Cache Utils')
+
+
+class LRUCache:
+    """Least recently used cache with hit and miss counters.  None values aren't cached."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: Any) -> Any:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Any) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class AsyncTTLCache:
+    """
+    TTL cache for upstream data with request coalescing.  Concurrent callers
+    for the same key share one in-flight fetch, and entries older than ttl but
+    younger than stale_ttl are served while a single background fetch
+    refreshes them.  If redis_prefix is set, entries are also shared through
+    Redis so other processes and restarts start warm.
+    """
+
+    def __init__(self, ttl: int, stale_ttl: int, redis_prefix: Optional[str] = None, max_size: int = 1000,
+                 encode: Callable[[Any], Any] = None, decode: Callable[[Any], Any] = None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.redis_prefix = redis_prefix
+        # Convert values to and from something JSON serializable for Redis
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self.max_size = max_size
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[Any, float]] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is None and self.redis_prefix:
+            entry = await self._get_from_redis(key)
+
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if age < self.stale_ttl:
+                self.stale_hits += 1
+                self._start_fetch(key, fetch)
+                return value
+
+        self.misses += 1
+        # Shield so one caller being cancelled doesn't cancel the fetch for everyone else
+        return await asyncio.shield(self._start_fetch(key, fetch))
+
+    def peek(self, key: str) -> Any:
+        """Returns the cached value regardless of age, without fetching."""
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key: str, value: Any, fetched_at: float = None) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (value, fetched_at or time.time())
+        if len(self._entries) > self.max_size:
+            # Dicts keep insertion order, so the first key is the least recently fetched
+            del self._entries[next(iter(self._entries))]
+
+    async def warm(self, keys: List[str]) -> int:
+        """
+        Loads the entries for keys that are shared through Redis in one
+        round-trip, so the first gets after a restart don't each wait on one.
+
+        :returns: The number of entries loaded
+        """
+        keys = keys[:self.max_size]
+        if not self.redis_prefix or not keys:
+            return 0
+        try:
+            db_datas = await db.mget([self.redis_prefix + key for key in keys])
+        except RedisError as e:
+            log.warning(f"Error warming cache from Redis: {e}")
+            return 0
+        loaded, unreadable = 0, []
+        for key, db_data in zip(keys, db_datas):
+            if db_data:
+                if self._put_from_redis(key, db_data):
+                    loaded += 1
+                else:
+                    unreadable.append(key)
+        if unreadable:
+            await self._delete_from_redis(unreadable)
+        return loaded
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses}
+
+    def _start_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            task.add_done_callback(lambda t: self._log_fetch_error(key, t))
+            self._in_flight[key] = task
+        return task
+
+    @staticmethod
+    def _log_fetch_error(key: str, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            log.warning(f"[key={key}] error fetching value: {task.exception()}")
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+            if value is not None:
+                self.put(key, value)
+                if self.redis_prefix:
+                    await self._set_on_redis(key, value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    async def _get_from_redis(self, key: str) -> Optional[Tuple[Any, float]]:
+        try:
+            db_data = await db.get(self.redis_prefix + key)
+        except RedisError as e:
+            log.warning(f"[key={key}] error reading cache from Redis: {e}")
+            return None
+        if not db_data:
+            return None
+        entry = self._put_from_redis(key, db_data)
+        if entry is None:
+            await self._delete_from_redis([key])
+        return entry
+
+    def _put_from_redis(self, key: str, db_data: str) -> Optional[Tuple[Any, float]]:
+        """Puts an entry read from Redis in the cache, or returns None if it can't be decoded."""
+        try:
+            cached = loads(db_data)
+            value = self.decode(cached["value"])
+            fetched_at = float(cached["fetched_at"])
+        except (ValueError, KeyError, TypeError) as e:
+            # Written in an older format, it'll be fetched again
+            log.warning(f"[key={key}] unreadable cache entry in Redis: {e!r}")
+            return None
+        self.put(key, value, fetched_at)
+        return value, fetched_at
+
+    async def _delete_from_redis(self, keys: List[str]) -> None:
+        try:
+            await db.delete(*(self.redis_prefix + key for key in keys))
+        except RedisError as e:
+            log.warning(f"Error deleting cache entries from Redis: {e}")
+
+    async def _set_on_redis(self, key: str, value: Any) -> None:
+        entry = dumps({"value": self.encode(value), "fetched_at": time.time()})
+        try:
+            await db.set(self.redis_prefix + key, entry, ex=self.stale_ttl)
+        except RedisError as e:
+            log.warning(f"[key={key}] error writing cache to Redis: {e}")
@@ -1,83 +1,196 @@
+import asyncio
 from json import loads, dumps
+from typing import Callable, Dict, Optional, Set, Tuple
+
 import discord
-import redis
-from local_config import DEFAULT_BOT_PREFIX, EMBED_EXPIRE_SECONDS
+from logbook import Logger
+from redis.exceptions import RedisError
+
+from cache_utils import LRUCache
+from local_config import DEFAULT_BOT_PREFIX, EMBED_EXPIRE_SECONDS, CONFIG_CACHE_SIZE
+from redis_utils import db, sync_db, blocking_db, blocking_sync_db
+
+ALERT_SUBSCRIBERS_KEY = "alert-subscribers"
+ALERT_SUBSCRIBERS_MIGRATED_KEY = "alert-subscribers-migrated"
+CONFIG_INVALIDATION_CHANNEL = "config-invalidation"
+
+log = Logger('Config')
+
+
+class ConfigCache(LRUCache):
+    """
+    Process-wide LRU cache of parsed config data, keyed by DB key name.
+    Entries are dropped when any bot process publishes a change to the key.
+
+    A read from the DB can race with the invalidation of what it read, so
+    loaded values are put with put_if_unchanged, which skips them if the key
+    was invalidated since generation() was taken before the read.
+    """
+
+    def __init__(self, max_size: int):
+        super().__init__(max_size)
+        self._epoch = 0  # Bumped by clear
+        self._generations: Dict[str, int] = {}  # Bumped by invalidate
+
+    def generation(self, key: str) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(key, 0)
+
+    def put_if_unchanged(self, key: str, value: dict, generation: Tuple[int, int]) -> bool:
+        if self.generation(key) != generation:
+            return False
+        self.put(key, value)
+        return True
+
+    def invalidate(self, key: str) -> None:
+        super().invalidate(key)
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self) -> None:
+        super().clear()
+        self._epoch += 1
+        self._generations.clear()
+
+
+config_cache = ConfigCache(CONFIG_CACHE_SIZE)
 
-redis_db = redis.StrictRedis(host='localhost', charset="utf-8", decode_responses=True)  # TODO: Make DB configurable in local_config
+
+class UnknownConfigOption(AttributeError):
+    """Raised for an option name that isn't in the config's CONFIG_ITEMS."""
 
 
 class ConfigItem:
+    __slots__ = ("name", "default", "help_text")
+
     def __init__(self, name, default, help_text):
         self.name = name
         self.default = default
         self.help_text = help_text
-        self.value = self.default
-
-    def get_key_value(self):
-        return {self.name: self.value}
 
 
 class Config:
-    def __init__(self):
-        self._config_items = self._get_config_items()
-        self._get_config_from_db()
+    """
+    Options are described once per class in CONFIG_ITEMS.  Each instance only
+    holds a dict of the values that were set, which may be shared with the
+    config cache, so it is replaced rather than modified when an option changes.
+    """
+    __slots__ = ("_values",)
+    CONFIG_ITEMS: Tuple[ConfigItem, ...] = ()
+    _CONFIG_ITEMS_BY_NAME: Dict[str, ConfigItem] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._CONFIG_ITEMS_BY_NAME = {config_item.name: config_item for config_item in cls.CONFIG_ITEMS}
+
+    def __init__(self, load: bool = True):
+        self._values = {}
+        if load:
+            self._get_config_from_db()
+
+    @classmethod
+    async def create(cls, *args):
+        """Build a config and load it from the DB without blocking the event loop."""
+        config = cls(*args, load=False)
+        await config._async_get_config_from_db()
+        return config
 
     def _get_config_from_db(self):
         key_name = self._get_db_key_name()
-        db_data = redis_db.get(key_name)
-        if db_data:
-            config_in_db = loads(db_data)
-            for config_item in self._config_items:
-                if config_item.name in config_in_db:
-                    config_item.value = config_in_db[config_item.name]
+        config_in_db = config_cache.get(key_name)
+        if config_in_db is None:
+            generation = config_cache.generation(key_name)
+            db_data = sync_db.get(key_name)
+            config_in_db = loads(db_data) if db_data else {}
+            config_cache.put_if_unchanged(key_name, config_in_db, generation)
+        self._load_config_data(config_in_db)
+
+    async def _async_get_config_from_db(self):
+        key_name = self._get_db_key_name()
+        config_in_db = config_cache.get(key_name)
+        if config_in_db is None:
+            generation = config_cache.generation(key_name)
+            db_data = await db.get(key_name)
+            config_in_db = loads(db_data) if db_data else {}
+            config_cache.put_if_unchanged(key_name, config_in_db, generation)
+        self._load_config_data(config_in_db)
+
+    def _load_config_data(self, config_in_db: dict):
+        self._values = config_in_db
 
     def _set_config_on_db(self):
+        pipe = sync_db.pipeline()
+        config_items_list = self._queue_config_on_db(pipe)
+        pipe.execute()
+        config_cache.put(self._get_db_key_name(), config_items_list)
+
+    async def _async_set_config_on_db(self):
+        pipe = db.pipeline()
+        config_items_list = self._queue_config_on_db(pipe)
+        await pipe.execute()
+        config_cache.put(self._get_db_key_name(), config_items_list)
+
+    def _queue_config_on_db(self, pipe) -> dict:
         config_items_list = {}
-        for config_item in self._config_items:
-            if config_item.value != config_item.default:
-                config_items_list[config_item.name] = config_item.value
+        for config_item in self.CONFIG_ITEMS:
+            value = self._values.get(config_item.name, config_item.default)
+            if value != config_item.default:
+                config_items_list[config_item.name] = value
 
         key_name = self._get_db_key_name()
-        redis_db.set(key_name, dumps(config_items_list))
+        pipe.set(key_name, dumps(config_items_list))
+        if self.receive_alerts == "true":
+            pipe.sadd(ALERT_SUBSCRIBERS_KEY, key_name)
+        else:
+            pipe.srem(ALERT_SUBSCRIBERS_KEY, key_name)
+        pipe.publish(CONFIG_INVALIDATION_CHANNEL, key_name)
+        return config_items_list
 
     def _get_db_key_name(self):
         raise NotImplementedError
 
-    def _get_config_items(self):
-        raise NotImplementedError
-
     def _get_embed_key_name(self) -> str:
         return "embed-" + self._get_db_key_name()
 
     def _get_config_item_from_str(self, item):
-        if "_config_items" in self.__dict__:
-            for config_item in self._config_items:
-                if config_item.name == item.lower():
-                    return config_item
+        return self._CONFIG_ITEMS_BY_NAME.get(item) or self._CONFIG_ITEMS_BY_NAME.get(item.lower())
 
-        return None
+    def _set_value(self, config_item, value):
+        values = dict(self._values)
+        values[config_item.name] = value
+        self._values = values
 
     def __getattr__(self, item):
         config_item = self._get_config_item_from_str(item)
         if config_item is not None:
-            return config_item.value
-        raise AttributeError
+            return self._values.get(config_item.name, config_item.default)
+        raise UnknownConfigOption(item)
 
     def __setattr__(self, item, value):
         config_item = self._get_config_item_from_str(item)
         if config_item is None:
-            self.__dict__[item] = value
+            try:
+                object.__setattr__(self, item, value)  # Slots like _values
+            except AttributeError:
+                raise UnknownConfigOption(item) from None
             return
 
-        config_item.value = value
+        self._set_value(config_item, value)
         self._set_config_on_db()
 
+    async def set_option(self, item, value):
+        """Awaitable version of setting an option as an attribute."""
+        config_item = self._get_config_item_from_str(item)
+        if config_item is None:
+            raise UnknownConfigOption(item)
+
+        self._set_value(config_item, value)
+        await self._async_set_config_on_db()
+
     def config_options_embed(self):
         embed = discord.Embed()
         embed.title = "Launch Alerts Options"
         embed.description = "Launch Alerts supports the following configuration options.\n" \
                             "Set using `{} config [option] [value]`.".format(DEFAULT_BOT_PREFIX[0])
-        for config_item in self._config_items:
+        for config_item in self.CONFIG_ITEMS:
             embed_value = "Default: {}\nCurrently: {}\n{}".format(config_item.default,
                                                                   self.__getattr__(config_item.name),
                                                                   config_item.help_text)
@@ -85,7 +198,7 @@ class Config:
 
         return embed
 
-    def record_embed_message(self, message: discord.message) -> None:
+    async def record_embed_message(self, message: discord.message) -> None:
         """
         Saves the most recent config embed to the database
         so that it can be fetched and updated every time a change
@@ -94,9 +207,9 @@ class Config:
         :param message: The message with the embed in it
         """
         key_name = self._get_embed_key_name()
-        redis_db.set(key_name, message.id, ex=EMBED_EXPIRE_SECONDS)
+        await db.set(key_name, message.id, ex=EMBED_EXPIRE_SECONDS)
 
-    def get_embed_message(self) -> str:
+    async def get_embed_message(self) -> str:
         """
         Returns the message id for the most recent config embed
         sent in the channel
@@ -104,41 +217,125 @@ class Config:
         :returns: The message id for the embed (if it exists), otherwise None
         """
         key_name = self._get_embed_key_name()
-        return redis_db.get(key_name)
+        return await db.get(key_name)
 
 
 class ChannelConfig(Config):
+    __slots__ = ("server_id", "channel_id")
     KEY_PREFIX = 'config-channel'
+    CONFIG_ITEMS = (
+        ConfigItem("receive_alerts", "false", "Receive alerts for upcoming launches in this channel"),
+        ConfigItem("alert_times", "24h, 12h, 6h, 3h, 1h, 15m", "Comma separated list of time to launch for alerts"),
+        ConfigItem("timezone", "UTC", "Timezone for messages in this channel"),
+    )
 
-    def __init__(self, server_id: str, channel_id: str):
+    def __init__(self, server_id: str, channel_id: str, load: bool = True):
         self.server_id = server_id
         self.channel_id = channel_id
-        super().__init__()
+        super().__init__(load)
 
     def _get_db_key_name(self):
         return '{}-{}-{}'.format(self.KEY_PREFIX, self.server_id, self.channel_id)
 
-    def _get_config_items(self):
-        return [
-            ConfigItem("receive_alerts", "false", "Receive alerts for upcoming launches in this channel"),
-            ConfigItem("alert_times", "24h, 12h, 6h, 3h, 1h, 15m", "Comma separated list of time to launch for alerts"),
-            ConfigItem("timezone", "UTC", "Timezone for messages in this channel"),
-        ]
-
 
 class UserConfig(Config):
+    __slots__ = ("user_id",)
     KEY_PREFIX = 'config-user'
+    CONFIG_ITEMS = (
+        ConfigItem("receive_alerts", "false", "Receive alerts for upcoming launches"),
+        ConfigItem("alert_times", "24h, 12h, 6h, 3h, 1h, 15m", "Comma separated list of time to launch for alerts"),
+        ConfigItem("timezone", "UTC", "Timezone for messages"),
+    )
 
-    def __init__(self, user_id):
+    def __init__(self, user_id, load: bool = True):
         self.user_id = user_id
-        super().__init__()
+        super().__init__(load)
 
     def _get_db_key_name(self):
         return '{}-{}'.format(self.KEY_PREFIX, self.user_id)
 
-    def _get_config_items(self):
-        return [
-            ConfigItem("receive_alerts", "false", "Receive alerts for upcoming launches"),
-            ConfigItem("alert_times", "24h, 12h, 6h, 3h, 1h, 15m", "Comma separated list of time to launch for alerts"),
-            ConfigItem("timezone", "UTC", "Timezone for messages"),
-        ]
+
+async def get_alert_subscriber_keys() -> Set[str]:
+    """Returns the DB keys of all configs with receive_alerts turned on."""
+    return await db.smembers(ALERT_SUBSCRIBERS_KEY)
+
+
+async def warm_config_cache() -> int:
+    """
+    Loads the configs of alert subscribers into the config cache, up to its
+    size, so the first alert ticks after a restart don't fetch them one by one.
+
+    :returns: The number of configs loaded
+    """
+    key_names = sorted(await get_alert_subscriber_keys())[:config_cache.max_size]
+    if not key_names:
+        return 0
+    generations = [config_cache.generation(key_name) for key_name in key_names]
+    loaded = 0
+    for key_name, generation, db_data in zip(key_names, generations, await db.mget(key_names)):
+        loaded += config_cache.put_if_unchanged(key_name, loads(db_data) if db_data else {}, generation)
+    return loaded
+
+
+async def build_alert_subscribers_index() -> int:
+    """
+    One-time migration that builds the alert subscribers index from
+    the config keys already in the database.  Later changes are kept
+    in sync by Config._queue_config_on_db.
+
+    :returns: The number of subscribers added to the index
+    """
+    if await db.exists(ALERT_SUBSCRIBERS_MIGRATED_KEY):
+        return 0
+
+    subscriber_keys = []
+    for prefix in (ChannelConfig.KEY_PREFIX, UserConfig.KEY_PREFIX):
+        cursor = None
+        while cursor != 0:
+            cursor, key_names = await db.scan(cursor or 0, match="{}-*".format(prefix), count=1000)
+            for key_name in key_names:
+                db_data = await db.get(key_name)
+                if db_data and loads(db_data).get("receive_alerts") == "true":
+                    subscriber_keys.append(key_name)
+
+    pipe = db.pipeline()
+    if subscriber_keys:
+        pipe.sadd(ALERT_SUBSCRIBERS_KEY, *subscriber_keys)
+    pipe.set(ALERT_SUBSCRIBERS_MIGRATED_KEY, 1)
+    await pipe.execute()
+    return len(subscriber_keys)
+
+
+async def listen_for_config_invalidations(on_change: Callable[[Optional[str]], None] = None,
+                                          subscribed: asyncio.Event = None) -> None:
+    """
+    Drops cached configs when any bot process changes them.  If the
+    subscription is lost the whole cache is cleared, since changes may
+    have been missed while disconnected.
+
+    :param on_change: Called with the DB key of each changed config, or None when changes may have been missed
+    :param subscribed: Set once changes are being received, configs cached before then may miss them
+    """
+    while True:
+        pubsub = blocking_sync_db.pubsub(ignore_subscribe_messages=True)
+        try:
+            await blocking_db.run(pubsub.subscribe, CONFIG_INVALIDATION_CHANNEL)
+            if subscribed:
+                subscribed.set()
+            while True:
+                message = await blocking_db.run(pubsub.get_message, timeout=1.0)
+                if message:
+                    config_cache.invalidate(message["data"])
+                    if on_change:
+                        on_change(message["data"])
+        except Exception as e:
+            if isinstance(e, RedisError):
+                log.error(f"Lost config invalidation subscription: {e}")
+            else:
+                log.exception(f"Error handling config invalidation: {e}")
+            config_cache.clear()
+            if on_change:
+                on_change(None)
+            await asyncio.sleep(5)
+        finally:
+            pubsub.close()
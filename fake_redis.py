@@ -0,0 +1,21 @@
+import unittest
+
+import fakeredis
+import redis
+
+import redis_utils
+
+
+def use_fake_redis(test_case: unittest.TestCase = None) -> fakeredis.FakeServer:
+    """
+    Point the shared connection pools at a fresh in-process server, for tests
+    and benchmarks.  With a test case, the original pools are put back when
+    the test finishes.
+    """
+    server = fakeredis.FakeServer()
+    pool = redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=server, decode_responses=True)
+    for client in (redis_utils.sync_db, redis_utils.blocking_sync_db):
+        if test_case is not None:
+            test_case.addCleanup(setattr, client, "connection_pool", client.connection_pool)
+        client.connection_pool = pool
+    return server
@@ -0,0 +1,91 @@
+from datetime import datetime
+from typing import Optional, Tuple
+
+import pytz
+from dateutil.parser import parse
+
+
+class Launch:
+    """
+    A rocketlaunch.live launch, parsed once when the API response is received.
+    Only the fields the bot uses are kept.
+    """
+    __slots__ = ("slug", "name", "win_open", "date_str", "live_url", "mission_desc", "mission_names",
+                 "vehicle_id", "vehicle_name", "provider_name", "provider_slug", "pad_name", "location_name")
+
+    def __init__(self, slug: str, name: str, win_open: Optional[datetime], date_str: str, live_url: Optional[str],
+                 mission_desc: Optional[str], mission_names: Tuple[str, ...], vehicle_id: int, vehicle_name: str,
+                 provider_name: str, provider_slug: str, pad_name: str, location_name: str):
+        self.slug = slug
+        self.name = name
+        self.win_open = win_open
+        self.date_str = date_str
+        self.live_url = live_url
+        self.mission_desc = mission_desc
+        self.mission_names = mission_names
+        self.vehicle_id = vehicle_id
+        self.vehicle_name = vehicle_name
+        self.provider_name = provider_name
+        self.provider_slug = provider_slug
+        self.pad_name = pad_name
+        self.location_name = location_name
+
+    @classmethod
+    def from_api(cls, launch: dict) -> "Launch":
+        return cls(
+            slug=launch["slug"],
+            name=launch["name"],
+            win_open=get_launch_win_open(launch),
+            date_str=launch["date_str"],
+            live_url=get_live_url(launch),
+            mission_desc=get_mission_desc(launch),
+            mission_names=tuple(mission["name"] for mission in launch["missions"] if mission["name"]),
+            vehicle_id=launch["vehicle"]["id"],
+            vehicle_name=launch["vehicle"]["name"],
+            provider_name=launch["provider"]["name"],
+            provider_slug=launch["provider"]["slug"],
+            pad_name=launch["pad"]["name"],
+            location_name=launch["pad"]["location"]["name"],
+        )
+
+    @property
+    def version(self) -> int:
+        """Changes whenever any of the launch data changes."""
+        return hash(tuple(getattr(self, name) for name in self.__slots__))
+
+    def dump(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["win_open"] = int(self.win_open.timestamp()) if self.win_open else None
+        data["mission_names"] = list(self.mission_names)
+        return data
+
+    @classmethod
+    def load(cls, data: dict) -> "Launch":
+        data = dict(data)
+        data["win_open"] = datetime.fromtimestamp(data["win_open"], pytz.utc) if data["win_open"] else None
+        data["mission_names"] = tuple(data["mission_names"])
+        return cls(**data)
+
+
+def get_launch_win_open(launch: dict) -> datetime:
+    if launch["t0"]:
+        win_open = launch["t0"]
+    else:
+        win_open = launch["win_open"]
+    if win_open:
+        return parse(win_open)
+
+
+def get_live_url(launch: dict) -> str:
+    for media in launch["media"]:
+        if media["ldfeatured"]:
+            if media["media_url"]:
+                return media["media_url"]
+            elif media["youtube_vidid"]:
+                return f'https://youtu.be/{media["youtube_vidid"]}'
+
+
+def get_mission_desc(launch: dict) -> str:
+    if launch["missions"]:
+        if launch["missions"][0]["description"]:
+            return launch["missions"][0]["description"]
@@ -1,27 +1,46 @@
-import json
 import sys
 import asyncio
-from typing import List, Union, Dict, Sequence
-import backoff
+import signal
+import time
+from typing import List, Optional, Tuple, Union
 import pytz
-from discord import DMChannel, TextChannel, Emoji
+from discord import DMChannel, TextChannel
 from discord.abc import GuildChannel
 from discord.ext import commands, tasks
 import discord
-import aiohttp
 from datetime import datetime, timedelta
 from logbook import Logger, StreamHandler, FileHandler
 
-from acronym_utils import acronym_lookup, get_acronym_embed
-from config import ChannelConfig, UserConfig
-from launch_monitor import LaunchMonitor, ISOFORMAT
-from launch_monitor_utils import LAUNCH_MONITORS_KEY, db
+from acronym_utils import acronym_lookup, get_acronym_embed, acronym_dictionary
+from alert_delivery import AlertDelivery
+from alert_outbox import AlertOutbox, OutboxAlert, LAUNCH_MOVED, append_alerts, migrate_outbox_to_shards
+from alert_pipeline import LaunchMonitorSync, claim_due_launch_alerts, schedule_changed
+from cache_utils import AsyncTTLCache
+from upcoming_launches import UpcomingLaunchesSnapshot
+from config import UserConfig, UnknownConfigOption, build_alert_subscribers_index, listen_for_config_invalidations, \
+    config_cache, warm_config_cache
+from launch import Launch
+from launch_monitor_utils import migrate_launch_monitors_blob, get_next_due_time, record_sent_alert, \
+    forget_sent_alert, LAUNCH_MOVED_ALERT_TIME, migrate_due_times_to_partitions, migrate_launch_monitors_to_partitions
+from launch_sync import LaunchDiff, get_moved_seconds, get_known_launch_slugs, migrate_known_launches_to_partitions
+from metrics import TICK_SECONDS, STAGE_SECONDS, LAUNCH_CHANGES, DISCORD_SEND_SECONDS, \
+    register_cache, start_metrics_server, registry
+from partitions import PartitionLeases
+from profiling import Profiler
+from rocket_launch_live import RocketLaunchLiveClient, UpstreamError
+from sharding import ShardedBot
 from utils import get_config_from_message, get_launch_embed, is_today_launch, \
-    get_config_from_channel, get_config_from_db_key, get_server_name_from_channel, convert_quoted_string_in_list, \
-    new_aiohttp_connector, get_launch_win_open, get_live_url, get_server_id_from_channel, has_tc_integration
+    get_config_from_channel, get_server_name_from_channel, convert_quoted_string_in_list, \
+    new_aiohttp_connector, get_server_id_from_channel, has_tc_integration, launch_embed_cache, chunk_embeds, \
+    send_embeds, MAX_EMBEDS_PER_MESSAGE
 from local_config import *
 
 SUB_EMOJI = "🔔"
+UPSTREAM_ERROR_MESSAGE = "rocketlaunch.live isn't responding right now, please try again later."
+
+ALERT_SCHEDULER_MAX_SLEEP = 60
+ALERT_UPCOMING_LAUNCHES = 5  # Only the next few launches get alerts
+CONFIG_WARM_TIMEOUT = 10  # Seconds to wait for the config invalidation subscription before warming without it
 
 
 def get_prefix(client, message):
@@ -41,367 +60,584 @@ def get_prefix(client, message):
         return DEFAULT_BOT_PREFIX
 
 
-description = "Rocket launch lookup and alert bot.\n" \
-              "Valid prefixes: {}".format(", ".join(DEFAULT_BOT_PREFIX))
-
-loop = asyncio.get_event_loop()
-connector = loop.run_until_complete(new_aiohttp_connector())
-
-bot = commands.Bot(command_prefix=get_prefix, description=description, loop=loop, connector=connector)
-bot.session = aiohttp.ClientSession(connector=connector)
-
-StreamHandler(sys.stdout).push_application()
-FileHandler('discord-launch-alert.log', bubble=True).push_application()
-bot.log = Logger('Launch Alerts Bot')
-
-
-async def save_launch_alerts(upcoming_launches: List[dict], alert_sent_lms: List[LaunchMonitor]) -> None:
-    """Get all configurations with launch alerts turned on.  Update with last alert times and save to DB."""
-    db_keys = db.keys()
-
-    launch_monitors_to_save = []
-    for key in db_keys:
-        if key.startswith(ChannelConfig.KEY_PREFIX) or key.startswith(UserConfig.KEY_PREFIX):
-            config = get_config_from_db_key(str(key))
-            if config.receive_alerts == "true":
-                for upcoming_launch in upcoming_launches:
-                    # Create clean list for all launch monitors
-                    if not get_launch_win_open(upcoming_launch):
-                        continue
-                    new_lm = LaunchMonitor()
-                    new_lm.load({
-                        "server": config.server_id if hasattr(config, "server_id") else None,
-                        "channel": config.channel_id if hasattr(config, "channel_id") else config.user_id,
-                        "launch_slug": upcoming_launch["slug"],
-                        "launch_win_open": get_launch_win_open(upcoming_launch).strftime(ISOFORMAT),
-                        "last_alert": None
-                    }, config.alert_times)
-
-                    # Update last_alert from times in the DB
-                    for current_lm in await get_launch_alerts(due_only=False):
-                        if new_lm == current_lm:
-                            new_lm.last_alert = current_lm.last_alert
-                            # TODO check for launch_win_open change here and send alert that the window has moved
-                            # if new_lm.launch_win_open != current_lm.launch_win_open:
-                            #     "[mission name] has been moved to [time].  Go to [link] to find out more.
-
-                    # Update last_alert for messages we just sent
-                    for alert_sent_lm in alert_sent_lms:
-                        if new_lm == alert_sent_lm:
-                            new_lm.last_alert = alert_sent_lm.last_alert
-                    launch_monitors_to_save.append(new_lm.dump())
-    db.set(LAUNCH_MONITORS_KEY, json.dumps(launch_monitors_to_save))
-
-
-async def get_launch_alerts(due_only=True) -> List[LaunchMonitor]:
-    launch_monitors_from_db = db.get(LAUNCH_MONITORS_KEY)
-    if launch_monitors_from_db:
-        launch_monitors_from_db = json.loads(launch_monitors_from_db)
-    else:
-        launch_monitors_from_db = []
-
-    monitors = []
-    for launch_monitor in launch_monitors_from_db:
-        if launch_monitor["server"]:
-            config = ChannelConfig(launch_monitor["server"], launch_monitor["channel"])
-        else:
-            config = UserConfig(launch_monitor["channel"])
-
-        lm = LaunchMonitor()
-        lm.load(launch_monitor, config.alert_times)
-        if not due_only or lm.is_alert_due():
-            monitors.append(lm)
-
-    return monitors
-
-
-@tasks.loop(seconds=60)
-async def process_alerts():
-    bot.log.info("Process Alerts")
-    lms = await get_launch_alerts()
-    for lm in lms:
-        bot.log.info(f"[channel={lm.channel}, slug={lm.launch}] sending launch alert")
-        try:
-            lm.last_alert = datetime.now(pytz.utc)
-            await send_launch_alert(lm)
-        except Exception as e:
-            bot.log.exception("Error sending launch alert: {}".format(e))
-    upcoming_launches = await get_multiple_launches(("5",))
-    if upcoming_launches:
-        await save_launch_alerts(upcoming_launches, lms)
-
-
-@process_alerts.before_loop
-async def before_process_alerts():
-    print('process alerts waiting for bot to start')
-    await bot.wait_until_ready()
-
-
-async def send_launch_alert(lm: LaunchMonitor) -> None:
-    if lm.server:
-        channel = bot.get_channel(int(lm.channel))
-        if channel:
-            config = get_config_from_channel(channel)
-        else:
-            bot.log.error(f"[channel={lm.channel}, slug={lm.launch}] channel does not exist")
-            return
-    else:  # User configs are different
-        user = bot.get_user(int(lm.channel))
-        if not user.dm_channel:
-            await user.create_dm()
-        channel = user.dm_channel
-        config = UserConfig(lm.channel)
-    launch = await get_launch_by_slug(lm.launch)
-
-    # OffNom send Starship tests to #boca-chica
-    if isinstance(channel, GuildChannel) and channel.guild.id == 360523650912223253 and launch["vehicle"]["id"] == 115:
-        channel = bot.get_channel(int(754432168293433354))
-
-    async for msg in channel.history(limit = 3):
-        if msg.embeds and msg.author == bot.user:
-            if msg.embeds[0].footer.text.split(" | ")[1] == launch["slug"]:
-                launch_window = get_launch_win_open(launch)
-                if int(launch_window.timestamp()) == int(msg.embeds[0].fields[0].name.split(":")[1]):
-                    #Skip alerting everyone
-                    return
-
-    asyncio.ensure_future(send_launch_panel(channel, launch, config.timezone, message="There's a launch coming up!"))
-
-@backoff.on_exception(backoff.expo,
-                      Exception,
-                      max_tries=10)
-async def get_multiple_launches(args: Sequence):
-    headers = {"Authorization": f"Bearer {ROCKET_LAUNCH_LIVE_TOKEN}"}
-    # Uses slash to separate parameters
-    params = "/".join(args)
-    async with bot.session.get('https://fdo.rocketlaunch.live/json/launch/next/{}'.format(params), headers=headers) as response:
-        if response.status == 200:
-            js = await response.json()
-            return js["result"]
-
-
-@backoff.on_exception(backoff.expo,
-                      Exception,
-                      max_tries=10)
-async def get_launch_by_slug(slug: str):
-    # TODO: Add caching for launch data so that we don't retrieve it too often
-    #     Safe to redis key, perhaps "cache-slug" with 60 second expiry.  If not there, fetch, then save to redis
-    headers = {"Authorization": f"Bearer {ROCKET_LAUNCH_LIVE_TOKEN}"}
-    async with bot.session.get('https://fdo.rocketlaunch.live/json/launch/{}'.format(slug), headers=headers) as response:
-        if response.status == 200:
-            js = await response.json()
-            if js["result"]:
-                return js["result"][0]
+class LaunchAlerts(commands.Cog):
+    """Launch alerts and the launch lookup commands."""
+
+    def __init__(self, bot: ShardedBot, rocket_launch_live: RocketLaunchLiveClient):
+        self.bot = bot
+        self.rocket_launch_live = rocket_launch_live
+        # Launch.dump() entries, the prefix changes with the format so old entries aren't read
+        self.launch_cache = AsyncTTLCache(LAUNCH_CACHE_TTL, LAUNCH_CACHE_STALE_TTL,
+                                          redis_prefix="cache-launch-v2-" if LAUNCH_CACHE_USE_REDIS else None,
+                                          encode=Launch.dump, decode=Launch.load)
+        self.alert_delivery = AlertDelivery(self.send_outbox_alerts, ALERT_DELIVERY_CONCURRENCY,
+                                            alerts_per_send=MAX_EMBEDS_PER_MESSAGE)
+        self.launch_monitor_sync = LaunchMonitorSync(FULL_RECONCILE_SECONDS, LAUNCH_MOVED_NOTIFY_SECONDS)
+        # Other processes may be running alerts too, so only monitors in the partitions leased to this one are handled
+        self.partition_leases = PartitionLeases(ALERT_PARTITIONS, ALERT_PARTITION_LEASE_SECONDS)
+        self.launch_monitor_sync.set_partitions(self.partition_leases.owned)
+        self.alert_outbox: Optional[AlertOutbox] = None  # For the shards this process runs
+        self.upcoming_launches_snapshot = UpcomingLaunchesSnapshot(rocket_launch_live.get_next_launches,
+                                                                   UPCOMING_LAUNCHES_HORIZON,
+                                                                   UPCOMING_LAUNCHES_REFRESH_SECONDS)
+        self.profiler = Profiler(PROFILE_DIR)
+        self.config_subscribed = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Start the background tasks, they wait for the bot to be ready before touching Discord."""
+        self._tasks = [
+            asyncio.ensure_future(coro) for coro in (
+                listen_for_config_invalidations(self.launch_monitor_sync.config_changed, self.config_subscribed),
+                self.partition_leases.run(self.on_partitions_changed),
+                self.alert_scheduler(),
+                self.deliver_alerts(),
+                self.upcoming_launches_snapshot.run(),
+                acronym_dictionary.run(self.bot.session, ACRONYM_REFRESH_SECONDS),
+            )
+        ]
+        self.process_alerts.start()
+
+    def cog_unload(self):
+        self.process_alerts.cancel()
+        for task in self._tasks:
+            task.cancel()
+
+    async def warm_caches(self) -> None:
+        """
+        Load the launch, config and acronym caches from Redis at the same time,
+        so the first alert tick and commands after a restart don't each fetch
+        what the last process already had.
+        """
+        async def warm_launch_cache():
+            return await self.launch_cache.warm(await get_known_launch_slugs())
+
+        async def warm_configs():
+            # Configs changed before the invalidation subscription starts would stay stale in the cache
+            try:
+                await asyncio.wait_for(self.config_subscribed.wait(), CONFIG_WARM_TIMEOUT)
+            except asyncio.TimeoutError:
+                return 0
+            return await warm_config_cache()
+
+        started_at = time.time()
+        results = await asyncio.gather(warm_launch_cache(), warm_configs(), acronym_dictionary.load_from_redis(),
+                                       return_exceptions=True)
+        for name, result in zip(("launches", "configs", "acronyms"), results):
+            if isinstance(result, Exception):
+                self.bot.log.warning(f"Error warming {name} cache: {result}")
+        self.bot.log.info(f"Warmed caches in {time.time() - started_at:.2f}s: {results[0]} launches, "
+                          f"{results[1]} configs, acronyms {'loaded' if results[2] is True else 'not loaded'}")
+
+    async def alert_scheduler(self):
+        """Sleep until the earliest scheduled alert is due, then append only the due alerts to the outbox."""
+        await self.bot.wait_until_ready()
+        while True:
+            schedule_changed.clear()
+            try:
+                with TICK_SECONDS.time(task="alert_scheduler"), self.profiler.profile("alert_scheduler"):
+                    with STAGE_SECONDS.time(stage="claim_due"):
+                        # Delivered by alert_outbox, so a slow batch doesn't hold up the next due alerts
+                        await claim_due_launch_alerts(self.partition_leases.owned, self.bot.shard_count)
+                    next_due = await get_next_due_time(self.partition_leases.owned)
+            except Exception as e:
+                self.bot.log.exception("Error processing launch alerts: {}".format(e))
+                next_due = None
+
+            sleep = ALERT_SCHEDULER_MAX_SLEEP
+            if next_due is not None:
+                sleep = min(max(next_due - datetime.now(pytz.utc).timestamp(), 0), ALERT_SCHEDULER_MAX_SLEEP)
+            try:
+                await asyncio.wait_for(schedule_changed.wait(), sleep)
+            except asyncio.TimeoutError:
+                pass
+
+    async def deliver_alerts(self):
+        """Deliver the alerts in the outboxes of the shards this process runs, which can see their guilds."""
+        await self.bot.wait_until_ready()
+        self.alert_outbox = AlertOutbox(self.alert_delivery.deliver, self.partition_leases.worker_id,
+                                        self.bot.local_shard_ids, ALERT_OUTBOX_BATCH_SIZE, ALERT_OUTBOX_RETRY_SECONDS,
+                                        ALERT_OUTBOX_MAX_ATTEMPTS)
+        await self.alert_outbox.run()
+
+    @tasks.loop(seconds=60)
+    async def process_alerts(self):
+        self.bot.log.info("Process Alerts")
+        with TICK_SECONDS.time(task="process_alerts"), self.profiler.profile("process_alerts"):
+            with STAGE_SECONDS.time(stage="upcoming_launches"):
+                try:
+                    upcoming_launches = (await self.upcoming_launches_snapshot.get())[:ALERT_UPCOMING_LAUNCHES]
+                except UpstreamError as e:
+                    # Monitors already saved keep alerting, they just won't pick up new launches
+                    self.bot.log.warning(f"No upcoming launches to reconcile: {e}")
+                    upcoming_launches = []
+            if upcoming_launches:
+                with STAGE_SECONDS.time(stage="sync"):
+                    diff, moved = await self.launch_monitor_sync.sync(upcoming_launches)
+                for change in LaunchDiff.__slots__:
+                    LAUNCH_CHANGES.inc(len(getattr(diff, change)), change=change)
+                # Alerts and notices should show the new data straight away
+                for launch in diff.updated + [new for _, new in diff.moved]:
+                    self.launch_cache.put(launch.slug, launch)
+                await append_alerts([OutboxAlert.from_launch_monitor(lm, LAUNCH_MOVED, LAUNCH_MOVED_ALERT_TIME,
+                                                                     time.time(), moved_from)
+                                     for lm, moved_from in moved], self.bot.shard_count)
+        self.bot.log.info(f"Config cache: {config_cache.stats()}")
+        self.bot.log.info(f"Alert delivery: {self.alert_delivery.stats()}")
+        if self.alert_outbox:
+            self.bot.log.info(f"Alert outbox: {self.alert_outbox.stats()}")
+        self.bot.log.info(f"Shards: {self.bot.shard_stats.stats()}")
+        self.bot.log.info(f"Rocketlaunch.live: {self.rocket_launch_live.state()}")
+
+    @process_alerts.before_loop
+    async def before_process_alerts(self):
+        print('process alerts waiting for bot to start')
+        await self.bot.wait_until_ready()
+        migrated = await build_alert_subscribers_index()
+        if migrated:
+            self.bot.log.info(f"Built alert subscribers index with {migrated} subscribers")
+        migrated = await migrate_launch_monitors_blob()
+        if migrated:
+            self.bot.log.info(f"Migrated {migrated} launch monitors to per-monitor storage")
+        migrated = await migrate_launch_monitors_to_partitions()
+        if migrated:
+            self.bot.log.info(f"Migrated {migrated} launch monitors to partitioned storage")
+        migrated = await migrate_known_launches_to_partitions()
+        if migrated:
+            self.bot.log.info(f"Migrated {migrated} known launches to partitioned storage")
+        migrated = await migrate_due_times_to_partitions()
+        if migrated:
+            self.bot.log.info(f"Migrated {migrated} due times to partitioned storage")
+        migrated = await migrate_outbox_to_shards(self.bot.shard_count)
+        if migrated:
+            self.bot.log.info(f"Migrated {migrated} alerts to the shard outboxes")
+
+    def on_partitions_changed(self, partitions):
+        self.launch_monitor_sync.set_partitions(partitions)
+        schedule_changed.set()
+
+    async def get_alert_destination(self, alert: OutboxAlert, launch: Launch):
+        """Returns the channel an alert goes to and its config, or None if it's gone."""
+        if alert.server:
+            channel = self.bot.get_channel(int(alert.channel))
+            if channel:
+                config = await get_config_from_channel(channel)
             else:
+                self.bot.log.error(f"[channel={alert.channel}, slug={alert.launch}] channel does not exist")
                 return None
+        else:  # User configs are different
+            try:
+                # Users are only cached by the shards of guilds they share with the bot
+                user = self.bot.get_user(int(alert.channel)) or await self.bot.fetch_user(int(alert.channel))
+                if not user.dm_channel:
+                    await user.create_dm()
+            except (discord.NotFound, discord.Forbidden) as e:
+                self.bot.log.error(f"[user={alert.channel}, slug={alert.launch}] can't send direct messages: {e}")
+                return None
+            channel = user.dm_channel
+            config = await UserConfig.create(alert.channel)
+
+        # OffNom send Starship tests to #boca-chica
+        if isinstance(channel, GuildChannel) and channel.guild.id == 360523650912223253 and launch.vehicle_id == 115:
+            channel = self.bot.get_channel(int(754432168293433354))
+        return channel, config
+
+    async def send_outbox_alerts(self, alerts: List[OutboxAlert]) -> None:
+        """
+        Sends alerts from the outbox for one channel, with the alerts going to
+        the same place combined into as few messages as possible.  Raises if
+        they should be retried, alerts that can't be delivered at all, like
+        ones for deleted channels, are dropped.
+        """
+        # Everything that can fail is looked up before any alert is recorded as sent
+        resolved = []
+        for alert in alerts:
+            launch = await self.get_launch_by_slug(alert.launch)
+            if launch is None:
+                self.bot.log.error(f"[channel={alert.channel}, slug={alert.launch}] launch does not exist")
+                continue
+            destination = await self.get_alert_destination(alert, launch)
+            if destination is not None:
+                resolved.append((alert, launch) + destination)
+
+        groups = {}  # (channel id, kind) -> channel, config and the alerts going there
+        unsent = []
+        try:
+            for alert, launch, channel, config in resolved:
+                # Checked against the channel the alert actually goes to, several channels can be redirected to one
+                if not await record_sent_alert(channel.id, alert.launch, alert.launch_win_open, alert.alert_time):
+                    self.bot.log.info(f"[channel={channel.id}, slug={alert.launch}] {alert.kind} already sent")
+                    continue
+                unsent.append((channel, alert))
+                groups.setdefault((channel.id, alert.kind), (channel, config, []))[2].append((alert, launch))
+
+            for channel, config, group in groups.values():
+                for chunk in self.chunk_alert_panels(channel, config.timezone, group):
+                    await self.send_launch_panels(channel, [launch for _, launch in chunk], config.timezone,
+                                                  message=get_alert_message(chunk))
+                    sent = [alert for alert, _ in chunk]
+                    unsent = [(sent_to, alert) for sent_to, alert in unsent if alert not in sent]
+        except Exception:
+            # Messages already sent stay recorded, so the retry only sends the rest
+            for sent_to, alert in unsent:
+                await forget_sent_alert(sent_to.id, alert.launch, alert.launch_win_open, alert.alert_time)
+            raise
+
+    @staticmethod
+    def chunk_alert_panels(channel: Union[TextChannel, DMChannel], timezone: str,
+                           alerts: List[Tuple[OutboxAlert, Launch]]) -> List[List[Tuple[OutboxAlert, Launch]]]:
+        """Splits alerts for one channel into the ones that can be sent in each message."""
+        if has_tc_integration(get_server_id_from_channel(channel)):
+            # Subscribing with the reaction only works for the launch in the message's first embed
+            return [[alert] for alert in alerts]
+        chunks, start = [], 0
+        for embeds in chunk_embeds([get_launch_embed(launch, timezone) for _, launch in alerts]):
+            chunks.append(alerts[start:start + len(embeds)])
+            start += len(embeds)
+        return chunks
+
+    async def get_launch_by_slug(self, slug: str):
+        """
+        Launch data for a slug, shared between everyone asking for it within LAUNCH_CACHE_TTL.
+        While rocketlaunch.live is failing, data of any age is used if there is some.
+        """
+        try:
+            return await self.launch_cache.get(slug, lambda: self.rocket_launch_live.get_launch(slug))
+        except UpstreamError as e:
+            launch = self.launch_cache.peek(slug)
+            if launch is None:
+                raise
+            self.bot.log.warning(f"[slug={slug}] using cached launch data: {e}")
+            return launch
+
+    async def send_launch_panel(self, channel: Union[TextChannel, DMChannel], launch: Launch, timezone: str,
+                                message: str = None) -> None:
+        await self.send_launch_panels(channel, [launch], timezone, message)
+
+    async def send_launch_panels(self, channel: Union[TextChannel, DMChannel], launches: List[Launch], timezone: str,
+                                 message: str = None) -> None:
+        """Sends the panels of up to MAX_EMBEDS_PER_MESSAGE launches in one message."""
+        server = get_server_name_from_channel(channel)
+        server_id = get_server_id_from_channel(channel)
+        with_tc = has_tc_integration(server_id)
+        self.bot.log.info("[server={}, channel={}, slug={}] launch panel sent".format(
+            server, channel, ",".join(launch.slug for launch in launches)))
+        embeds = [get_launch_embed(launch, timezone, with_tc=with_tc) for launch in launches]
+        with DISCORD_SEND_SECONDS.time():
+            launch_message = await send_embeds(channel, message, embeds)
+        if with_tc:
+            await launch_message.add_reaction(SUB_EMOJI)
+
+    @commands.Cog.listener()
+    async def on_reaction_add(self, reaction, user):
+        if user == self.bot.user:
+            return
 
+        if reaction.emoji != SUB_EMOJI:
+            return
 
-async def send_launch_panel(channel: Union[TextChannel, DMChannel], launch: Dict, timezone: str, message: str=None) -> None:
-    server = get_server_name_from_channel(channel)
-    server_id = get_server_id_from_channel(channel)
-    with_tc = has_tc_integration(server_id)
-    bot.log.info("[server={}, channel={}, slug={}] launch panel sent".format(server, channel, launch["slug"]))
-    launch_message = await channel.send(message, embed=get_launch_embed(launch, timezone, with_tc=with_tc))
-    if with_tc:
-        await launch_message.add_reaction(SUB_EMOJI)
-
-
-@bot.event
-async def on_reaction_add(reaction, user):
-    if user == bot.user:
-        return
-
-    if reaction.emoji != SUB_EMOJI:
-        return
-
-    message = reaction.message
-    server = message.guild
-
-    if server.id not in SERVERS_WITH_TC_INTEGRATION:
-        return
-
-    if message.author == bot.user:
-        footer_text = message.embeds[0].footer.text
-        slug = footer_text.split("|")[1].strip()
-        launch = await get_launch_by_slug(slug)
-        live_url = get_live_url(launch) or ""
-        win_open = get_launch_win_open(launch) or ""
-        expire = win_open + timedelta(days=1)
-        name = launch["name"]
-
-        if launch["provider"]["slug"] == "spacex":
-            tc_parent_id = 6
-        else:
-            tc_parent_id = 17
-
-        tc_sub_message = f'{TERMINAL_COUNT_COMMAND} botsub "{server.id}" "{slug}" {tc_parent_id} "{live_url}" "{expire}" "{user.id}" "{name}"'
-
-        tc_channel = bot.get_channel(TERMINAL_COUNT_CHANNEL_ID)
-        await tc_channel.send(tc_sub_message)
-
-
-@bot.event
-async def on_reaction_remove(reaction, user):
-    if user == bot.user:
-        return
-
-    if reaction.emoji != SUB_EMOJI:
-        return
-
-    message = reaction.message
-    server = message.guild
+        message = reaction.message
+        server = message.guild
 
-    if server.id not in SERVERS_WITH_TC_INTEGRATION:
-        return
+        if server.id not in SERVERS_WITH_TC_INTEGRATION:
+            return
 
-    if message.author == bot.user:
-        footer_text = message.embeds[0].footer.text
-        slug = footer_text.split("|")[1].strip()
+        if message.author == self.bot.user:
+            footer_text = message.embeds[0].footer.text
+            slug = footer_text.split("|")[1].strip()
+            launch = await self.get_launch_by_slug(slug)
+            live_url = launch.live_url or ""
+            win_open = launch.win_open or ""
+            expire = win_open + timedelta(days=1)
+            name = launch.name
+
+            if launch.provider_slug == "spacex":
+                tc_parent_id = 6
+            else:
+                tc_parent_id = 17
 
-        tc_sub_message = f'{TERMINAL_COUNT_COMMAND} botunsub "{server.id}" "{slug}" "{user.id}"'
+            tc_sub_message = f'{TERMINAL_COUNT_COMMAND} botsub "{server.id}" "{slug}" {tc_parent_id} "{live_url}" "{expire}" "{user.id}" "{name}"'
 
-        tc_channel = bot.get_channel(TERMINAL_COUNT_CHANNEL_ID)
-        await tc_channel.send(tc_sub_message)
+            tc_channel = self.bot.get_channel(TERMINAL_COUNT_CHANNEL_ID)
+            await tc_channel.send(tc_sub_message)
 
+    @commands.Cog.listener()
+    async def on_reaction_remove(self, reaction, user):
+        if user == self.bot.user:
+            return
 
-@bot.event
-async def on_ready():
-    await bot.change_presence(activity=discord.Game(type=0, name="{}help".format(DEFAULT_BOT_PREFIX[0])))
-    bot.log.info('Logged in as')
-    bot.log.info(f'Name: {bot.user.name}')
-    bot.log.info(f'ID: {bot.user.id}')
-    bot.log.info(f'Lib Ver: {discord.__version__}')
-    bot.log.info('------')
-    if not hasattr(bot, 'uptime'):
-        bot.uptime = datetime.utcnow()
+        if reaction.emoji != SUB_EMOJI:
+            return
 
+        message = reaction.message
+        server = message.guild
 
-@bot.command(pass_context=True, aliases=['n'])
-async def next(ctx, *args):
-    """Get next launch with optional filtering.
-    Examples:
-    !launch next 2 (get next two launches)
-    !launch next crs (get next CRS launch)
-    !launch next 2 crs (get next two CRS launches)
-    !launch next 3 falcon 9 (get next three Falcon 9 launches)
-    !launch next falcon heavy (get next Falcon Heavy launch)"""
-    message = ctx.message
-    channel = message.channel
-    server = get_server_name_from_channel(channel)
-    bot.log.info("[server={}, channel={}, command={}, args={}] command called"
-                 .format(server, channel, "next", args))
+        if server.id not in SERVERS_WITH_TC_INTEGRATION:
+            return
 
-    async with channel.typing():
-        channel_config = get_config_from_message(message)
-        args = convert_quoted_string_in_list(args)
+        if message.author == self.bot.user:
+            footer_text = message.embeds[0].footer.text
+            slug = footer_text.split("|")[1].strip()
+
+            tc_sub_message = f'{TERMINAL_COUNT_COMMAND} botunsub "{server.id}" "{slug}" "{user.id}"'
+
+            tc_channel = self.bot.get_channel(TERMINAL_COUNT_CHANNEL_ID)
+            await tc_channel.send(tc_sub_message)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self.bot.change_presence(activity=discord.Game(type=0, name="{}help".format(DEFAULT_BOT_PREFIX[0])))
+        self.bot.log.info('Logged in as')
+        self.bot.log.info(f'Name: {self.bot.user.name}')
+        self.bot.log.info(f'ID: {self.bot.user.id}')
+        self.bot.log.info(f'Lib Ver: {discord.__version__}')
+        self.bot.log.info('------')
+        if not hasattr(self.bot, 'uptime'):
+            self.bot.uptime = datetime.utcnow()
+
+    async def cog_before_invoke(self, ctx):
+        self.profiler.start(ctx.command.name)
+
+    async def cog_after_invoke(self, ctx):
+        self.profiler.stop(ctx.command.name)
+
+    @commands.command(pass_context=True, aliases=['n'])
+    async def next(self, ctx, *args):
+        """Get next launch with optional filtering.
+        Examples:
+        !launch next 2 (get next two launches)
+        !launch next crs (get next CRS launch)
+        !launch next 2 crs (get next two CRS launches)
+        !launch next 3 falcon 9 (get next three Falcon 9 launches)
+        !launch next falcon heavy (get next Falcon Heavy launch)"""
+        message = ctx.message
+        channel = message.channel
+        server = get_server_name_from_channel(channel)
+        self.bot.log.info("[server={}, channel={}, command={}, args={}] command called"
+                          .format(server, channel, "next", args))
+
+        async with channel.typing():
+            channel_config = await get_config_from_message(message)
+            args = convert_quoted_string_in_list(args)
+
+            if args and args[0].isnumeric():
+                count, filter_arg = int(args[0]), " ".join(args[1:])
+            else:
+                count, filter_arg = 1, " ".join(args)
+            launches = self.upcoming_launches_snapshot.find(count, filter_arg)
+            if launches is None:
+                try:
+                    launches = await self.rocket_launch_live.get_next_launches(args)
+                except UpstreamError as e:
+                    self.bot.log.warning("[server={}, channel={}, command={}] {}".format(server, channel, "next", e))
+                    await channel.send(UPSTREAM_ERROR_MESSAGE)
+                    return
+            if launches:
+                for launch in launches:
+                    asyncio.ensure_future(self.send_launch_panel(channel, launch, channel_config.timezone))
+            else:
+                await channel.send("No launches found with filter `{}`.".format(filter_arg))
+
+    @commands.command(pass_context=True, aliases=['t'])
+    async def today(self, ctx):
+        """Get today's launches."""
+        message = ctx.message
+        channel = message.channel
+        server = get_server_name_from_channel(channel)
+        self.bot.log.info("[server={}, channel={}, command={}] command called"
+                          .format(server, channel, "today"))
+        async with channel.typing():
+            channel_config = await get_config_from_message(message)
+            try:
+                launches = await self.upcoming_launches_snapshot.get()
+            except UpstreamError as e:
+                self.bot.log.warning("[server={}, channel={}, command={}] {}".format(server, channel, "today", e))
+                await channel.send(UPSTREAM_ERROR_MESSAGE)
+                return
+            found_launches = False
 
-        launches = await get_multiple_launches(args)
-        if launches:
             for launch in launches:
-                asyncio.ensure_future(send_launch_panel(channel, launch, channel_config.timezone))
-        else:
-            if args[0].isnumeric():
-                filter_arg = " ".join(args[1:])
+                if is_today_launch(launch, channel_config.timezone):
+                    found_launches = True
+                    await self.send_launch_panel(channel, launch, channel_config.timezone)
+
+            if not found_launches:
+                self.bot.log.info("[[server={}, channel={}, command={}] no launches today"
+                                  .format(server, channel, "today"))
+                await channel.send("There are no launches today. \u2639")
+
+    @commands.command(pass_context=True, aliases=['c'])
+    async def config(self, ctx, option=None, *, value=None):
+        """Configure settings for this channel.
+        !launch config - View current config
+        !launch config option - View option
+        !launch config option value - Set option"""
+        message = ctx.message
+        channel = message.channel
+        server = get_server_name_from_channel(channel)
+        self.bot.log.info("[server={}, channel={}, command={}, option={}, value={}] command called"
+                          .format(server, channel, "config", option, value))
+        config = await get_config_from_message(message)
+
+        if option is None:  # Send Options
+            self.bot.log.info("[server={}, channel={}, command={}, option={}, value={}] options sent"
+                              .format(server, channel, "config", option, value))
+            embed_message = await channel.send(embed=config.config_options_embed())
+            await config.record_embed_message(embed_message)
+        elif value is None:  # Get Value of Option
+            try:
+                current = config.__getattr__(option)
+            except UnknownConfigOption:
+                await channel.send("Unknown option {}".format(option))
+                return
+            self.bot.log.info("[server={}, channel={}, command={}, option={}, value={}] value sent"
+                              .format(server, channel, "config", option, value))
+            await channel.send("{} is currently set to {}".format(option, current))
+        else:  # Set Value of Option
+            try:
+                await config.set_option(option, value)
+            except UnknownConfigOption:
+                await channel.send("Unknown option {}".format(option))
+                return
+            self.bot.log.info("[server={}, channel={}, command={}, option={}, value={}] option set"
+                              .format(server, channel, "config", option, value))
+            old_embed_id = await config.get_embed_message()
+
+            if old_embed_id:
+                embed_message = await ctx.message.channel.fetch_message(old_embed_id)
+                await embed_message.edit(embed=config.config_options_embed())
+            await channel.send("{} is now set to {}".format(option, config.__getattr__(option)))
+
+    @commands.command(pass_context=True, aliases=['s'])
+    async def slug(self, ctx, slug):
+        """Retrieve data for a specific launch."""
+        message = ctx.message
+        channel = message.channel
+        server = get_server_name_from_channel(channel)
+        self.bot.log.info("[server={}, channel={}, command={}, slug={}] command called"
+                          .format(server, channel, "slug", slug))
+        message_config = await get_config_from_message(message)
+
+        async with channel.typing():
+            try:
+                launch = await self.get_launch_by_slug(slug)
+            except UpstreamError as e:
+                self.bot.log.warning("[server={}, channel={}, command={}, slug={}] {}".format(server, channel, "slug", slug, e))
+                await channel.send(UPSTREAM_ERROR_MESSAGE)
+                return
+            if launch:
+                await self.send_launch_panel(channel, launch, message_config.timezone)
+            else:
+                self.bot.log.warning("[server={}, channel={}, command={}, slug={}] slug not found called"
+                                     .format(server, channel, "slug", slug))
+                await channel.send("No launch found with slug `{}`.".format(slug))
+
+    @commands.command(pass_context=True, aliases=['a'])
+    async def acronym(self, ctx, acronym):
+        """Try to find definition for an acronym."""
+        message = ctx.message
+        channel = message.channel
+        server = get_server_name_from_channel(channel)
+        self.bot.log.info("[server={}, channel={}, command={}, acronym={}] command called"
+                          .format(server, channel, "acronym", acronym))
+
+        async with channel.typing():
+            definitions = await acronym_lookup(self.bot.session, acronym)
+            if definitions:
+                embed = get_acronym_embed(acronym, definitions)
+                await channel.send(embed=embed)
             else:
-                filter_arg = " ".join(args)
-
-            await channel.send("No launches found with filter `{}`.".format(filter_arg))
-
-
-@bot.command(pass_context=True, aliases=['t'])
-async def today(ctx):
-    """Get today's launches."""
-    message = ctx.message
-    channel = message.channel
-    server = get_server_name_from_channel(channel)
-    bot.log.info("[server={}, channel={}, command={}] command called"
-                 .format(server, channel, "today"))
-    async with channel.typing():
-        channel_config = get_config_from_message(message)
-        launches = await get_multiple_launches(('5',),)
-        found_launches = False
-
-        for launch in launches:
-            if is_today_launch(launch, channel_config.timezone):
-                found_launches = True
-                await send_launch_panel(channel, launch, channel_config.timezone)
-
-        if not found_launches:
-            bot.log.info("[[server={}, channel={}, command={}] no launches today"
-                         .format(server, channel, "today"))
-            await channel.send("There are no launches today. \u2639")
-
-
-@bot.command(pass_context=True, aliases=['c'])
-async def config(ctx, option=None, *, value=None):
-    """Configure settings for this channel.
-    !launch config - View current config
-    !launch config option - View option
-    !launch config option value - Set option"""
-    message = ctx.message
-    channel = message.channel
-    server = get_server_name_from_channel(channel)
-    bot.log.info("[server={}, channel={}, command={}, option={}, value={}] command called"
-                 .format(server, channel, "config", option, value))
-    config = get_config_from_message(message)
-
-    if option is None:  # Send Options
-        bot.log.info("[server={}, channel={}, command={}, option={}, value={}] options sent"
-                     .format(server, channel, "config", option, value))
-        embed_message = await channel.send(embed=config.config_options_embed())
-        config.record_embed_message(embed_message)
-    elif value is None:  # Get Value of Option
-        bot.log.info("[server={}, channel={}, command={}, option={}, value={}] value sent"
-                     .format(server, channel, "config", option, value))
-        await channel.send("{} is currently set to {}".format(option, config.__getattr__(option)))
-    else:  # Set Value of Option
-        config.__setattr__(option, value)
-        bot.log.info("[server={}, channel={}, command={}, option={}, value={}] option set"
-                     .format(server, channel, "config", option, value))
-        old_embed_id = config.get_embed_message()
-
-        if old_embed_id:
-            embed_message = await ctx.message.channel.fetch_message(old_embed_id)
-            await embed_message.edit(embed=config.config_options_embed())
-        await channel.send("{} is now set to {}".format(option, config.__getattr__(option)))
-
-
-@bot.command(pass_context=True, aliases=['s'])
-async def slug(ctx, slug):
-    """Retrieve data for a specific launch."""
-    message = ctx.message
-    channel = message.channel
-    server = get_server_name_from_channel(channel)
-    bot.log.info("[server={}, channel={}, command={}, slug={}] command called"
-                 .format(server, channel, "slug", slug))
-    message_config = get_config_from_message(message)
-
-    async with channel.typing():
-        launch = await get_launch_by_slug(slug)
-        if launch:
-            await send_launch_panel(channel, launch, message_config.timezone)
-        else:
-            bot.log.warning("[server={}, channel={}, command={}, slug={}] slug not found called"
-                            .format(server, channel, "slug", slug))
-            await channel.send("No launch found with slug `{}`.".format(slug))
-
-
-@bot.command(pass_context=True, aliases=['a'])
-async def acronym(ctx, acronym):
-    """Try to find definition for an acronym."""
-    message = ctx.message
-    channel = message.channel
-    server = get_server_name_from_channel(channel)
-    bot.log.info("[server={}, channel={}, command={}, acronym={}] command called"
-                 .format(server, channel, "acronym", acronym))
-
-    async with channel.typing():
-        definitions = await acronym_lookup(bot.session, acronym)
-        if definitions:
-            embed = get_acronym_embed(acronym, definitions)
-            await channel.send(embed=embed)
-        else:
-            await channel.send("No definitions found for `{}`.".format(acronym))
-
-process_alerts.start()
-bot.run(DISCORD_BOT_TOKEN)
+                suggestions = acronym_dictionary.suggest(acronym)
+                if suggestions:
+                    await channel.send("No definitions found for `{}`. Did you mean {}?"
+                                       .format(acronym, ", ".join(f"`{suggestion}`" for suggestion in suggestions)))
+                else:
+                    await channel.send("No definitions found for `{}`.".format(acronym))
+
+    @commands.command(pass_context=True, hidden=True)
+    @commands.is_owner()
+    async def profile(self, ctx, target, count: int = 1):
+        """Profile the next runs of process_alerts, alert_scheduler or a command.
+        !launch profile process_alerts 3
+        !launch profile next"""
+        if target not in ("process_alerts", "alert_scheduler") and target not in self.bot.all_commands:
+            await ctx.message.channel.send("Can't profile `{}`.".format(target))
+            return
+        target = self.bot.all_commands[target].name if target in self.bot.all_commands else target
+        self.profiler.arm(target, count)
+        await ctx.message.channel.send("Profiling the next {} runs of `{}`, results will be in `{}`."
+                                       .format(count, target, PROFILE_DIR))
+
+
+def get_launch_moved_message(alert: OutboxAlert, launch: Launch) -> str:
+    moved_seconds = None
+    if alert.moved_from:
+        moved_seconds = get_moved_seconds(datetime.fromtimestamp(alert.moved_from, pytz.utc), launch.win_open)
+    if not moved_seconds:
+        return "The launch window has moved!"
+    return "The launch window has moved {} by {}, it was <t:{}:f>.".format(
+        "later" if moved_seconds > 0 else "earlier", timedelta(seconds=abs(moved_seconds)), alert.moved_from)
+
+
+def get_alert_message(alerts: List[Tuple[OutboxAlert, Launch]]) -> str:
+    """Message sent with the panels of alerts of the same kind."""
+    if alerts[0][0].kind == LAUNCH_MOVED:
+        if len(alerts) == 1:
+            return get_launch_moved_message(*alerts[0])
+        return "\n".join(f"**{launch.name}**: {get_launch_moved_message(alert, launch)}" for alert, launch in alerts)
+    if len(alerts) == 1:
+        return "There's a launch coming up!"
+    return f"There are {len(alerts)} launches coming up!"
+
+
+async def create_bot() -> ShardedBot:
+    """
+    Builds the bot with the LaunchAlerts cog added.  Nothing connects to
+    Discord, Redis or rocketlaunch.live until it's started.
+    """
+    description = "Rocket launch lookup and alert bot.\n" \
+                  "Valid prefixes: {}".format(", ".join(DEFAULT_BOT_PREFIX))
+    connector = await new_aiohttp_connector()
+
+    # Runs DISCORD_SHARD_IDS, or every shard if None, with one gateway connection each
+    bot = ShardedBot(command_prefix=get_prefix, description=description, connector=connector,
+                     shard_count=DISCORD_SHARD_COUNT, shard_ids=DISCORD_SHARD_IDS)
+    rocket_launch_live = RocketLaunchLiveClient(ROCKET_LAUNCH_LIVE_TOKEN, connector,
+                                                ROCKET_LAUNCH_LIVE_DEADLINE_SECONDS,
+                                                failure_threshold=ROCKET_LAUNCH_LIVE_CIRCUIT_FAILURES,
+                                                reset_timeout=ROCKET_LAUNCH_LIVE_CIRCUIT_RESET_SECONDS)
+    bot.session = rocket_launch_live.session
+    bot.log = Logger('Launch Alerts Bot')
+
+    launch_alerts = LaunchAlerts(bot, rocket_launch_live)
+    bot.add_cog(launch_alerts)
+    register_cache("config", config_cache)
+    register_cache("launch", launch_alerts.launch_cache)
+    register_cache("launch_embed", launch_embed_cache)
+    registry.add_collector(bot.shard_stats.collect)
+    return bot
+
+
+def main():
+    StreamHandler(sys.stdout).push_application()
+    FileHandler('discord-launch-alert.log', bubble=True).push_application()
+
+    loop = asyncio.get_event_loop()
+    bot = loop.run_until_complete(create_bot())
+    launch_alerts = bot.get_cog(LaunchAlerts.__name__)
+    if METRICS_PORT:
+        loop.run_until_complete(start_metrics_server(METRICS_HOST, METRICS_PORT))
+    try:
+        # kill -USR1 <pid> profiles the next alert tick
+        loop.add_signal_handler(signal.SIGUSR1, launch_alerts.profiler.arm, "process_alerts", 1)
+    except (AttributeError, NotImplementedError):
+        pass  # No SIGUSR1 or signal handlers on Windows
+
+    launch_alerts.start()
+    # Warms while the shards log in
+    loop.create_task(launch_alerts.warm_caches())
+    bot.run(DISCORD_BOT_TOKEN)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,40 @@
 import re
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
-from typing import List, Optional
+from functools import lru_cache
+from typing import Optional, Tuple
 
 import pytz
 
 SECONDS_PER_UNIT = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
 ISOFORMAT = "%Y-%m-%dT%H:%M:%S%z"
+ALERT_TIME_FORMAT = re.compile(r"^(\d{1,5}[" + "".join(SECONDS_PER_UNIT.keys()) + "])+$")
+ALERT_TIME_UNIT = re.compile(r"\d{1,5}[" + "".join(SECONDS_PER_UNIT.keys()) + "]")
 
 
 class InvalidAlertTimeFormat(Exception): pass
 
 
+@lru_cache(maxsize=1024)
+def parse_alert_times(alert_times: str) -> Tuple[timedelta, ...]:
+    """
+    Parse a comma separated alert_times string into offsets from the launch,
+    largest first.  Results are cached, so every monitor with the same
+    alert_times shares one tuple.
+    """
+    return tuple(sorted((LaunchMonitor.get_time_delta_from_str(alert_time.strip())
+                         for alert_time in alert_times.split(',')), reverse=True))
+
+
+@lru_cache(maxsize=4096)
+def get_alert_datetimes(launch_win_open: datetime, alert_times: str) -> Tuple[datetime, ...]:
+    """Sorted alert datetimes, shared by every monitor of a launch window with the same alert_times."""
+    return tuple(launch_win_open - td for td in parse_alert_times(alert_times))
+
+
 class LaunchMonitor:
+    __slots__ = ("server", "channel", "launch", "launch_win_open", "last_alert", "alert_datetimes")
+
     def __init__(self):
         self.server = None
         self.channel = None
@@ -34,6 +57,25 @@ class LaunchMonitor:
             self.last_alert = None
         self.alert_datetimes = self._get_alert_datetimes(alert_times)
 
+    def load_compact(self, data: list, alert_times: str) -> None:
+        """Load from the compact [server, channel, launch_slug, launch_win_open, last_alert] epoch encoding."""
+        self.server, self.channel, self.launch, launch_win_open, last_alert = data
+        self.launch_win_open = datetime.fromtimestamp(launch_win_open, pytz.utc)
+        if last_alert:
+            self.last_alert = datetime.fromtimestamp(last_alert, pytz.utc)
+        else:
+            self.last_alert = None
+        self.alert_datetimes = self._get_alert_datetimes(alert_times)
+
+    def dump_compact(self) -> list:
+        return [
+            self.server,
+            self.channel,
+            self.launch,
+            int(self.launch_win_open.timestamp()),
+            int(self.last_alert.timestamp()) if self.last_alert else None
+        ]
+
     def dump(self) -> dict:
         data = {
             "server": self.server,
@@ -49,43 +91,45 @@ class LaunchMonitor:
         """
         Get time for next alert.  Return only the most recent past due, or if no past due, return the next due.
         """
-        now = datetime.now(pytz.utc)
+        return self._get_next_alert_datetime(datetime.now(pytz.utc))
+
+    def _get_next_alert_datetime(self, now: datetime) -> Optional[datetime]:
+        past_due = bisect_left(self.alert_datetimes, now)
+        if past_due:
+            past_due_alert = self.alert_datetimes[past_due - 1]
+            if not self.last_alert or self.last_alert < past_due_alert:
+                return past_due_alert
 
-        past_due_alert = None
-        for alert_datetime in self.alert_datetimes:
-            if alert_datetime < now:
-                if not self.last_alert:
-                    past_due_alert = alert_datetime
-                elif self.last_alert < alert_datetime:
-                    past_due_alert = alert_datetime
+        upcoming = bisect_right(self.alert_datetimes, now)
+        if upcoming < len(self.alert_datetimes):
+            return self.alert_datetimes[upcoming]
 
-        if past_due_alert:
-            return past_due_alert
+    @property
+    def last_alert_datetime(self) -> Optional[datetime]:
+        """
+        Get the scheduled alert time that the last alert was sent for.
+        """
+        if not self.last_alert:
+            return None
 
-        for alert_datetime in self.alert_datetimes:
-            if alert_datetime > now:
-                return alert_datetime
+        sent = bisect_right(self.alert_datetimes, self.last_alert)
+        if sent:
+            return self.alert_datetimes[sent - 1]
 
     def is_alert_due(self) -> bool:
-        alert_datetime = self.next_alert_datetime
+        now = datetime.now(tz=pytz.utc)
+        alert_datetime = self._get_next_alert_datetime(now)
         if alert_datetime:
-            return alert_datetime < datetime.now(tz=pytz.utc)
+            return alert_datetime < now
         else:
             return False
 
-    def _get_alert_datetimes(self, alert_times: str) -> List[datetime]:
-        datetimes_list = []
-        alert_times = alert_times.split(',')
-        for alert_time in alert_times:
-            alert_time = alert_time.strip()
-            td = self.get_time_delta_from_str(alert_time)
-            datetimes_list.append(self.launch_win_open - td)
-        return sorted(datetimes_list)
+    def _get_alert_datetimes(self, alert_times: str) -> Tuple[datetime, ...]:
+        return get_alert_datetimes(self.launch_win_open, alert_times)
 
     @staticmethod
     def is_valid_alert_time_format(alert_time: str) -> bool:
-        available_units = "".join(SECONDS_PER_UNIT.keys())
-        if re.match(r"^(\d{1,5}[" + available_units + "])+$", alert_time):
+        if ALERT_TIME_FORMAT.match(alert_time):
             return True
         else:
             return False
@@ -94,8 +138,7 @@ class LaunchMonitor:
     def get_time_delta_from_str(alert_time: str) -> timedelta:
         if not LaunchMonitor.is_valid_alert_time_format(alert_time):
             raise InvalidAlertTimeFormat
-        available_units = "".join(SECONDS_PER_UNIT.keys())
-        split_by_unit = re.findall(r"\d{1,5}[" + available_units + "]", alert_time)
+        split_by_unit = ALERT_TIME_UNIT.findall(alert_time)
 
         seconds = 0
         for unit in split_by_unit:
@@ -1,4 +1,246 @@
-import redis
+import json
+from datetime import datetime
+from collections import defaultdict
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
 
-db = redis.StrictRedis(host='localhost', charset="utf-8", decode_responses=True)  # TODO: Make DB configurable in local_config
-LAUNCH_MONITORS_KEY = "launch-monitors"
+from logbook import Logger
+
+from launch_monitor import ISOFORMAT
+from partitions import get_field_partition, all_partitions
+from redis_utils import db
+
+LAUNCH_MONITORS_KEY = "launch-monitors"  # Legacy JSON blob of every launch monitor
+LAUNCH_MONITORS_HASH_KEY = "launch-monitors-hash"  # Legacy hash of every launch monitor
+LAUNCH_MONITORS_HASH_KEY_PREFIX = "launch-monitors-hash"  # One hash of field -> compact monitor per partition
+LAUNCH_MONITORS_DUE_KEY = "launch-monitors-due"  # Legacy sorted set of every monitor's next alert epoch
+LAUNCH_MONITORS_DUE_KEY_PREFIX = "launch-monitors-due"  # One sorted set of hash field -> next alert epoch per partition
+SENT_ALERT_KEY_PREFIX = "sent-alert"
+SENT_ALERT_EXPIRE_SECONDS = 60 * 60 * 24  # Kept for a day after the launch window opens
+LAUNCH_MOVED_ALERT_TIME = 0  # Recorded in place of an alert time for the "launch moved" notice of a window
+
+log = Logger('Launch Monitor Utils')
+
+
+def get_launch_monitor_field(channel: str, launch_slug: str) -> str:
+    return "{}:{}".format(channel, launch_slug)
+
+
+def get_launch_monitors_key(partition: int) -> str:
+    return "{}-{}".format(LAUNCH_MONITORS_HASH_KEY_PREFIX, partition)
+
+
+def get_due_key(partition: int) -> str:
+    return "{}-{}".format(LAUNCH_MONITORS_DUE_KEY_PREFIX, partition)
+
+
+def group_by_partition(fields: Iterable[str]) -> Dict[int, List[str]]:
+    fields_by_partition = defaultdict(list)
+    for field in fields:
+        fields_by_partition[get_field_partition(field)].append(field)
+    return fields_by_partition
+
+
+def load_launch_monitor(field: str, value: Optional[str]) -> Optional[list]:
+    try:
+        return json.loads(value) if value else None
+    except ValueError:
+        log.error(f"[field={field}] corrupt launch monitor in DB")
+        return None
+
+
+async def get_stored_launch_monitors(partitions: Collection[int] = None) -> Dict[str, Optional[list]]:
+    """
+    Returns the launch monitors saved in the DB in their compact encoding,
+    keyed by hash field, optionally only those in the given partitions.
+    Corrupt entries are logged and mapped to None so they get overwritten or
+    removed on the next save.
+    """
+    pipe = db.pipeline(transaction=False)
+    for partition in all_partitions() if partitions is None else partitions:
+        pipe.hgetall(get_launch_monitors_key(partition))
+    return {field: load_launch_monitor(field, value)
+            for partition_launch_monitors in await pipe.execute() for field, value in partition_launch_monitors.items()}
+
+
+async def _get_launch_monitors(fields: Collection[str]) -> Dict[str, Optional[str]]:
+    """The stored values of the fields, None for fields that aren't stored."""
+    fields_by_partition = group_by_partition(fields)
+    pipe = db.pipeline(transaction=False)
+    for partition, partition_fields in fields_by_partition.items():
+        pipe.hmget(get_launch_monitors_key(partition), partition_fields)
+    return {field: value for partition_fields, values in zip(fields_by_partition.values(), await pipe.execute())
+            for field, value in zip(partition_fields, values)}
+
+
+async def get_launch_monitors(fields: List[str]) -> Dict[str, Optional[list]]:
+    """Like get_stored_launch_monitors, but only for the given fields.  Fields that aren't stored are left out."""
+    if not fields:
+        return {}
+    return {field: load_launch_monitor(field, value)
+            for field, value in (await _get_launch_monitors(fields)).items() if value is not None}
+
+
+async def get_due_times(fields: List[str]) -> Dict[str, int]:
+    """Like get_stored_due_times, but only for the given fields."""
+    if not fields:
+        return {}
+    pipe = db.pipeline(transaction=False)
+    for field in fields:
+        pipe.zscore(get_due_key(get_field_partition(field)), field)
+    return {field: int(score) for field, score in zip(fields, await pipe.execute()) if score is not None}
+
+
+async def get_stored_due_times(partitions: Collection[int] = None) -> Dict[str, int]:
+    """Returns the next alert time of every scheduled launch monitor in the partitions, keyed by hash field."""
+    pipe = db.pipeline(transaction=False)
+    for partition in all_partitions() if partitions is None else partitions:
+        pipe.zrange(get_due_key(partition), 0, -1, withscores=True)
+    return {field: int(score) for due_times in await pipe.execute() for field, score in due_times}
+
+
+async def get_next_due_time(partitions: Collection[int] = None) -> Optional[int]:
+    """Returns the earliest scheduled alert time in the partitions, or None if nothing is scheduled."""
+    pipe = db.pipeline(transaction=False)
+    for partition in all_partitions() if partitions is None else partitions:
+        pipe.zrange(get_due_key(partition), 0, 0, withscores=True)
+    next_dues = [int(next_due[0][1]) for next_due in await pipe.execute() if next_due]
+    return min(next_dues) if next_dues else None
+
+
+async def get_due_launch_monitors(now: int, partitions: Collection[int] = None) \
+        -> Tuple[Dict[str, Optional[list]], Dict[str, int]]:
+    """
+    Returns the launch monitors in the partitions with an alert due at or before
+    now and their due times, keyed by hash field.
+    """
+    pipe = db.pipeline(transaction=False)
+    for partition in all_partitions() if partitions is None else partitions:
+        pipe.zrangebyscore(get_due_key(partition), "-inf", now, withscores=True)
+    due_times = {field: int(score) for partition_due_times in await pipe.execute()
+                 for field, score in partition_due_times}
+    if not due_times:
+        return {}, {}
+
+    launch_monitors = {field: load_launch_monitor(field, value)
+                       for field, value in (await _get_launch_monitors(due_times)).items()}
+    return launch_monitors, due_times
+
+
+async def save_launch_monitors(launch_monitors: Dict[str, list], stored_launch_monitors: Dict[str, Optional[list]],
+                               due_times: Dict[str, Optional[int]] = None,
+                               stored_due_times: Dict[str, int] = None, pipe=None) -> int:
+    """
+    Writes only the launch monitors and next alert times that differ from what is
+    stored.  Stored monitors missing from launch_monitors, and stored due times
+    that are missing or None in due_times, are removed.  If a pipeline is given
+    the writes are only queued on it, for the caller to execute.
+
+    :returns: The number of monitors and due times written or removed
+    """
+    due_times = due_times or {}
+    stored_due_times = stored_due_times or {}
+
+    changed = {field: json.dumps(data, separators=(",", ":")) for field, data in launch_monitors.items()
+               if stored_launch_monitors.get(field) != data}
+    removed = [field for field in stored_launch_monitors if field not in launch_monitors]
+    changed_due = {field: due for field, due in due_times.items()
+                   if due is not None and stored_due_times.get(field) != due}
+    removed_due = [field for field in stored_due_times if due_times.get(field) is None]
+
+    execute = pipe is None
+    if execute:
+        pipe = db.pipeline()
+    for partition, fields in group_by_partition(changed).items():
+        pipe.hset(get_launch_monitors_key(partition), mapping={field: changed[field] for field in fields})
+    for partition, fields in group_by_partition(removed).items():
+        pipe.hdel(get_launch_monitors_key(partition), *fields)
+    for partition, fields in group_by_partition(changed_due).items():
+        pipe.zadd(get_due_key(partition), {field: changed_due[field] for field in fields})
+    for partition, fields in group_by_partition(removed_due).items():
+        pipe.zrem(get_due_key(partition), *fields)
+    if execute:
+        await pipe.execute()
+    return len(changed) + len(removed) + len(changed_due) + len(removed_due)
+
+
+def get_sent_alert_key(channel: str, launch_slug: str, launch_win_open: int) -> str:
+    return "{}-{}-{}-{}".format(SENT_ALERT_KEY_PREFIX, channel, launch_slug, launch_win_open)
+
+
+async def record_sent_alert(channel: str, launch_slug: str, launch_win_open: int, alert_time: int) -> bool:
+    """
+    Records that the alert scheduled for alert_time has been sent to the channel
+    for this launch window.  Works as an atomic claim, so only the first caller
+    for an alert gets True and should send it.
+    """
+    key_name = get_sent_alert_key(channel, launch_slug, launch_win_open)
+    pipe = db.pipeline()
+    pipe.sadd(key_name, alert_time)
+    pipe.expireat(key_name, launch_win_open + SENT_ALERT_EXPIRE_SECONDS)
+    added, _ = await pipe.execute()
+    return added == 1
+
+
+async def forget_sent_alert(channel: str, launch_slug: str, launch_win_open: int, alert_time: int) -> None:
+    """Undoes record_sent_alert after sending failed, so the alert can be retried."""
+    await db.srem(get_sent_alert_key(channel, launch_slug, launch_win_open), alert_time)
+
+
+async def migrate_launch_monitors_blob() -> int:
+    """
+    One-time migration of the legacy launch-monitors JSON blob into the per-monitor hash.
+
+    :returns: The number of launch monitors migrated
+    """
+    launch_monitors_from_db = await db.get(LAUNCH_MONITORS_KEY)
+    if not launch_monitors_from_db:
+        return 0
+
+    launch_monitors = {}
+    for launch_monitor in json.loads(launch_monitors_from_db):
+        last_alert = launch_monitor["last_alert"]
+        field = get_launch_monitor_field(launch_monitor["channel"], launch_monitor["launch_slug"])
+        launch_monitors[field] = [
+            launch_monitor["server"],
+            launch_monitor["channel"],
+            launch_monitor["launch_slug"],
+            int(datetime.strptime(launch_monitor["launch_win_open"], ISOFORMAT).timestamp()),
+            int(datetime.strptime(last_alert, ISOFORMAT).timestamp()) if last_alert else None
+        ]
+
+    await save_launch_monitors(launch_monitors, {})
+    await db.delete(LAUNCH_MONITORS_KEY)
+    return len(launch_monitors)
+
+
+async def migrate_launch_monitors_to_partitions() -> int:
+    """
+    One-time migration of the single launch monitors hash into one per partition.
+
+    :returns: The number of launch monitors migrated
+    """
+    launch_monitors = await db.hgetall(LAUNCH_MONITORS_HASH_KEY)
+    if not launch_monitors:
+        return 0
+
+    pipe = db.pipeline()
+    for partition, fields in group_by_partition(launch_monitors).items():
+        pipe.hset(get_launch_monitors_key(partition), mapping={field: launch_monitors[field] for field in fields})
+    pipe.delete(LAUNCH_MONITORS_HASH_KEY)
+    await pipe.execute()
+    return len(launch_monitors)
+
+
+async def migrate_due_times_to_partitions() -> int:
+    """
+    One-time migration of the single due times sorted set into one per partition.
+
+    :returns: The number of due times migrated
+    """
+    due_times = {field: int(score) for field, score in await db.zrange(LAUNCH_MONITORS_DUE_KEY, 0, -1, withscores=True)}
+    if not due_times:
+        return 0
+
+    await save_launch_monitors({}, {}, due_times, {})
+    await db.delete(LAUNCH_MONITORS_DUE_KEY)
+    return len(due_times)
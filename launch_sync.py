@@ -0,0 +1,117 @@
+import json
+from datetime import datetime
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+from launch import Launch
+from partitions import all_partitions
+from redis_utils import db
+
+KNOWN_LAUNCHES_KEY = "known-launches"  # Legacy hash of slug -> last synced launch data
+# One hash per partition of the launches as its monitors were last synced, so a process that takes over a
+# partition diffs against what that partition's subscribers were told rather than what another process saw
+KNOWN_LAUNCHES_KEY_PREFIX = "known-launches"
+
+
+class LaunchDiff:
+    """What changed in the upcoming launches since they were last synced."""
+    __slots__ = ("added", "removed", "moved", "updated")
+
+    def __init__(self, added: List[Launch], removed: List[Launch], moved: List[Tuple[Launch, Launch]],
+                 updated: List[Launch]):
+        self.added = added
+        self.removed = removed
+        self.moved = moved  # (old, new) pairs whose launch window changed
+        self.updated = updated  # Any other change, e.g. the live stream or mission details
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved or self.updated)
+
+    def __repr__(self):
+        return "LaunchDiff(added={}, removed={}, moved={}, updated={})".format(
+            [launch.slug for launch in self.added], [launch.slug for launch in self.removed],
+            [new.slug for _, new in self.moved], [launch.slug for launch in self.updated])
+
+
+def diff_launches(known_launches: Dict[str, Launch], upcoming_launches: List[Launch]) -> LaunchDiff:
+    upcoming_by_slug = {launch.slug: launch for launch in upcoming_launches}
+    added, moved, updated = [], [], []
+    for slug, launch in upcoming_by_slug.items():
+        known_launch = known_launches.get(slug)
+        if known_launch is None:
+            added.append(launch)
+        elif known_launch.win_open != launch.win_open:
+            moved.append((known_launch, launch))
+        elif known_launch.version != launch.version:
+            updated.append(launch)
+    removed = [launch for slug, launch in known_launches.items() if slug not in upcoming_by_slug]
+    return LaunchDiff(added, removed, moved, updated)
+
+
+def merge_diffs(diffs: Iterable[LaunchDiff]) -> LaunchDiff:
+    """One diff with every change in diffs, each launch only once."""
+    added, removed, moved, updated = {}, {}, {}, {}
+    for diff in diffs:
+        added.update((launch.slug, launch) for launch in diff.added)
+        removed.update((launch.slug, launch) for launch in diff.removed)
+        moved.update((new.slug, (old, new)) for old, new in diff.moved)
+        updated.update((launch.slug, launch) for launch in diff.updated)
+    return LaunchDiff(list(added.values()), list(removed.values()), list(moved.values()), list(updated.values()))
+
+
+def get_known_launches_key(partition: int) -> str:
+    return "{}-{}".format(KNOWN_LAUNCHES_KEY_PREFIX, partition)
+
+
+async def get_known_launches(partitions: Collection[int]) -> Dict[int, Dict[str, Launch]]:
+    """The known launches of each partition, keyed by slug."""
+    pipe = db.pipeline(transaction=False)
+    for partition in partitions:
+        pipe.hgetall(get_known_launches_key(partition))
+    return {partition: {slug: Launch.load(json.loads(data)) for slug, data in known_launches.items()}
+            for partition, known_launches in zip(partitions, await pipe.execute())}
+
+
+async def get_known_launch_slugs() -> List[str]:
+    """Slugs known to any partition."""
+    pipe = db.pipeline(transaction=False)
+    for partition in all_partitions():
+        pipe.hkeys(get_known_launches_key(partition))
+    return sorted({slug for slugs in await pipe.execute() for slug in slugs})
+
+
+async def save_known_launches(diffs: Dict[int, LaunchDiff]) -> None:
+    """Applies each partition's diff to its known launches."""
+    pipe = db.pipeline()
+    for partition, diff in diffs.items():
+        key = get_known_launches_key(partition)
+        changed = {launch.slug: json.dumps(launch.dump())
+                   for launch in diff.added + [new for _, new in diff.moved] + diff.updated}
+        if changed:
+            pipe.hset(key, mapping=changed)
+        if diff.removed:
+            pipe.hdel(key, *[launch.slug for launch in diff.removed])
+    await pipe.execute()
+
+
+async def migrate_known_launches_to_partitions() -> int:
+    """
+    One-time migration of the single known launches hash into one per partition.
+
+    :returns: The number of known launches migrated
+    """
+    known_launches = await db.hgetall(KNOWN_LAUNCHES_KEY)
+    if not known_launches:
+        return 0
+
+    pipe = db.pipeline()
+    for partition in all_partitions():
+        pipe.hset(get_known_launches_key(partition), mapping=known_launches)
+    pipe.delete(KNOWN_LAUNCHES_KEY)
+    await pipe.execute()
+    return len(known_launches)
+
+
+def get_moved_seconds(old_win_open: Optional[datetime], new_win_open: Optional[datetime]) -> Optional[int]:
+    """How far a launch window moved, positive when it moved later."""
+    if old_win_open and new_win_open:
+        return int((new_win_open - old_win_open).total_seconds())
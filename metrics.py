@@ -0,0 +1,209 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+from aiohttp import web
+from logbook import Logger
+
+log = Logger('Metrics')
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    TYPE = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, Any], float]]:
+        for key, value in self._values.items():
+            yield self.name, dict(zip(self.label_names, key)), value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.TYPE}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels) -> None:
+        """For counters that are kept elsewhere and copied in by a collector."""
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # Per-bucket counts, then sum and count
+            series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[Dict[str, Any]]:
+        """
+        Observes the time taken by the block.  Labels can be filled in or
+        changed inside the block, e.g. with the status of a response.
+        """
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, Any], float]]:
+        for key, (bucket_counts, total, count) in self._values.items():
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bucket)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """
+    Metrics for this process, rendered in the Prometheus text format.
+    Collectors are called before each render to update metrics that are
+    read from elsewhere, such as cache stats.
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: Metric) -> Any:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help_text, label_names, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                log.exception("Error collecting metrics: {}".format(e))
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry(prefix="launch_alerts_")
+
+TICK_SECONDS = registry.histogram("tick_seconds", "Duration of one run of a periodic task", ("task",))
+STAGE_SECONDS = registry.histogram("stage_seconds", "Duration of one stage of a periodic task", ("stage",))
+LAUNCH_CHANGES = registry.counter("launch_changes_total", "Changes seen in the upcoming launches, by kind", ("change",))
+ALERTS_DUE = registry.counter("alerts_due_total", "Launch alerts claimed as due")
+ALERTS_SENT = registry.counter("alerts_sent_total", "Launch alerts delivered, by result", ("result",))
+ALERT_LATENCY_SECONDS = registry.histogram("alert_latency_seconds", "Time from an alert being claimed to it being sent",
+                                           buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+UPSTREAM_SECONDS = registry.histogram("upstream_request_seconds", "Upstream API request latency",
+                                      ("endpoint", "status"))
+UPSTREAM_CIRCUIT_STATE = registry.gauge("upstream_circuit_state", "Upstream circuit breaker: 0 closed, 1 half open, 2 open",
+                                        ("upstream",))
+REDIS_CALLS = registry.counter("redis_calls_total", "Redis round-trips, by command", ("command",))
+CACHE_REQUESTS = registry.counter("cache_requests_total", "Cache lookups since start, by result", ("cache", "result"))
+CACHE_SIZE = registry.gauge("cache_size", "Entries held in each cache", ("cache",))
+DISCORD_SEND_SECONDS = registry.histogram("discord_send_seconds", "Latency of sending a message to Discord")
+OUTBOX_DEPTH = registry.gauge("outbox_depth", "Alerts in each shard's outbox waiting to be delivered or retried",
+                              ("shard",))
+OUTBOX_LAG_SECONDS = registry.gauge("outbox_lag_seconds", "Age of the oldest alert in each shard's outbox", ("shard",))
+OUTBOX_DEAD_LETTERS = registry.gauge("outbox_dead_letters", "Alerts given up on after too many failed attempts")
+OUTBOX_RETRIES = registry.counter("outbox_retries_total", "Alerts claimed again after a failed or abandoned delivery",
+                                  ("shard",))
+SHARD_LATENCY_SECONDS = registry.gauge("shard_latency_seconds", "Gateway heartbeat latency of each shard", ("shard",))
+GATEWAY_EVENTS = registry.counter("gateway_events_total", "Gateway events received, by the shard of their guild",
+                                  ("shard",))
+
+
+def register_cache(name: str, cache) -> None:
+    """Export the stats() of an LRUCache or AsyncTTLCache."""
+    def collect():
+        for result, value in cache.stats().items():
+            if result == "size":
+                CACHE_SIZE.set(value, cache=name)
+            else:
+                CACHE_REQUESTS.set(value, cache=name, result=result)
+    registry.add_collector(collect)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve the metrics on http://host:port/metrics."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
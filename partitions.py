@@ -0,0 +1,141 @@
+import asyncio
+import math
+import os
+import socket
+import time
+import zlib
+from typing import Callable, Collection, List, Optional, Set
+from uuid import uuid4
+
+import redis
+from logbook import Logger
+from redis.exceptions import RedisError
+
+from local_config import ALERT_PARTITIONS
+from redis_utils import db
+
+WORKERS_KEY = "alert-workers"  # Sorted set of worker id -> last heartbeat
+LEASE_KEY_PREFIX = "alert-partition-lease"
+
+log = Logger('Partitions')
+
+
+def get_partition(channel_id) -> int:
+    """Partition of a channel or user id, the same in every process."""
+    return zlib.crc32(str(channel_id).encode()) % ALERT_PARTITIONS
+
+
+def get_field_partition(field: str) -> int:
+    """Partition of a launch monitor hash field, which starts with the channel or user id."""
+    return get_partition(field.split(":", 1)[0])
+
+
+def get_subscriber_partition(key_name: str) -> int:
+    """Partition of a config DB key, which ends with the channel or user id."""
+    return get_partition(key_name.rsplit("-", 1)[1])
+
+
+def all_partitions() -> List[int]:
+    return list(range(ALERT_PARTITIONS))
+
+
+def get_lease_key(partition: int) -> str:
+    return "{}-{}".format(LEASE_KEY_PREFIX, partition)
+
+
+def _update_own_lease(client: redis.StrictRedis, key: str, worker_id: str, ttl_ms: Optional[int]) -> bool:
+    """Extends the lease by ttl_ms, or releases it if ttl_ms is None, only if worker_id still holds it."""
+    def update(pipe):
+        if pipe.get(key) != worker_id:
+            return False
+        pipe.multi()
+        if ttl_ms:
+            pipe.pexpire(key, ttl_ms)
+        else:
+            pipe.delete(key)
+        return True
+    return client.transaction(update, key, value_from_callable=True)
+
+
+class PartitionLeases:
+    """
+    Splits launch monitors between alert worker processes.  Each worker
+    heartbeats into WORKERS_KEY and holds Redis leases on up to its fair share
+    of the partitions, renewing them every third of lease_seconds.  When a
+    worker joins, the others release their extra partitions for it, and when
+    one stops renewing its leases expire and the rest pick them up.
+    """
+
+    def __init__(self, partitions: int, lease_seconds: int, worker_id: str = None):
+        self.partitions = partitions
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid4().hex[:8])
+        self.owned: Set[int] = set()
+        self.renewed_at = 0.0
+
+    async def refresh(self) -> bool:
+        """
+        Renews held leases and rebalances partitions between live workers.
+
+        :returns: Whether the owned partitions changed
+        """
+        now = time.time()
+        ttl_ms = self.lease_seconds * 1000
+        pipe = db.pipeline()
+        pipe.zadd(WORKERS_KEY, {self.worker_id: now})
+        pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - self.lease_seconds)
+        pipe.zcard(WORKERS_KEY)
+        pipe.mget([get_lease_key(partition) for partition in range(self.partitions)])
+        _, _, workers, owners = await pipe.execute()
+        fair_share = math.ceil(self.partitions / max(workers, 1))
+
+        owned = set()
+        for partition in sorted(self.owned):
+            if owners[partition] != self.worker_id:
+                log.warning(f"[partition={partition}] lease lost")
+                continue
+            release = len(owned) >= fair_share
+            if await db.run(_update_own_lease, db.client, get_lease_key(partition), self.worker_id,
+                            None if release else ttl_ms) and not release:
+                owned.add(partition)
+
+        free = [partition for partition in range(self.partitions) if owners[partition] is None]
+        wanted = free[:max(fair_share - len(owned), 0)]
+        if wanted:
+            pipe = db.pipeline(transaction=False)
+            for partition in wanted:
+                pipe.set(get_lease_key(partition), self.worker_id, nx=True, px=ttl_ms)
+            for partition, acquired in zip(wanted, await pipe.execute()):
+                if acquired:
+                    owned.add(partition)
+
+        self.renewed_at = now
+        changed = owned != self.owned
+        if changed:
+            log.info(f"[worker={self.worker_id}, workers={workers}] now owns partitions {sorted(owned)}")
+        self.owned = owned
+        return changed
+
+    async def release_all(self) -> None:
+        for partition in self.owned:
+            await db.run(_update_own_lease, db.client, get_lease_key(partition), self.worker_id, None)
+        await db.zrem(WORKERS_KEY, self.worker_id)
+        self.owned = set()
+
+    async def run(self, on_change: Callable[[Collection[int]], None]) -> None:
+        try:
+            while True:
+                try:
+                    changed = await self.refresh()
+                except RedisError as e:
+                    log.error(f"Error renewing partition leases: {e}")
+                    # Past this point another worker may have taken them over
+                    changed = bool(self.owned) and time.time() - self.renewed_at > self.lease_seconds
+                    if changed:
+                        self.owned = set()
+                if changed:
+                    on_change(set(self.owned))
+                await asyncio.sleep(self.lease_seconds / 3)
+        finally:
+            if self.owned:
+                await self.release_all()
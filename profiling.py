@@ -0,0 +1,73 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from logbook import Logger
+
+log = Logger('Profiling')
+
+
+class Profiler:
+    """
+    Profiles the next few runs of a task or command with cProfile, once armed.
+    Each run is written to `directory` as a .prof file for pstats/snakeviz,
+    along with a .txt summary of the top functions by cumulative time.
+
+    Only one run is profiled at a time.  cProfile sees every coroutine that
+    runs on the event loop meanwhile, not just the profiled one.
+    """
+
+    def __init__(self, directory: str, top_functions: int = 30):
+        self.directory = directory
+        self.top_functions = top_functions
+        self._remaining: Dict[str, int] = {}
+        self._active: Optional[str] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._runs = 0
+
+    def arm(self, target: str, count: int = 1) -> None:
+        self._remaining[target] = count
+        log.info(f"[target={target}] profiling the next {count} runs")
+
+    def start(self, target: str) -> None:
+        if not self._remaining.get(target) or self._active is not None:
+            return
+        self._active = target
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, target: str) -> Optional[str]:
+        """Finish profiling target if it was being profiled, returning the path of the summary."""
+        if self._active != target:
+            return None
+        self._profile.disable()
+        profile, self._profile, self._active = self._profile, None, None
+        self._remaining[target] -= 1
+        if not self._remaining[target]:
+            del self._remaining[target]
+        return self._write(target, profile)
+
+    @contextmanager
+    def profile(self, target: str):
+        self.start(target)
+        try:
+            yield
+        finally:
+            self.stop(target)
+
+    def _write(self, target: str, profile: cProfile.Profile) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        self._runs += 1
+        path = os.path.join(self.directory, "{}-{}-{}".format(target, time.strftime("%Y%m%d-%H%M%S"), self._runs))
+        profile.dump_stats(path + ".prof")
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(self.top_functions)
+        with open(path + ".txt", "w") as summary_file:
+            summary_file.write(summary.getvalue())
+        log.info(f"[target={target}] profile written to {path}.prof, summary in {path}.txt")
+        return path + ".txt"
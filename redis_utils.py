@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import redis
+
+from metrics import REDIS_CALLS
+from local_config import REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_UNIX_SOCKET, REDIS_MAX_CONNECTIONS, \
+    REDIS_BLOCKING_CONNECTIONS
+
+
+def new_connection_pool(max_connections: int = REDIS_MAX_CONNECTIONS) -> redis.BlockingConnectionPool:
+    """Connection pool shared by every Redis client in the bot, configured in local_config."""
+    if REDIS_UNIX_SOCKET:
+        return redis.BlockingConnectionPool(connection_class=redis.UnixDomainSocketConnection,
+                                            path=REDIS_UNIX_SOCKET, db=REDIS_DB,
+                                            max_connections=max_connections, decode_responses=True)
+    return redis.BlockingConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB,
+                                        max_connections=max_connections, decode_responses=True)
+
+
+class AsyncPipeline:
+    """Queues commands like a normal pipeline, but execute() has to be awaited."""
+
+    def __init__(self, pipe: redis.client.Pipeline, async_redis: "AsyncRedis"):
+        self._pipe = pipe
+        self._async_redis = async_redis
+
+    def __getattr__(self, item):
+        return getattr(self._pipe, item)
+
+    async def execute(self) -> list:
+        return await self._async_redis.run_command("pipeline", self._pipe.execute)
+
+
+class AsyncRedis:
+    """
+    Awaitable wrapper around a redis.StrictRedis client.  Commands run on a
+    dedicated thread pool sized to the connection pool so that Redis I/O never
+    blocks the discord.py event loop.
+
+    redis.asyncio needs async-timeout>=4, which conflicts with the aiohttp<3.8
+    pin discord.py 1.7 requires, so the sync client is used from threads instead.
+    """
+
+    def __init__(self, client: redis.StrictRedis, max_workers: int):
+        self.client = client
+        self.round_trips = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="redis")
+
+    def __getattr__(self, item):
+        command = getattr(self.client, item)
+
+        async def run_command(*args, **kwargs):
+            return await self.run_command(item, command, *args, **kwargs)
+
+        return run_command
+
+    async def run(self, func, *args, **kwargs):
+        """Run any other blocking Redis call, such as a PubSub method, on the Redis thread pool."""
+        return await self.run_command(func.__name__, func, *args, **kwargs)
+
+    async def run_command(self, name: str, func, *args, **kwargs):
+        self.round_trips += 1
+        REDIS_CALLS.inc(command=name)
+        return await asyncio.get_event_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def pipeline(self, transaction: bool = True) -> AsyncPipeline:
+        return AsyncPipeline(self.client.pipeline(transaction=transaction), self)
+
+
+# Connections are only opened on first use, so importing this module does no I/O
+sync_db = redis.StrictRedis(connection_pool=new_connection_pool())  # Sync shim for tests and scripts
+db = AsyncRedis(sync_db, max_workers=REDIS_MAX_CONNECTIONS)
+# Calls that wait on Redis, like the alert outbox's blocking reads and pub/sub, hold a thread and a connection
+# until they return, so they get their own to keep them from starving every other command
+blocking_sync_db = redis.StrictRedis(connection_pool=new_connection_pool(REDIS_BLOCKING_CONNECTIONS))
+blocking_db = AsyncRedis(blocking_sync_db, max_workers=REDIS_BLOCKING_CONNECTIONS)
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+from logbook import Logger
+
+from launch import Launch
+from metrics import UPSTREAM_SECONDS, UPSTREAM_CIRCUIT_STATE
+
+API_URL = "https://fdo.rocketlaunch.live/json"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+log = Logger('Rocketlaunch.live')
+
+
+class UpstreamError(Exception):
+    """rocketlaunch.live couldn't answer within the deadline."""
+
+
+class UpstreamClientError(UpstreamError):
+    """rocketlaunch.live rejected the request with a 4xx, e.g. for an unknown slug, but is up."""
+
+
+class CircuitOpenError(UpstreamError):
+    """Calls are failing fast because rocketlaunch.live has been failing."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures so callers fail fast
+    instead of waiting on an upstream that is down.  After `reset_timeout`
+    seconds one trial call is let through; it closes the circuit if it
+    succeeds and re-opens it if it fails.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            log.info("Circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_inconclusive(self) -> None:
+        """The call failed for a reason that says nothing about the upstream, e.g. it was cancelled."""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                log.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.time()
+        self._trial_in_flight = False
+
+
+class RocketLaunchLiveClient:
+    """
+    rocketlaunch.live API client.  Owns the aiohttp session the bot uses for
+    its upstream requests.
+
+    Each call has a total deadline.  Connection errors, timeouts, 429 and 5xx
+    responses are retried with short exponential delays while there is time
+    left; other errors are raised straight away.  Upstream failures raise
+    UpstreamError and count towards the circuit breaker.  Other 4xx responses
+    raise UpstreamClientError and don't, since callers can cause them.
+    """
+
+    def __init__(self, token: str, connector: aiohttp.BaseConnector = None, deadline: float = 10,
+                 attempt_timeout: float = 5, max_attempts: int = 3, failure_threshold: int = 5,
+                 reset_timeout: float = 30, api_url: str = API_URL):
+        self.token = token
+        self.api_url = api_url
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.last_error: Optional[str] = None
+
+    async def get_next_launches(self, args: Sequence, deadline: float = None) -> List[Launch]:
+        # Uses slash to separate parameters
+        js = await self._get_json("launch_next", "/launch/next/{}".format("/".join(args)), deadline)
+        return [Launch.from_api(launch) for launch in js["result"]]
+
+    async def get_launch(self, slug: str, deadline: float = None) -> Optional[Launch]:
+        js = await self._get_json("launch", "/launch/{}".format(slug), deadline)
+        if js["result"]:
+            return Launch.from_api(js["result"][0])
+        return None
+
+    def state(self) -> Dict[str, Any]:
+        return {"circuit": self.breaker.state, "failures": self.breaker.failures, "last_error": self.last_error}
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def _get_json(self, endpoint: str, path: str, deadline: float = None) -> dict:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{endpoint}: circuit open after {self.breaker.failures} failures")
+
+        try:
+            js = await self._get_json_with_retries(endpoint, path, deadline or self.deadline)
+        except UpstreamClientError:
+            self.breaker.record_success()  # It answered
+            raise
+        except UpstreamError as e:
+            self.last_error = str(e)
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.record_inconclusive()
+            raise
+        else:
+            self.breaker.record_success()
+            return js
+        finally:
+            UPSTREAM_CIRCUIT_STATE.set(self._circuit_state_value(), upstream="rocketlaunch.live")
+
+    async def _get_json_with_retries(self, endpoint: str, path: str, deadline: float) -> dict:
+        headers = {"Authorization": f"Bearer {self.token}"}
+        give_up_at = time.monotonic() + deadline
+        delay = 0.5
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = give_up_at - time.monotonic()
+            with UPSTREAM_SECONDS.time(endpoint=endpoint, status="error") as labels:
+                try:
+                    async with self.session.get(self.api_url + path, headers=headers,
+                                                timeout=aiohttp.ClientTimeout(total=min(remaining, self.attempt_timeout))) as response:
+                        labels["status"] = response.status
+                        if response.status == 200:
+                            return await response.json()
+                        error = f"{endpoint}: HTTP {response.status}"
+                        if response.status < 500 and response.status not in RETRY_STATUSES:
+                            raise UpstreamClientError(error)
+                        if response.status not in RETRY_STATUSES:
+                            raise UpstreamError(error)
+                except aiohttp.ContentTypeError as e:
+                    raise UpstreamError(f"{endpoint}: unexpected response {e}")
+                except RETRY_EXCEPTIONS as e:
+                    labels["status"] = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                    error = f"{endpoint}: {type(e).__name__} {e}"
+
+            if attempt == self.max_attempts or give_up_at - time.monotonic() <= delay:
+                break
+            log.warning(f"[attempt={attempt}] {error}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay *= 2
+        raise UpstreamError(error)
+
+    def _circuit_state_value(self) -> int:
+        return {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}[self.breaker.state]
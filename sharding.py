@@ -0,0 +1,85 @@
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from discord.ext import commands
+
+from metrics import GATEWAY_EVENTS, SHARD_LATENCY_SECONDS
+
+DM_SHARD_ID = 0  # Discord only sends direct message events to shard 0
+GUILD_EVENTS = {"GUILD_CREATE", "GUILD_UPDATE", "GUILD_DELETE"}  # Have the guild's own id instead of a guild_id
+
+
+def get_shard_id(server_id: Optional[str], shard_count: int) -> int:
+    """The shard that owns a guild, or the one DMs are sent from if there's no guild."""
+    if not server_id:
+        return DM_SHARD_ID
+    return (int(server_id) >> 22) % shard_count
+
+
+class ShardStats:
+    """
+    Latency and gateway event rate of each shard this process runs.  discord.py
+    doesn't say which shard an event arrived on, so events are counted against
+    the shard of their guild, and ones without a guild against DM_SHARD_ID.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.events: Dict[int, int] = defaultdict(int)
+        self._last_events: Dict[int, int] = {}
+        self._last_at = time.time()
+
+    def record_event(self, msg: dict) -> None:
+        shard_count = self.bot.shard_count
+        if not shard_count or msg.get("op") != 0:  # Only dispatched events
+            return
+        data = msg.get("d")
+        guild_id = None
+        if isinstance(data, dict):
+            guild_id = data.get("id") if msg.get("t") in GUILD_EVENTS else data.get("guild_id")
+        shard_id = get_shard_id(guild_id, shard_count)
+        self.events[shard_id] += 1
+        GATEWAY_EVENTS.inc(shard=shard_id)
+
+    def stats(self) -> Dict[int, Dict[str, float]]:
+        """Each shard's latency, and its events per second since the last call."""
+        now = time.time()
+        elapsed = max(now - self._last_at, 1e-9)
+        stats = {}
+        for shard_id, latency in self.bot.latencies:
+            events = self.events.get(shard_id, 0)
+            stats[shard_id] = {
+                "latency": round(latency, 3),
+                "events_per_second": round((events - self._last_events.get(shard_id, 0)) / elapsed, 2),
+            }
+        self._last_events = dict(self.events)
+        self._last_at = now
+        return stats
+
+    def collect(self) -> None:
+        """Metrics collector for the shard latencies."""
+        for shard_id, latency in self.bot.latencies:
+            SHARD_LATENCY_SECONDS.set(latency, shard=shard_id)
+
+
+class ShardedBot(commands.AutoShardedBot):
+    """
+    AutoShardedBot that keeps ShardStats.  Events are counted as they are
+    dispatched instead of in an on_socket_response listener, which would start
+    a task for every gateway event.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard_stats = ShardStats(self)
+
+    def dispatch(self, event_name, *args, **kwargs):
+        if event_name == "socket_response":
+            self.shard_stats.record_event(args[0])
+        super().dispatch(event_name, *args, **kwargs)
+
+    @property
+    def local_shard_ids(self):
+        """The shards run by this process."""
+        return self.shard_ids or range(self.shard_count or 1)
@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+
+from acronym_utils import AcronymDictionary
+
+
+class TestAcronymDictionary(unittest.TestCase):
+
+    def setUp(self):
+        self.dictionary = AcronymDictionary({
+            "LEO": ["Low Earth Orbit"],
+            "LES": ["Launch Escape System"],
+            "GTO": ["Geosynchronous Transfer Orbit"],
+            "GEO": ["Geostationary Earth Orbit"],
+        })
+
+    def test_lookup(self):
+        self.assertEqual(self.dictionary.lookup("leo"), ["Low Earth Orbit"])
+        self.assertEqual(self.dictionary.lookup("MEO"), [])
+
+    def test_prefix_lookup(self):
+        self.assertEqual(self.dictionary.prefix_lookup("le"), ["LEO", "LES"])
+        self.assertEqual(self.dictionary.prefix_lookup("le", limit=1), ["LEO"])
+        self.assertEqual(self.dictionary.prefix_lookup("X"), [])
+
+    def test_suggest(self):
+        self.assertIn("GTO", self.dictionary.suggest("GT0"))
+        self.assertEqual(self.dictionary.suggest("L")[:2], ["LEO", "LES"])
+
+
+class TestAcronymDictionaryRefresh(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.dictionary = AcronymDictionary(refresh_timeout=0.05)
+        self.dictionary._refresh = self._refresh
+
+    async def _refresh(self, session):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+
+    async def test_waiters_dont_clear_a_running_refresh(self):
+        waiter = asyncio.ensure_future(self.dictionary.refresh(None))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        await self.dictionary.refresh(None)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(self.dictionary._refresh_task)
+
+    async def test_hung_refresh_times_out(self):
+        async def hang(session):
+            await asyncio.sleep(60)
+
+        self.dictionary._refresh = hang
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.dictionary.refresh(None)
+        self.assertIsNone(self.dictionary._refresh_task)
@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+
+from alert_delivery import AlertDelivery
+from test_alert_outbox import get_alert
+
+
+class TestAlertDelivery(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.sends = []
+        self.failing = set()
+
+    async def send(self, alerts):
+        self.sends.append([alert.channel for alert in alerts])
+        if alerts[0].channel in self.failing:
+            raise Exception("Missing Permissions")
+
+    async def test_alerts_for_a_channel_are_sent_together(self):
+        delivery = AlertDelivery(self.send, concurrency=2, alerts_per_send=3)
+        alerts = [get_alert("1"), get_alert("2"), get_alert("1"), get_alert("1"), get_alert("1")]
+        self.assertEqual(await delivery.deliver(alerts), [True] * 5)
+        # In order within a channel
+        self.assertEqual([send for send in self.sends if send[0] == "1"], [["1", "1", "1"], ["1"]])
+        self.assertIn(["2"], self.sends)
+        self.assertEqual(delivery.stats()["sent"], 5)
+        self.assertEqual(delivery._channel_locks, {})
+
+    async def test_failed_send_fails_its_alerts(self):
+        self.failing.add("2")
+        delivery = AlertDelivery(self.send, concurrency=2)
+        alerts = [get_alert("1"), get_alert("2"), get_alert("2")]
+        self.assertEqual(await delivery.deliver(alerts), [True, False, False])
+        self.assertEqual(delivery.stats()["failed"], 2)
+
+    async def test_overlapping_deliveries_keep_channel_order(self):
+        async def send(alerts):
+            self.sends.append("start " + alerts[0].launch)
+            await asyncio.sleep(0.01)
+            self.sends.append("end " + alerts[0].launch)
+
+        delivery = AlertDelivery(send, concurrency=10, alerts_per_send=1)
+        first = [get_alert("1"), get_alert("1")]
+        second = [get_alert("1")]
+        for i, alert in enumerate(first + second):
+            alert.launch = str(i)
+        first_delivery = asyncio.ensure_future(delivery.deliver(first))
+        # Starts after the lock was handed from the first send to the second
+        await asyncio.sleep(0.015)
+        await asyncio.gather(first_delivery, delivery.deliver(second))
+        self.assertEqual(self.sends, ["start 0", "end 0", "start 1", "end 1", "start 2", "end 2"])
+        self.assertEqual(delivery._channel_locks, {})
+        self.assertEqual(delivery._channel_lock_users, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+import unittest
+
+import redis_utils
+from alert_outbox import AlertOutbox, OutboxAlert, ALERT, LAUNCH_MOVED, append_alerts, migrate_outbox_to_shards, \
+    get_outbox_key, OUTBOX_STREAM_KEY, DEAD_LETTERS_KEY
+from fake_redis import use_fake_redis
+
+
+def get_alert(channel="754432168293433354", kind=ALERT, moved_from=None, server="360523650912223253"):
+    return OutboxAlert(kind, server, channel, "crs-25", 1644894000, 1644890400, time.time(), moved_from)
+
+
+class TestAlertOutbox(unittest.IsolatedAsyncioTestCase):
+    # Reads don't block, fakeredis doesn't return entries that were already waiting to blocking reads
+
+    def setUp(self):
+        use_fake_redis(self)
+        self.sent = []
+        self.failing = set()
+
+    async def deliver(self, alerts):
+        self.sent.extend(alerts)
+        return [alert.channel not in self.failing for alert in alerts]
+
+    async def test_delivered_alerts_are_acked(self):
+        outbox = AlertOutbox(self.deliver, "worker", retry_after=0, block_ms=None)
+        await outbox.ensure_groups()
+        await outbox.ensure_groups()
+        await append_alerts([get_alert(), get_alert("123456", LAUNCH_MOVED, 1644890000)])
+
+        self.assertEqual(await outbox.process_batch(), 2)
+        self.assertEqual([alert.channel for alert in self.sent], ["754432168293433354", "123456"])
+        self.assertEqual(self.sent[1].kind, LAUNCH_MOVED)
+        self.assertEqual(self.sent[1].moved_from, 1644890000)
+        self.assertIsNone(self.sent[0].moved_from)
+
+        self.assertEqual(await outbox.process_batch(), 0)
+        await outbox.update_stats()
+        self.assertEqual(outbox.stats(), {"depth": 0, "lag": 0.0, "dead_letters": 0})
+
+    async def test_failed_alerts_are_retried_then_dead_lettered(self):
+        outbox = AlertOutbox(self.deliver, "worker", retry_after=0, max_attempts=2, block_ms=None)
+        await outbox.ensure_groups()
+        self.failing.add("123456")
+        await append_alerts([get_alert(), get_alert("123456")])
+
+        self.assertEqual(await outbox.process_batch(), 2)
+        await outbox.update_stats()
+        self.assertEqual(outbox.depth, 1)
+
+        # Another consumer takes over the failed alert, which fails for the last time
+        other = AlertOutbox(self.deliver, "other", retry_after=0, max_attempts=2, block_ms=None)
+        self.assertEqual(await other.process_batch(), 1)
+        self.assertEqual([alert.channel for alert in self.sent], ["754432168293433354", "123456", "123456"])
+
+        await outbox.update_stats()
+        self.assertEqual(outbox.depth, 0)
+        self.assertEqual(outbox.dead_letters, 1)
+        dead_letter = json.loads(redis_utils.sync_db.lindex(DEAD_LETTERS_KEY, 0))
+        self.assertEqual(dead_letter["channel"], "123456")
+        self.assertEqual(redis_utils.sync_db.xlen(get_outbox_key(0)), 0)
+        self.assertEqual(await outbox.process_batch(), 0)
+
+    async def test_alerts_are_routed_to_their_guilds_shard(self):
+        shard_outboxes = [AlertOutbox(self.deliver, "worker", [shard_id], block_ms=None) for shard_id in range(4)]
+        for outbox in shard_outboxes:
+            await outbox.ensure_groups()
+        # (360523650912223253 >> 22) % 4 == 3, DMs go to shard 0
+        await append_alerts([get_alert(), get_alert("123456", server=None)], shard_count=4)
+
+        self.assertEqual([await outbox.process_batch() for outbox in shard_outboxes], [1, 0, 0, 1])
+        self.assertEqual([alert.channel for alert in self.sent], ["123456", "754432168293433354"])
+
+    async def test_one_outbox_reads_every_local_shard(self):
+        outbox = AlertOutbox(self.deliver, "worker", [0, 3], block_ms=None)
+        await outbox.ensure_groups()
+        await append_alerts([get_alert(), get_alert("123456", server=None)], shard_count=4)
+
+        self.assertEqual(await outbox.process_batch(), 2)
+        self.assertEqual(await outbox.process_batch(), 0)
+        await outbox.update_stats()
+        self.assertEqual(outbox.depth, 0)
+        self.assertEqual(redis_utils.sync_db.xlen(get_outbox_key(3)), 0)
+
+    async def test_alerts_being_sent_are_not_retried_elsewhere(self):
+        async def slow_failing_deliver(alerts):
+            self.sent.extend(alerts)
+            await asyncio.sleep(0.5)
+            return [False] * len(alerts)
+
+        outbox = AlertOutbox(slow_failing_deliver, "worker", retry_after=0.2, block_ms=None)
+        other = AlertOutbox(self.deliver, "other", retry_after=0.2, block_ms=None)
+        await outbox.ensure_groups()
+        await append_alerts([get_alert()])
+
+        sending = asyncio.ensure_future(outbox.process_batch())
+        # Sent for longer than retry_after, but still claimed by the first consumer
+        await asyncio.sleep(0.3)
+        self.assertEqual(await other.process_batch(), 0)
+        self.assertEqual(await sending, 1)
+
+        # Once the send has failed, it's retried after retry_after rather than lost
+        self.assertEqual(await other.process_batch(), 0)
+        await asyncio.sleep(0.25)
+        self.assertEqual(await other.process_batch(), 1)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(redis_utils.sync_db.xlen(get_outbox_key(0)), 0)
+
+    async def test_migrate_outbox_to_shards(self):
+        redis_utils.sync_db.xadd(OUTBOX_STREAM_KEY, get_alert().dump())
+        self.assertEqual(await migrate_outbox_to_shards(4), 1)
+        self.assertEqual(await migrate_outbox_to_shards(4), 0)
+        self.assertFalse(redis_utils.sync_db.exists(OUTBOX_STREAM_KEY))
+        self.assertEqual(redis_utils.sync_db.xlen(get_outbox_key(3)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest import mock
+
+import redis_utils
+from alert_outbox import get_outbox_key, OutboxAlert
+from alert_pipeline import claim_due_launch_alerts
+from config import config_cache
+from fake_redis import use_fake_redis
+from launch_monitor_utils import get_launch_monitor_field, save_launch_monitors, get_stored_due_times, \
+    get_stored_launch_monitors, get_due_launch_monitors, get_next_due_time
+from partitions import get_field_partition
+
+DUE = get_launch_monitor_field("1", "crs-25")
+NOT_DUE = get_launch_monitor_field("2", "crs-26")  # In another partition
+
+
+class TestClaimDueLaunchAlerts(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        use_fake_redis(self)
+        config_cache.clear()
+        self.sync_db = redis_utils.sync_db
+        for user in ("1", "2"):
+            self.sync_db.set(f"config-user-{user}", json.dumps({"receive_alerts": "true", "alert_times": "1h, 15m"}))
+
+        self.now = int(time.time())
+        # The 1h alert was due 30 minutes ago, the 15m one is in 15 minutes
+        self.due_win_open = self.now + 30 * 60
+        # Both alerts are hours away
+        self.not_due_win_open = self.now + 3 * 60 * 60
+        await save_launch_monitors({DUE: [None, "1", "crs-25", self.due_win_open, None],
+                                    NOT_DUE: [None, "2", "crs-26", self.not_due_win_open, None]}, {},
+                                   {DUE: self.due_win_open - 60 * 60, NOT_DUE: self.not_due_win_open - 60 * 60}, {})
+
+    def get_outbox(self):
+        return [OutboxAlert.load(entry_id, data) for entry_id, data in self.sync_db.xrange(get_outbox_key(0))]
+
+    async def test_only_due_monitors_are_loaded(self):
+        launch_monitors, due_times = await get_due_launch_monitors(self.now)
+        self.assertEqual(launch_monitors, {DUE: [None, "1", "crs-25", self.due_win_open, None]})
+        self.assertEqual(due_times, {DUE: self.due_win_open - 60 * 60})
+
+        self.assertEqual(await get_due_launch_monitors(self.now, [get_field_partition(NOT_DUE)]), ({}, {}))
+
+    async def test_next_due_time(self):
+        self.assertEqual(await get_next_due_time(), self.due_win_open - 60 * 60)
+        self.assertEqual(await get_next_due_time([get_field_partition(NOT_DUE)]), self.not_due_win_open - 60 * 60)
+        self.sync_db.flushall()
+        self.assertIsNone(await get_next_due_time())
+
+    async def test_claim_reschedules_and_queues_alert(self):
+        alerts = await claim_due_launch_alerts()
+        self.assertEqual([(alert.channel, alert.launch, alert.alert_time) for alert in alerts],
+                         [("1", "crs-25", self.due_win_open - 60 * 60)])
+
+        # Saved as sent and rescheduled to the 15m alert, in the same transaction as the outbox entry
+        self.assertEqual([(alert.channel, alert.alert_time) for alert in self.get_outbox()],
+                         [("1", self.due_win_open - 60 * 60)])
+        self.assertEqual(await get_stored_due_times(), {DUE: self.due_win_open - 15 * 60,
+                                                        NOT_DUE: self.not_due_win_open - 60 * 60})
+        self.assertIsNotNone((await get_stored_launch_monitors())[DUE][4])
+        self.assertEqual(await get_next_due_time(), self.due_win_open - 15 * 60)
+
+        # Nothing more is due until then
+        self.assertEqual(await claim_due_launch_alerts(), [])
+        self.assertEqual(len(self.get_outbox()), 1)
+
+    async def test_failed_claim_changes_nothing(self):
+        stored = await get_stored_launch_monitors()
+        with mock.patch("alert_pipeline.queue_alerts", side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                await claim_due_launch_alerts()
+
+        # Neither marked as sent nor queued, so the next claim still gets it
+        self.assertEqual(await get_stored_launch_monitors(), stored)
+        self.assertEqual(self.get_outbox(), [])
+        self.assertEqual(len(await claim_due_launch_alerts()), 1)
+
+    async def test_concurrent_claims_claim_once(self):
+        results = await asyncio.gather(claim_due_launch_alerts(), claim_due_launch_alerts())
+        self.assertEqual(sorted(len(alerts) for alerts in results), [0, 1])
+        self.assertEqual(len(self.get_outbox()), 1)
+
+    async def test_claims_only_given_partitions(self):
+        self.assertEqual(await claim_due_launch_alerts([get_field_partition(NOT_DUE)]), [])
+        self.assertEqual(len(await claim_due_launch_alerts([get_field_partition(DUE)])), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
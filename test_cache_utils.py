@@ -0,0 +1,76 @@
+import asyncio
+import json
+import time
+import unittest
+
+import redis_utils
+from cache_utils import AsyncTTLCache
+from fake_redis import use_fake_redis
+from launch import Launch
+
+
+class TestAsyncTTLCache(unittest.IsolatedAsyncioTestCase):
+
+    async def test_coalesces_concurrent_fetches(self):
+        cache = AsyncTTLCache(ttl=60, stale_ttl=600)
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"slug": "test-slug"}
+
+        results = await asyncio.gather(*[cache.get("test-slug", fetch) for _ in range(20)])
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result == {"slug": "test-slug"} for result in results))
+
+        self.assertEqual(await cache.get("test-slug", fetch), {"slug": "test-slug"})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.hits, 1)
+
+    async def test_serves_stale_while_revalidating(self):
+        cache = AsyncTTLCache(ttl=0, stale_ttl=600)
+        cache.put("test-slug", "old")
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return "new"
+
+        self.assertEqual(await cache.get("test-slug", fetch), "old")
+        self.assertEqual(cache.stale_hits, 1)
+        await asyncio.sleep(0.05)
+        self.assertEqual(cache.peek("test-slug"), "new")
+
+    async def test_does_not_cache_errors(self):
+        cache = AsyncTTLCache(ttl=60, stale_ttl=600)
+
+        async def fail():
+            raise ValueError("upstream down")
+
+        async def fetch():
+            return "value"
+
+        with self.assertRaises(ValueError):
+            await cache.get("test-slug", fail)
+        self.assertEqual(await cache.get("test-slug", fetch), "value")
+
+    async def test_unreadable_redis_entries_are_misses(self):
+        use_fake_redis(self)
+        # A raw API payload, cached before launches were stored as Launch.dump()
+        redis_utils.sync_db.set("cache-test-crs-25", json.dumps({"value": {"slug": "crs-25", "win_open": "2022-07-15"},
+                                                                 "fetched_at": time.time()}))
+        redis_utils.sync_db.set("cache-test-crs-26", "not json")
+        cache = AsyncTTLCache(ttl=60, stale_ttl=600, redis_prefix="cache-test-", decode=Launch.load)
+
+        self.assertEqual(await cache.warm(["crs-25", "crs-26"]), 0)
+        self.assertIsNone(redis_utils.sync_db.get("cache-test-crs-25"))
+        self.assertIsNone(redis_utils.sync_db.get("cache-test-crs-26"))
+
+        redis_utils.sync_db.set("cache-test-crs-26", "not json")
+
+        async def fetch():
+            return "fetched"
+
+        self.assertEqual(await cache.get("crs-26", fetch), "fetched")
+        self.assertEqual(cache.misses, 1)
+
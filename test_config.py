@@ -0,0 +1,98 @@
+import asyncio
+import json
+import unittest
+
+import redis_utils
+from config import ConfigCache, ChannelConfig, UserConfig, UnknownConfigOption, ALERT_SUBSCRIBERS_KEY, \
+    build_alert_subscribers_index, get_alert_subscriber_keys, config_cache
+from fake_redis import use_fake_redis
+
+
+class TestConfigCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = ConfigCache(2)
+        self.assertEqual(cache.get("config-user-1"), None)
+        cache.put("config-user-1", {"timezone": "EST"})
+        self.assertEqual(cache.get("config-user-1"), {"timezone": "EST"})
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 1, "misses": 1})
+
+    def test_lru_eviction(self):
+        cache = ConfigCache(2)
+        cache.put("config-user-1", {})
+        cache.put("config-user-2", {})
+        cache.get("config-user-1")
+        cache.put("config-user-3", {})
+        self.assertEqual(cache.get("config-user-2"), None)
+        self.assertEqual(cache.get("config-user-1"), {})
+        self.assertEqual(cache.get("config-user-3"), {})
+
+    def test_invalidate(self):
+        cache = ConfigCache(2)
+        cache.put("config-user-1", {"receive_alerts": "true"})
+        cache.invalidate("config-user-1")
+        self.assertEqual(cache.get("config-user-1"), None)
+
+    def test_put_if_unchanged(self):
+        cache = ConfigCache(2)
+        generation = cache.generation("config-user-1")
+        cache.invalidate("config-user-1")  # Changed while it was being read
+        self.assertFalse(cache.put_if_unchanged("config-user-1", {"timezone": "EST"}, generation))
+        self.assertEqual(cache.get("config-user-1"), None)
+
+        generation = cache.generation("config-user-1")
+        cache.clear()
+        self.assertFalse(cache.put_if_unchanged("config-user-1", {"timezone": "EST"}, generation))
+
+        generation = cache.generation("config-user-1")
+        self.assertTrue(cache.put_if_unchanged("config-user-1", {"timezone": "EST"}, generation))
+        self.assertEqual(cache.get("config-user-1"), {"timezone": "EST"})
+
+
+class TestConfig(unittest.TestCase):
+
+    def test_options(self):
+        config = ChannelConfig("360523650912223253", "general", load=False)
+        self.assertEqual(config.timezone, "UTC")
+        config._load_config_data({"timezone": "America/New_York"})
+        self.assertEqual(config.timezone, "America/New_York")
+        self.assertEqual(config.__getattr__("TimeZone"), "America/New_York")
+        self.assertEqual(config.alert_times, "24h, 12h, 6h, 3h, 1h, 15m")
+        self.assertTrue(hasattr(config, "server_id"))
+        self.assertFalse(hasattr(UserConfig("general", load=False), "server_id"))
+
+    def test_unknown_option(self):
+        config = ChannelConfig("360523650912223253", "general", load=False)
+        with self.assertRaises(UnknownConfigOption):
+            config.__setattr__("foo", "bar")
+        with self.assertRaises(UnknownConfigOption):
+            asyncio.run(config.set_option("foo", "bar"))
+        self.assertFalse(hasattr(config, "foo"))
+
+
+class TestAlertSubscribersIndex(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        config_cache.clear()
+
+    async def test_build_alert_subscribers_index(self):
+        sync_db = redis_utils.sync_db
+        sync_db.set("config-channel-1-2", json.dumps({"receive_alerts": "true"}))
+        sync_db.set("config-channel-1-3", json.dumps({"receive_alerts": "false"}))
+        sync_db.set("config-user-4", json.dumps({"receive_alerts": "true", "timezone": "EST"}))
+        sync_db.set("config-user-5", json.dumps({}))
+        sync_db.set("embed-config-user-4", "123")
+
+        self.assertEqual(await build_alert_subscribers_index(), 2)
+        self.assertEqual(await get_alert_subscriber_keys(), {"config-channel-1-2", "config-user-4"})
+
+        # Only runs once, later changes are kept in sync when configs are saved
+        sync_db.srem(ALERT_SUBSCRIBERS_KEY, "config-user-4")
+        self.assertEqual(await build_alert_subscribers_index(), 0)
+        self.assertEqual(await get_alert_subscriber_keys(), {"config-channel-1-2"})
+
+        config = await UserConfig.create("4")
+        await config.set_option("receive_alerts", "true")
+        self.assertEqual(await get_alert_subscriber_keys(), {"config-channel-1-2", "config-user-4"})
+
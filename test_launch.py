@@ -0,0 +1,44 @@
+import unittest
+from datetime import datetime
+
+import pytz
+
+from launch import Launch
+
+
+class TestLaunch(unittest.TestCase):
+
+    def setUp(self):
+        self.api_launch = {
+            "slug": "crs-25",
+            "name": "CRS-25",
+            "t0": None,
+            "win_open": "2022-07-15T00:44:00Z",
+            "date_str": "Jul 15",
+            "media": [{"ldfeatured": True, "media_url": None, "youtube_vidid": "abc123"}],
+            "missions": [{"name": "SpaceX CRS-25", "description": "Resupply mission"}],
+            "vehicle": {"id": 1, "name": "Falcon 9"},
+            "provider": {"name": "SpaceX", "slug": "spacex"},
+            "pad": {"name": "LC-39A", "location": {"name": "Kennedy Space Center"}},
+        }
+
+    def test_from_api(self):
+        launch = Launch.from_api(self.api_launch)
+        self.assertEqual(launch.win_open, datetime(2022, 7, 15, 0, 44, 0, tzinfo=pytz.utc))
+        self.assertEqual(launch.live_url, "https://youtu.be/abc123")
+        self.assertEqual(launch.mission_desc, "Resupply mission")
+        self.assertEqual(launch.mission_names, ("SpaceX CRS-25",))
+        self.assertEqual(launch.location_name, "Kennedy Space Center")
+
+        self.api_launch["t0"] = "2022-07-15T00:45:00Z"
+        self.assertEqual(Launch.from_api(self.api_launch).win_open, datetime(2022, 7, 15, 0, 45, 0, tzinfo=pytz.utc))
+
+    def test_dump(self):
+        launch = Launch.from_api(self.api_launch)
+        loaded = Launch.load(launch.dump())
+        for name in Launch.__slots__:
+            self.assertEqual(getattr(loaded, name), getattr(launch, name))
+
+        self.api_launch["win_open"] = None
+        launch = Launch.from_api(self.api_launch)
+        self.assertEqual(Launch.load(launch.dump()).win_open, None)
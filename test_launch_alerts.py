@@ -0,0 +1,144 @@
+import json
+import time
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytz
+
+import launch_alerts
+import redis_utils
+from acronym_utils import DECRONYM_CACHE_KEY, acronym_dictionary
+from alert_outbox import ALERT, LAUNCH_MOVED, OutboxAlert
+from config import ALERT_SUBSCRIBERS_KEY, config_cache
+from fake_redis import use_fake_redis
+from launch_monitor_utils import get_sent_alert_key
+from launch_sync import get_known_launches_key
+from test_launch_sync import get_launch
+
+
+class TestLaunchAlerts(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.bot = None
+        use_fake_redis(self)
+        config_cache.clear()
+
+    async def asyncTearDown(self):
+        if self.bot:
+            await self.bot.close()
+
+    async def test_create_bot(self):
+        self.assertFalse(hasattr(launch_alerts, "bot"))
+        self.bot = await launch_alerts.create_bot()
+        self.assertIsInstance(self.bot.get_cog("LaunchAlerts"), launch_alerts.LaunchAlerts)
+        self.assertTrue({"next", "today", "config", "slug", "acronym", "profile"} <= set(self.bot.all_commands))
+        self.assertFalse(self.bot.is_ready())
+
+    async def test_warm_caches(self):
+        launch = get_launch("crs-25", datetime(2022, 7, 15, 0, 44, tzinfo=pytz.utc))
+        sync_db = redis_utils.sync_db
+        sync_db.hset(get_known_launches_key(0), "crs-25", json.dumps(launch.dump()))
+        sync_db.set("cache-launch-v2-crs-25", json.dumps({"value": launch.dump(), "fetched_at": time.time()}))
+        sync_db.sadd(ALERT_SUBSCRIBERS_KEY, "config-user-123456")
+        sync_db.set("config-user-123456", json.dumps({"receive_alerts": "true"}))
+        sync_db.set(DECRONYM_CACHE_KEY, json.dumps({"etag": None, "last_modified": None,
+                                                    "acronyms": {"LEO": ["Low Earth Orbit"]}}))
+
+        self.bot = await launch_alerts.create_bot()
+        cog = self.bot.get_cog("LaunchAlerts")
+        cog.config_subscribed.set()
+        await cog.warm_caches()
+        self.assertEqual(cog.launch_cache.peek("crs-25").name, "CRS-25")
+        self.assertEqual(config_cache.get("config-user-123456"), {"receive_alerts": "true"})
+        self.assertEqual(acronym_dictionary.lookup("leo"), ["Low Earth Orbit"])
+
+    async def test_config_unknown_option(self):
+        self.bot = await launch_alerts.create_bot()
+        cog = self.bot.get_cog("LaunchAlerts")
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        channel = SimpleNamespace(id=754432168293433354, guild=SimpleNamespace(id=360523650912223253), send=send)
+        ctx = SimpleNamespace(message=SimpleNamespace(channel=channel))
+        await cog.config.callback(cog, ctx, "foo", value="bar")
+        await cog.config.callback(cog, ctx, "foo")
+        self.assertEqual(sent, ["Unknown option foo", "Unknown option foo"])
+
+
+class TestSendOutboxAlerts(unittest.IsolatedAsyncioTestCase):
+    # Sent alerts are only recorded until the launch is long past
+    WIN_OPEN = datetime.fromtimestamp(int(time.time()) + 60 * 60 * 24, pytz.utc)
+
+    def setUp(self):
+        self.bot = None
+        use_fake_redis(self)
+        self.sends = []
+        self.fail_after = None
+
+    async def asyncSetUp(self):
+        self.bot = await launch_alerts.create_bot()
+        self.cog = self.bot.get_cog("LaunchAlerts")
+        self.cog.get_launch_by_slug = self.get_launch_by_slug
+        self.cog.get_alert_destination = self.get_alert_destination
+        self.cog.send_launch_panels = self.send_launch_panels
+
+    async def asyncTearDown(self):
+        if self.bot:
+            await self.bot.close()
+
+    async def get_launch_by_slug(self, slug):
+        return None if slug == "gone" else get_launch(slug, self.WIN_OPEN)
+
+    async def get_alert_destination(self, alert, launch):
+        return SimpleNamespace(id=int(alert.channel)), SimpleNamespace(timezone="UTC")
+
+    async def send_launch_panels(self, channel, launches, timezone, message=None):
+        if self.fail_after is not None and len(self.sends) == self.fail_after:
+            raise Exception("Missing Permissions")
+        self.sends.append((channel.id, [launch.slug for launch in launches], message))
+
+    def get_alert(self, channel, slug, kind=ALERT):
+        return OutboxAlert(kind, "360523650912223253", channel, slug, int(self.WIN_OPEN.timestamp()), 1644890400,
+                           time.time())
+
+    def is_recorded(self, alert):
+        return redis_utils.sync_db.sismember(get_sent_alert_key(alert.channel, alert.launch, alert.launch_win_open),
+                                             alert.alert_time)
+
+    async def test_alerts_are_grouped_by_channel_and_kind(self):
+        await self.cog.send_outbox_alerts([self.get_alert("1", "crs-25"), self.get_alert("2", "crs-25"),
+                                           self.get_alert("1", "crs-26"),
+                                           self.get_alert("1", "crs-27", LAUNCH_MOVED)])
+        self.assertEqual(self.sends, [(1, ["crs-25", "crs-26"], "There are 2 launches coming up!"),
+                                      (2, ["crs-25"], "There's a launch coming up!"),
+                                      (1, ["crs-27"], "The launch window has moved!")])
+
+        # Already recorded as sent
+        await self.cog.send_outbox_alerts([self.get_alert("1", "crs-25")])
+        self.assertEqual(len(self.sends), 3)
+
+    async def test_failed_chunk_is_forgotten(self):
+        alerts = [self.get_alert("1", f"launch-{i}") for i in range(12)]
+        self.fail_after = 1
+        with self.assertRaises(Exception):
+            await self.cog.send_outbox_alerts(alerts)
+        self.assertEqual(self.sends, [(1, [f"launch-{i}" for i in range(10)], "There are 10 launches coming up!")])
+        self.assertEqual([self.is_recorded(alert) for alert in alerts], [True] * 10 + [False] * 2)
+
+        # The retry only sends what's missing
+        self.fail_after = None
+        await self.cog.send_outbox_alerts(alerts)
+        self.assertEqual(self.sends[1], (1, ["launch-10", "launch-11"], "There are 2 launches coming up!"))
+
+    async def test_alerts_for_missing_launches_are_dropped(self):
+        alerts = [self.get_alert("1", "gone"), self.get_alert("1", "crs-25")]
+        await self.cog.send_outbox_alerts(alerts)
+        self.assertEqual(self.sends, [(1, ["crs-25"], "There's a launch coming up!")])
+        self.assertFalse(self.is_recorded(alerts[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
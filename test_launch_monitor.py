@@ -4,7 +4,7 @@ from datetime import timedelta, datetime
 import pytz
 from freezegun import freeze_time
 
-from launch_monitor import LaunchMonitor
+from launch_monitor import LaunchMonitor, parse_alert_times
 
 
 class TestLaunchMonitor(unittest.TestCase):
@@ -21,6 +21,11 @@ class TestLaunchMonitor(unittest.TestCase):
         self.assertEqual(LaunchMonitor.get_time_delta_from_str("1d3h2s"), timedelta(seconds=97202))
         self.assertEqual(LaunchMonitor.get_time_delta_from_str("2s3h1d"), timedelta(seconds=97202))
 
+    def test_parse_alert_times(self):
+        self.assertEqual(parse_alert_times("15m, 1h,24h"),
+                         (timedelta(hours=24), timedelta(hours=1), timedelta(minutes=15)))
+        self.assertIs(parse_alert_times("24h, 12h, 6h, 3h, 1h, 15m"), parse_alert_times("24h, 12h, 6h, 3h, 1h, 15m"))
+
     def test_is_valid_alert_time_format(self):
         self.assertEqual(LaunchMonitor.is_valid_alert_time_format("1s"), True)
         self.assertEqual(LaunchMonitor.is_valid_alert_time_format("1m"), True)
@@ -170,3 +175,33 @@ class TestLaunchMonitor(unittest.TestCase):
         }
         lm.load(data, "24h, 12h, 6h, 3h, 1h, 15m")
         self.assertEqual(lm.is_alert_due(), False)
+
+    def test_dump_compact(self):
+        lm = LaunchMonitor()
+        data = ["360523650912223253", "general", "test-slug", 1518444000, 1518400800]
+        lm.load_compact(data, "24h, 12h, 6h, 3h, 1h, 15m")
+        self.assertEqual(lm.launch_win_open, datetime(2018, 2, 12, 14, 0, 0, tzinfo=pytz.utc))
+        self.assertEqual(lm.last_alert, datetime(2018, 2, 12, 2, 0, 0, tzinfo=pytz.utc))
+        self.assertEqual(lm.dump_compact(), data)
+
+        lm = LaunchMonitor()
+        lm.load({
+            "server": None,
+            "channel": "general",
+            "launch_slug": "test-slug",
+            "launch_win_open": "2018-02-12T14:00:00+0000",
+            "last_alert": None
+        }, "24h, 12h, 6h, 3h, 1h, 15m")
+        self.assertEqual(lm.dump_compact(), [None, "general", "test-slug", 1518444000, None])
+
+    @freeze_time("2018-02-12 08:10:00+00:00")
+    def test_last_alert_datetime(self):
+        # No alerts sent yet
+        lm = LaunchMonitor()
+        lm.load_compact([None, "general", "test-slug", 1518444000, None], "24h, 12h, 6h, 3h, 1h, 15m")
+        self.assertEqual(lm.last_alert_datetime, None)
+
+        # Alert sent late for the 6h
+        lm = LaunchMonitor()
+        lm.load_compact([None, "general", "test-slug", 1518444000, 1518423000], "24h, 12h, 6h, 3h, 1h, 15m")
+        self.assertEqual(lm.last_alert_datetime, datetime(2018, 2, 12, 8, 0, 0, tzinfo=pytz.utc))
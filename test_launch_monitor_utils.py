@@ -0,0 +1,104 @@
+import json
+import time
+import unittest
+
+import redis_utils
+from fake_redis import use_fake_redis
+from launch_monitor_utils import LAUNCH_MONITORS_KEY, LAUNCH_MONITORS_HASH_KEY, LAUNCH_MONITORS_DUE_KEY, \
+    get_launch_monitors_key, get_stored_launch_monitors, get_stored_due_times, get_due_key, save_launch_monitors, \
+    migrate_launch_monitors_blob, migrate_launch_monitors_to_partitions, migrate_due_times_to_partitions, \
+    record_sent_alert, forget_sent_alert, get_sent_alert_key, LAUNCH_MOVED_ALERT_TIME, SENT_ALERT_EXPIRE_SECONDS
+from partitions import get_field_partition
+
+
+class TestLaunchMonitorStorage(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        self.sync_db = redis_utils.sync_db
+
+    async def test_migrate_launch_monitors_to_partitions(self):
+        launch_monitors = {"1:crs-25": [None, "1", "crs-25", 1644894000, None],
+                           "2:crs-25": [None, "2", "crs-25", 1644894000, 1644807600]}
+        self.sync_db.hset(LAUNCH_MONITORS_HASH_KEY, mapping={field: json.dumps(lm)
+                                                             for field, lm in launch_monitors.items()})
+
+        self.assertEqual(await migrate_launch_monitors_to_partitions(), 2)
+        self.assertEqual(await migrate_launch_monitors_to_partitions(), 0)
+        self.assertFalse(self.sync_db.exists(LAUNCH_MONITORS_HASH_KEY))
+        self.assertEqual(self.sync_db.hkeys(get_launch_monitors_key(get_field_partition("1:crs-25"))), ["1:crs-25"])
+        self.assertEqual(await get_stored_launch_monitors(), launch_monitors)
+        self.assertEqual(await get_stored_launch_monitors([get_field_partition("2:crs-25")]),
+                         {"2:crs-25": launch_monitors["2:crs-25"]})
+
+
+    async def test_only_changed_monitors_are_written(self):
+        stored = {"1:crs-25": [None, "1", "crs-25", 1644894000, None],
+                  "2:crs-25": [None, "2", "crs-25", 1644894000, None],
+                  "3:crs-25": [None, "3", "crs-25", 1644894000, None]}
+        stored_due = {"1:crs-25": 1644807600, "2:crs-25": 1644807600, "3:crs-25": 1644807600}
+        self.assertEqual(await save_launch_monitors(stored, {}, stored_due, {}), 6)
+        # Written with different spacing, so a rewrite would show
+        unchanged_key = get_launch_monitors_key(get_field_partition("1:crs-25"))
+        self.sync_db.hset(unchanged_key, "1:crs-25", json.dumps(stored["1:crs-25"]))
+
+        launch_monitors = {"1:crs-25": stored["1:crs-25"], "2:crs-25": [None, "2", "crs-25", 1644894000, 1644807600]}
+        due_times = {"1:crs-25": 1644807600, "2:crs-25": 1644850800}
+        # One monitor and due time changed, one of each removed
+        self.assertEqual(await save_launch_monitors(launch_monitors, stored, due_times, stored_due), 4)
+        self.assertEqual(self.sync_db.hget(unchanged_key, "1:crs-25"), json.dumps(stored["1:crs-25"]))
+        self.assertEqual(await get_stored_launch_monitors(), launch_monitors)
+        self.assertEqual(await get_stored_due_times(), due_times)
+
+    async def test_migrate_launch_monitors_blob(self):
+        self.sync_db.set(LAUNCH_MONITORS_KEY, json.dumps([
+            {"server": "360523650912223253", "channel": "1", "launch_slug": "crs-25",
+             "launch_win_open": "2022-02-15T03:00:00+0000", "last_alert": "2022-02-14T03:00:00+0000"},
+            {"server": None, "channel": "2", "launch_slug": "crs-25",
+             "launch_win_open": "2022-02-15T03:00:00+0000", "last_alert": None},
+        ]))
+
+        self.assertEqual(await migrate_launch_monitors_blob(), 2)
+        self.assertEqual(await migrate_launch_monitors_blob(), 0)
+        self.assertFalse(self.sync_db.exists(LAUNCH_MONITORS_KEY))
+        self.assertEqual(await get_stored_launch_monitors(),
+                         {"1:crs-25": ["360523650912223253", "1", "crs-25", 1644894000, 1644807600],
+                          "2:crs-25": [None, "2", "crs-25", 1644894000, None]})
+
+    async def test_migrate_due_times_to_partitions(self):
+        self.sync_db.zadd(LAUNCH_MONITORS_DUE_KEY, {"1:crs-25": 1644807600, "2:crs-25": 1644850800})
+
+        self.assertEqual(await migrate_due_times_to_partitions(), 2)
+        self.assertEqual(await migrate_due_times_to_partitions(), 0)
+        self.assertFalse(self.sync_db.exists(LAUNCH_MONITORS_DUE_KEY))
+        self.assertEqual(self.sync_db.zscore(get_due_key(get_field_partition("2:crs-25")), "2:crs-25"), 1644850800)
+        self.assertEqual(await get_stored_due_times(), {"1:crs-25": 1644807600, "2:crs-25": 1644850800})
+
+
+class TestSentAlerts(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        self.win_open = int(time.time()) + 60 * 60 * 24
+
+    async def test_record_and_forget(self):
+        alert_time = self.win_open - 60 * 60
+        self.assertTrue(await record_sent_alert("1", "crs-25", self.win_open, alert_time))
+        # Every other claim of the same alert is a duplicate
+        self.assertFalse(await record_sent_alert("1", "crs-25", self.win_open, alert_time))
+        # Other alert times, channels and windows are separate
+        self.assertTrue(await record_sent_alert("1", "crs-25", self.win_open, LAUNCH_MOVED_ALERT_TIME))
+        self.assertTrue(await record_sent_alert("2", "crs-25", self.win_open, alert_time))
+        self.assertTrue(await record_sent_alert("1", "crs-25", self.win_open + 3600, alert_time))
+
+        key = get_sent_alert_key("1", "crs-25", self.win_open)
+        self.assertAlmostEqual(redis_utils.sync_db.ttl(key), self.win_open + SENT_ALERT_EXPIRE_SECONDS - time.time(),
+                               delta=5)
+
+        # Forgotten after a failed send, so the retry can claim it again
+        await forget_sent_alert("1", "crs-25", self.win_open, alert_time)
+        self.assertTrue(await record_sent_alert("1", "crs-25", self.win_open, alert_time))
+        self.assertEqual(redis_utils.sync_db.smembers(key), {str(alert_time), str(LAUNCH_MOVED_ALERT_TIME)})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+
+import redis_utils
+from alert_pipeline import LaunchMonitorSync
+from config import ALERT_SUBSCRIBERS_KEY, config_cache
+from fake_redis import use_fake_redis
+from launch import Launch
+from launch_monitor_utils import get_stored_launch_monitors
+from launch_sync import KNOWN_LAUNCHES_KEY, diff_launches, get_known_launches, get_known_launch_slugs, \
+    migrate_known_launches_to_partitions
+from partitions import get_subscriber_partition
+
+
+def get_launch(slug: str, win_open: datetime, live_url: str = None) -> Launch:
+    return Launch(slug=slug, name=slug.upper(), win_open=win_open, date_str="", live_url=live_url, mission_desc=None,
+                  mission_names=(), vehicle_id=1, vehicle_name="Falcon 9", provider_name="SpaceX",
+                  provider_slug="spacex", pad_name="LC-39A", location_name="Kennedy Space Center")
+
+
+class TestDiffLaunches(unittest.TestCase):
+
+    def test_diff(self):
+        win_open = datetime(2022, 7, 15, 0, 44, tzinfo=pytz.utc)
+        known = {slug: get_launch(slug, win_open) for slug in ("same", "moved", "updated", "removed")}
+        upcoming = [get_launch("same", win_open), get_launch("moved", win_open + timedelta(hours=1)),
+                    get_launch("updated", win_open, live_url="https://youtu.be/abc123"), get_launch("added", win_open)]
+
+        diff = diff_launches(known, upcoming)
+        self.assertEqual([launch.slug for launch in diff.added], ["added"])
+        self.assertEqual([launch.slug for launch in diff.removed], ["removed"])
+        self.assertEqual([(old.win_open, new.win_open) for old, new in diff.moved],
+                         [(win_open, win_open + timedelta(hours=1))])
+        self.assertEqual([launch.slug for launch in diff.updated], ["updated"])
+        self.assertFalse(diff_launches(known, list(known.values())))
+
+
+class TestLaunchMonitorSync(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+        config_cache.clear()
+        for user_id in ("1", "2"):
+            redis_utils.sync_db.set(f"config-user-{user_id}", json.dumps({"receive_alerts": "true"}))
+            redis_utils.sync_db.sadd(ALERT_SUBSCRIBERS_KEY, f"config-user-{user_id}")
+        self.win_open = datetime.now(pytz.utc).replace(microsecond=0) + timedelta(days=2)
+        self.sync = LaunchMonitorSync(full_reconcile_interval=3600, moved_notify_seconds=900)
+
+    async def test_sync(self):
+        await self.sync.sync([get_launch("first", self.win_open), get_launch("second", self.win_open)])
+        self.assertEqual(len(await get_stored_launch_monitors()), 4)
+        self.assertEqual(await get_known_launch_slugs(), ["first", "second"])
+
+        # Window moves are synced without a full reconcile and notify every subscriber
+        diff, moved = await self.sync.sync([get_launch("first", self.win_open + timedelta(hours=1))])
+        self.assertEqual(len(diff.moved), 1)
+        self.assertEqual(sorted(lm.channel for lm, _ in moved), ["1", "2"])
+        self.assertEqual({moved_from for _, moved_from in moved}, {int(self.win_open.timestamp())})
+        launch_monitors = await get_stored_launch_monitors()
+        self.assertEqual(set(launch_monitors), {"1:first", "2:first"})
+        self.assertEqual(launch_monitors["1:first"][3], int(self.win_open.timestamp()) + 3600)
+
+        # Small moves update the monitors without notifying
+        _, moved = await self.sync.sync([get_launch("first", self.win_open + timedelta(hours=1, minutes=5))])
+        self.assertEqual(moved, [])
+
+    async def test_config_changed(self):
+        launches = [get_launch("first", self.win_open)]
+        await self.sync.sync(launches)
+
+        redis_utils.sync_db.set("config-user-2", json.dumps({}))
+        config_cache.clear()
+        self.sync.config_changed("config-user-2")
+        await self.sync.sync(launches)
+        self.assertEqual(set(await get_stored_launch_monitors()), {"1:first"})
+
+
+    async def test_takeover_notices_moves_missed_by_the_last_owner(self):
+        first = get_subscriber_partition("config-user-1")
+        second = get_subscriber_partition("config-user-2")
+        self.assertNotEqual(first, second)
+        self.sync.set_partitions([first])
+        other = LaunchMonitorSync(full_reconcile_interval=3600, moved_notify_seconds=900)
+        other.set_partitions([second])
+        await self.sync.sync([get_launch("first", self.win_open)])
+        await other.sync([get_launch("first", self.win_open)])
+
+        # Only the other process was running when the launch moved
+        moved_launch = get_launch("first", self.win_open + timedelta(hours=1))
+        _, moved = await other.sync([moved_launch])
+        self.assertEqual([lm.channel for lm, _ in moved], ["2"])
+
+        # This one restarts and still notifies its subscriber
+        restarted = LaunchMonitorSync(full_reconcile_interval=3600, moved_notify_seconds=900)
+        restarted.set_partitions([first])
+        _, moved = await restarted.sync([moved_launch])
+        self.assertEqual([lm.channel for lm, _ in moved], ["1"])
+        self.assertEqual((await get_known_launches([first]))[first]["first"].win_open, moved_launch.win_open)
+
+    async def test_migrate_known_launches_to_partitions(self):
+        redis_utils.sync_db.hset(KNOWN_LAUNCHES_KEY, "first", json.dumps(get_launch("first", self.win_open).dump()))
+        self.assertEqual(await migrate_known_launches_to_partitions(), 1)
+        self.assertEqual(await migrate_known_launches_to_partitions(), 0)
+        self.assertFalse(redis_utils.sync_db.exists(KNOWN_LAUNCHES_KEY))
+        self.assertEqual(set((await get_known_launches([3]))[3]), {"first"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from cache_utils import LRUCache
+from metrics import MetricsRegistry, register_cache, registry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_render_counter(self):
+        metrics = MetricsRegistry(prefix="test_")
+        counter = metrics.counter("sent_total", "Messages sent", ("result",))
+        counter.inc(result="sent")
+        counter.inc(2, result="sent")
+        counter.inc(result="failed")
+
+        self.assertEqual(metrics.render(), "# HELP test_sent_total Messages sent\n"
+                                           "# TYPE test_sent_total counter\n"
+                                           'test_sent_total{result="sent"} 3\n'
+                                           'test_sent_total{result="failed"} 1\n')
+
+    def test_render_histogram(self):
+        metrics = MetricsRegistry()
+        histogram = metrics.histogram("latency_seconds", "Latency", ("endpoint",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, endpoint="launch")
+        histogram.observe(0.5, endpoint="launch")
+        histogram.observe(5, endpoint="launch")
+
+        lines = metrics.render().splitlines()
+        self.assertIn('latency_seconds_bucket{endpoint="launch",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="launch",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="launch",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{endpoint="launch"} 5.55', lines)
+        self.assertIn('latency_seconds_count{endpoint="launch"} 3', lines)
+
+    def test_time_labels_set_in_block(self):
+        metrics = MetricsRegistry()
+        histogram = metrics.histogram("request_seconds", "Requests", ("status",))
+        with self.assertRaises(RuntimeError):
+            with histogram.time(status="error"):
+                raise RuntimeError
+        with histogram.time(status="error") as labels:
+            labels["status"] = 200
+
+        lines = metrics.render().splitlines()
+        self.assertIn('request_seconds_count{status="error"} 1', lines)
+        self.assertIn('request_seconds_count{status="200"} 1', lines)
+
+    def test_wrong_labels(self):
+        counter = MetricsRegistry().counter("calls_total", "Calls", ("command",))
+        with self.assertRaises(ValueError):
+            counter.inc()
+
+    def test_register_cache(self):
+        cache = LRUCache(10)
+        cache.put("key", "value")
+        cache.get("key")
+        cache.get("missing")
+        register_cache("test", cache)
+
+        lines = registry.render().splitlines()
+        self.assertIn('launch_alerts_cache_requests_total{cache="test",result="hits"} 1', lines)
+        self.assertIn('launch_alerts_cache_requests_total{cache="test",result="misses"} 1', lines)
+        self.assertIn('launch_alerts_cache_size{cache="test"} 1', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
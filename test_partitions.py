@@ -0,0 +1,52 @@
+import unittest
+
+import redis_utils
+from fake_redis import use_fake_redis
+from partitions import PartitionLeases, get_field_partition, get_subscriber_partition, get_lease_key
+
+
+class TestPartitions(unittest.TestCase):
+
+    def test_subscriber_and_field_partitions_match(self):
+        self.assertEqual(get_subscriber_partition("config-channel-360523650912223253-754432168293433354"),
+                         get_field_partition("754432168293433354:crs-25"))
+        self.assertEqual(get_subscriber_partition("config-user-123456"), get_field_partition("123456:crs-25"))
+
+
+class TestPartitionLeases(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_fake_redis(self)
+
+    async def test_rebalance_and_failover(self):
+        first = PartitionLeases(partitions=8, lease_seconds=30, worker_id="first")
+        second = PartitionLeases(partitions=8, lease_seconds=30, worker_id="second")
+
+        self.assertTrue(await first.refresh())
+        self.assertEqual(first.owned, set(range(8)))
+
+        # A new worker gets its share once the first releases its extra partitions
+        await second.refresh()
+        await first.refresh()
+        await second.refresh()
+        self.assertEqual(len(first.owned), 4)
+        self.assertEqual(len(second.owned), 4)
+        self.assertFalse(first.owned & second.owned)
+
+        # Leases of a stopped worker are taken over once they expire
+        for partition in first.owned:
+            redis_utils.sync_db.delete(get_lease_key(partition))
+        redis_utils.sync_db.zrem("alert-workers", "first")
+        await second.refresh()
+        self.assertEqual(second.owned, set(range(8)))
+
+    async def test_release_all(self):
+        leases = PartitionLeases(partitions=4, lease_seconds=30, worker_id="first")
+        await leases.refresh()
+        await leases.release_all()
+        self.assertEqual(leases.owned, set())
+        self.assertIsNone(redis_utils.sync_db.get(get_lease_key(0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
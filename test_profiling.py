@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+from profiling import Profiler
+
+
+def profiled_function():
+    return sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = Profiler(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_not_armed(self):
+        with self.profiler.profile("process_alerts"):
+            profiled_function()
+        self.assertFalse(os.path.exists(self.directory.name) and os.listdir(self.directory.name))
+
+    def test_profiles_armed_runs(self):
+        self.profiler.arm("process_alerts", 2)
+        for _ in range(3):
+            with self.profiler.profile("process_alerts"):
+                profiled_function()
+            with self.profiler.profile("next"):
+                profiled_function()
+
+        files = os.listdir(self.directory.name)
+        self.assertEqual(len([file for file in files if file.endswith(".prof")]), 2)
+        summary = [file for file in files if file.endswith(".txt")][0]
+        self.assertTrue(summary.startswith("process_alerts-"))
+        with open(os.path.join(self.directory.name, summary)) as summary_file:
+            self.assertIn("profiled_function", summary_file.read())
+        self.assertIsNone(self.profiler.stop("process_alerts"))
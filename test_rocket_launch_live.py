@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import patch
+
+from aiohttp import web
+
+from rocket_launch_live import CircuitBreaker, CircuitOpenError, RocketLaunchLiveClient, UpstreamError, \
+    UpstreamClientError
+
+LAUNCH = {"slug": "test-slug", "name": "Test Launch", "t0": None, "win_open": "2021-11-18T01:00Z", "date_str": "Nov 18",
+          "missions": [], "vehicle": {"id": 1, "name": "Falcon 9"}, "provider": {"name": "SpaceX", "slug": "spacex"},
+          "pad": {"name": "LC-39A", "location": {"name": "Kennedy Space Center"}}, "media": []}
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_allows_one_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        with patch("rocket_launch_live.time.time", return_value=breaker.opened_at + 30):
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestRocketLaunchLiveClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.statuses = []
+        self.requests = 0
+
+        async def handler(request):
+            self.requests += 1
+            status = self.statuses.pop(0) if self.statuses else 200
+            if status != 200:
+                return web.Response(status=status)
+            return web.json_response({"result": [LAUNCH]})
+
+        app = web.Application()
+        app.router.add_get("/json/launch/{slug}", handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.client = RocketLaunchLiveClient("token", deadline=5, failure_threshold=2,
+                                             api_url=f"http://127.0.0.1:{port}/json")
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.runner.cleanup()
+
+    async def test_get_launch(self):
+        launch = await self.client.get_launch("test-slug")
+        self.assertEqual(launch.slug, "test-slug")
+        self.assertEqual(self.client.state()["circuit"], CircuitBreaker.CLOSED)
+
+    async def test_retries_server_errors(self):
+        self.statuses = [503]
+        with patch("rocket_launch_live.asyncio.sleep"):
+            launch = await self.client.get_launch("test-slug")
+        self.assertEqual(launch.slug, "test-slug")
+        self.assertEqual(self.requests, 2)
+
+    async def test_does_not_retry_client_errors(self):
+        self.statuses = [404]
+        with self.assertRaises(UpstreamError):
+            await self.client.get_launch("test-slug")
+        self.assertEqual(self.requests, 1)
+
+    async def test_client_errors_dont_open_circuit(self):
+        self.statuses = [404, 404, 404]
+        for _ in range(3):
+            with self.assertRaises(UpstreamClientError):
+                await self.client.get_launch("test-slug")
+        self.assertEqual(self.client.state()["circuit"], CircuitBreaker.CLOSED)
+        self.assertEqual(self.client.state()["failures"], 0)
+
+    async def test_fails_fast_when_circuit_open(self):
+        self.statuses = [501, 501]
+        for _ in range(2):
+            with self.assertRaises(UpstreamError):
+                await self.client.get_launch("test-slug")
+        with self.assertRaises(CircuitOpenError):
+            await self.client.get_launch("test-slug")
+        self.assertEqual(self.requests, 2)
+        self.assertEqual(self.client.state()["circuit"], CircuitBreaker.OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
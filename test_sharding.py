@@ -0,0 +1,36 @@
+import unittest
+
+from sharding import ShardStats, get_shard_id
+
+
+class FakeBot:
+    shard_count = 4
+    latencies = [(0, 0.05), (1, 0.1), (2, 0.05), (3, 0.2)]
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_get_shard_id(self):
+        self.assertEqual(get_shard_id("360523650912223253", 4), (360523650912223253 >> 22) % 4)
+        self.assertEqual(get_shard_id("360523650912223253", 1), 0)
+        self.assertEqual(get_shard_id(None, 4), 0)
+
+    def test_shard_stats(self):
+        shard_stats = ShardStats(FakeBot())
+        guild_shard = get_shard_id("360523650912223253", 4)
+        shard_stats.record_event({"op": 0, "t": "MESSAGE_CREATE", "d": {"guild_id": "360523650912223253"}})
+        shard_stats.record_event({"op": 0, "t": "GUILD_CREATE", "d": {"id": "360523650912223253"}})
+        shard_stats.record_event({"op": 0, "t": "MESSAGE_CREATE", "d": {"channel_id": "123456"}})
+        shard_stats.record_event({"op": 11, "d": None})  # Heartbeat ACK
+        self.assertEqual(dict(shard_stats.events), {guild_shard: 2, 0: 1})
+
+        stats = shard_stats.stats()
+        self.assertEqual(set(stats), {0, 1, 2, 3})
+        self.assertEqual(stats[1]["latency"], 0.1)
+        self.assertEqual(stats[1]["events_per_second"], 0)
+        self.assertGreater(stats[guild_shard]["events_per_second"], 0)
+        self.assertEqual(shard_stats.stats()[guild_shard]["events_per_second"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import unittest
+
+from test_launch_sync import get_launch
+from upcoming_launches import UpcomingLaunchesSnapshot
+
+
+class TestUpcomingLaunchesSnapshot(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_refreshes_share_one_fetch(self):
+        calls = []
+
+        async def fetch(args):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return [get_launch("crs-25", None)]
+
+        snapshot = UpcomingLaunchesSnapshot(fetch, horizon=25, refresh_interval=60)
+        await asyncio.gather(*(snapshot.refresh() for _ in range(5)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([launch.slug for launch in await snapshot.get()], ["crs-25"])
+
+    async def test_waiters_dont_clear_a_running_refresh(self):
+        calls = []
+
+        async def fetch(args):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return [get_launch("crs-25", None)]
+
+        snapshot = UpcomingLaunchesSnapshot(fetch, horizon=25, refresh_interval=60)
+        # A cancelled waiter used to clear the refresh it was waiting on, so the next call started another one
+        waiter = asyncio.ensure_future(snapshot.refresh())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        await snapshot.refresh()
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(snapshot._refresh_task)
+
+
+if __name__ == '__main__':
+    unittest.main()
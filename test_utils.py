@@ -1,8 +1,19 @@
 import unittest
-from utils import convert_quoted_string_in_list
+
+import discord
+
+from launch import Launch
+from utils import convert_quoted_string_in_list, launch_matches_filter, get_launch_embed, chunk_embeds
 
 
 class TestUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.launch = Launch(slug="crs-25", name="CRS-25", win_open=None, date_str="Jul 14", live_url=None,
+                             mission_desc=None, mission_names=("SpaceX CRS-25",), vehicle_id=1,
+                             vehicle_name="Falcon 9", provider_name="SpaceX", provider_slug="spacex",
+                             pad_name="SLC-40", location_name="Cape Canaveral SFS")
+
     def test_convert_quoted_string_in_list(self):
         self.assertEqual(convert_quoted_string_in_list([]), [])
         self.assertEqual(convert_quoted_string_in_list(['3']), ['3'])
@@ -15,3 +26,31 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(convert_quoted_string_in_list(['5', 'united', 'launch', 'alliance']), ['5', 'united launch alliance'])
         self.assertEqual(convert_quoted_string_in_list(['5', 'united launch', 'alliance']), ['5', 'united launch alliance'])
         self.assertEqual(convert_quoted_string_in_list(['5', 'united launch alliance']), ['5', 'united launch alliance'])
+
+    def test_launch_matches_filter(self):
+        launch = self.launch
+        self.assertEqual(launch_matches_filter(launch, ""), True)
+        self.assertEqual(launch_matches_filter(launch, "crs"), True)
+        self.assertEqual(launch_matches_filter(launch, "falcon 9"), True)
+        self.assertEqual(launch_matches_filter(launch, "spacex"), True)
+        self.assertEqual(launch_matches_filter(launch, "falcon heavy"), False)
+
+    def test_get_launch_embed(self):
+        embed = get_launch_embed(self.launch, "UTC")
+        self.assertIs(get_launch_embed(self.launch, "America/New_York"), embed)
+        self.assertIsNot(get_launch_embed(self.launch, "UTC", with_tc=True), embed)
+
+        self.launch.live_url = "https://youtu.be/abc123"
+        updated_embed = get_launch_embed(self.launch, "UTC")
+        self.assertIsNot(updated_embed, embed)
+        self.assertEqual(updated_embed.description, "Live URL: https://youtu.be/abc123")
+
+    def test_chunk_embeds(self):
+        self.assertEqual(chunk_embeds([]), [])
+        embeds = [discord.Embed(title=str(i)) for i in range(23)]
+        self.assertEqual([len(chunk) for chunk in chunk_embeds(embeds)], [10, 10, 3])
+        self.assertEqual([embed for chunk in chunk_embeds(embeds) for embed in chunk], embeds)
+
+        # Messages are also limited to 6000 characters of embeds
+        embeds = [discord.Embed(description="x" * 2500) for _ in range(5)]
+        self.assertEqual([len(chunk) for chunk in chunk_embeds(embeds)], [2, 2, 1])
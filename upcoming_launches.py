@@ -0,0 +1,85 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from logbook import Logger
+
+from launch import Launch
+from utils import launch_matches_filter
+
+log = Logger('Upcoming Launches')
+
+
+class UpcomingLaunchesSnapshot:
+    """
+    The next `horizon` launches, refreshed in the background every
+    refresh_interval seconds so the alert loop and the next/today commands
+    share one upstream request instead of each making their own.
+    """
+
+    def __init__(self, fetch: Callable[[Sequence], Awaitable[Optional[List[Launch]]]], horizon: int,
+                 refresh_interval: int):
+        self.fetch = fetch
+        self.horizon = horizon
+        self.refresh_interval = refresh_interval
+        self.launches: Optional[List[Launch]] = None
+        self.refreshed_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_fresh(self) -> bool:
+        """Data older than a few missed refreshes is not trusted to answer queries locally."""
+        return self.launches is not None and time.time() - self.refreshed_at < self.refresh_interval * 5
+
+    async def refresh(self) -> None:
+        # Concurrent callers share the same refresh
+        if self._refresh_task is None:
+            task = asyncio.ensure_future(self._refresh())
+            task.add_done_callback(self._refresh_done)
+            self._refresh_task = task
+        await asyncio.shield(self._refresh_task)
+
+    def _refresh_done(self, task: asyncio.Task) -> None:
+        # Only the task that finished, a newer refresh may already have started
+        if self._refresh_task is task:
+            self._refresh_task = None
+
+    async def _refresh(self) -> None:
+        launches = await self.fetch((str(self.horizon),))
+        if launches is None:
+            log.warning("Upstream returned no data, keeping previous upcoming launches")
+            return
+        self.launches = launches
+        self.refreshed_at = time.time()
+
+    async def get(self) -> List[Launch]:
+        """
+        Returns the snapshot, fetching it first if it has never been loaded.
+        Unlike find, there is no freshness check, so while refreshes are
+        failing callers get the last launches loaded however old they are.
+        """
+        if self.launches is None:
+            await self.refresh()
+        return self.launches or []
+
+    def find(self, count: int, filter_arg: str = "") -> Optional[List[Launch]]:
+        """
+        Answer a `next` query from the snapshot.  Returns None when the snapshot
+        can't answer it, either because it's stale or because fewer than count
+        matching launches fall inside the horizon.
+        """
+        if not self.is_fresh:
+            return None
+
+        matches = [launch for launch in self.launches if launch_matches_filter(launch, filter_arg)]
+        if len(matches) < count:
+            return None
+        return matches[:count]
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.exception("Error refreshing upcoming launches: {}".format(e))
+            await asyncio.sleep(self.refresh_interval)
@@ -1,65 +1,87 @@
-from typing import Union, List, Tuple, Any
+from typing import Union, List, Tuple, Any, Optional
 
 import aiohttp
 import discord
 import pytz
 from datetime import datetime
-from dateutil.parser import parse
 from discord import Message, DMChannel, TextChannel
+from discord.http import Route
 
+from cache_utils import LRUCache
 from config import UserConfig, ChannelConfig
+from launch import Launch
 from local_config import SERVERS_WITH_TC_INTEGRATION
 
+LAUNCH_EMBED_CACHE_SIZE = 256
+MAX_EMBEDS_PER_MESSAGE = 10  # Discord's limits for one message
+MAX_EMBED_CHARACTERS_PER_MESSAGE = 6000
+
+launch_embed_cache = LRUCache(LAUNCH_EMBED_CACHE_SIZE)
+
 
 async def new_aiohttp_connector(*args, **kwargs) -> aiohttp.TCPConnector:
     """*Yes, it's just a coro to instantiate a class.*"""
     return aiohttp.TCPConnector(*args, **kwargs)
 
 
-def get_config_from_message(message: Message):
+async def get_config_from_message(message: Message):
     if isinstance(message.channel, DMChannel):
-        config = UserConfig(message.author.id)
+        config = await UserConfig.create(message.author.id)
     else:
-        config = ChannelConfig(message.channel.guild.id, message.channel.id)
+        config = await ChannelConfig.create(message.channel.guild.id, message.channel.id)
     return config
 
 
-def get_config_from_channel(channel: Union[TextChannel, DMChannel]):
+async def get_config_from_channel(channel: Union[TextChannel, DMChannel]):
     if isinstance(channel, DMChannel):
-        config = UserConfig(channel.recipient.id)
+        config = await UserConfig.create(channel.recipient.id)
     else:
-        config = ChannelConfig(channel.guild.id, channel.id)
+        config = await ChannelConfig.create(channel.guild.id, channel.id)
     return config
 
 
-def get_config_from_db_key(db_key: str):
+async def get_config_from_db_key(db_key: str):
     if db_key.startswith(UserConfig.KEY_PREFIX):
         _, _, user_id = db_key.split("-")
-        return UserConfig(user_id)
+        return await UserConfig.create(user_id)
     elif db_key.startswith(ChannelConfig.KEY_PREFIX):
         _, _, server_id, channel_id = db_key.split("-")
-        return ChannelConfig(server_id, channel_id)
+        return await ChannelConfig.create(server_id, channel_id)
     raise Exception("Can't match to KEY_PREFIX")
 
 
-def get_seconds_to_launch(launch):
-    window_open = get_launch_win_open(launch)
+def get_seconds_to_launch(launch: Launch):
+    window_open = launch.win_open
     if window_open:
         seconds_to_launch = int((window_open - datetime.now(pytz.utc)).total_seconds())
         return seconds_to_launch
 
 
-def get_launch_embed(launch, timezone, show_countdown=True, with_tc=False):
-    slug = launch["slug"]
+def get_launch_embed(launch: Launch, timezone, show_countdown=True, with_tc=False) -> discord.Embed:
+    """
+    Embeds are rendered once per launch data version and shared between every
+    channel the launch is sent to, so callers must not modify them.  Times are
+    rendered client-side with <t:...>, so timezone doesn't change the embed.
+    """
+    key = (launch.slug, launch.version, with_tc)
+    embed = launch_embed_cache.get(key)
+    if embed is None:
+        embed = render_launch_embed(launch, with_tc)
+        launch_embed_cache.put(key, embed)
+    return embed
+
+
+def render_launch_embed(launch: Launch, with_tc: bool) -> discord.Embed:
+    slug = launch.slug
 
     embed = discord.Embed()
-    embed.title = "{}".format(launch["name"])
+    embed.title = "{}".format(launch.name)
 
     description = ""
-    if get_live_url(launch):
-        description += f"Live URL: {get_live_url(launch)}"
-    if get_mission_desc(launch):
-        description += f'\n{get_mission_desc(launch)}'
+    if launch.live_url:
+        description += f"Live URL: {launch.live_url}"
+    if launch.mission_desc:
+        description += f'\n{launch.mission_desc}'
     if description:
         embed.description = description
 
@@ -71,25 +93,53 @@ def get_launch_embed(launch, timezone, show_countdown=True, with_tc=False):
     embed.set_footer(text=footer)
 
     #  Date Embed Field
-    if get_launch_win_open(launch):
-        launch_window = get_launch_win_open(launch)
-        date_display = int(launch_window.timestamp())
+    if launch.win_open:
+        date_display = int(launch.win_open.timestamp())
         embed.add_field(name=f"<t:{date_display}:D>", value=f"<t:{date_display}:t> (your time)\n<t:{date_display}:R>")
     else:
-        date_display = launch["date_str"].upper()
+        date_display = launch.date_str.upper()
         embed.add_field(name=date_display, value="Estimated")
 
-    vehicle_name = launch["vehicle"]["name"]
-    provider_name = launch["provider"]["name"]
-    pad_name = launch["pad"]["name"]
-    location_name = launch["pad"]["location"]["name"]
-    embed.add_field(name=vehicle_name, value=f'{provider_name}\n{pad_name}, {location_name}')
+    embed.add_field(name=launch.vehicle_name, value=f'{launch.provider_name}\n{launch.pad_name}, {launch.location_name}')
 
     return embed
 
 
-def is_today_launch(launch, timezone):
-    launch_window = get_launch_win_open(launch)
+def chunk_embeds(embeds: List[discord.Embed]) -> List[List[discord.Embed]]:
+    """Splits embeds, in order, into as few messages as Discord's embed count and size limits allow."""
+    chunks = []
+    chunk, characters = [], 0
+    for embed in embeds:
+        too_long = characters + len(embed) > MAX_EMBED_CHARACTERS_PER_MESSAGE
+        if chunk and (len(chunk) == MAX_EMBEDS_PER_MESSAGE or too_long):
+            chunks.append(chunk)
+            chunk, characters = [], 0
+        chunk.append(embed)
+        characters += len(embed)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+async def send_embeds(channel: Union[TextChannel, DMChannel], content: Optional[str],
+                      embeds: List[discord.Embed]) -> Message:
+    """
+    Like channel.send, but with up to MAX_EMBEDS_PER_MESSAGE embeds, which
+    discord.py 1.7 can't send.  Goes through the same HTTP client, so the
+    message still waits on the channel's rate limits.
+    """
+    if len(embeds) == 1:
+        return await channel.send(content, embed=embeds[0])
+    payload = {"embeds": [embed.to_dict() for embed in embeds]}
+    if content:
+        payload["content"] = content
+    route = Route("POST", "/channels/{channel_id}/messages", channel_id=channel.id)
+    data = await channel._state.http.request(route, json=payload)
+    return channel._state.create_message(channel=channel, data=data)
+
+
+def is_today_launch(launch: Launch, timezone):
+    launch_window = launch.win_open
     if not launch_window:
         return False
 
@@ -136,25 +186,10 @@ def convert_quoted_string_in_list(args: Tuple[Any]) -> List:
     return new_list
 
 
-def get_launch_win_open(launch: dict) -> datetime:
-    if launch["t0"]:
-        win_open = launch["t0"]
-    else:
-        win_open = launch["win_open"]
-    if win_open:
-        return parse(win_open)
-
-
-def get_live_url(launch: dict) -> str:
-    for media in launch["media"]:
-        if media["ldfeatured"]:
-            if media["media_url"]:
-                return media["media_url"]
-            elif media["youtube_vidid"]:
-                return f'https://youtu.be/{media["youtube_vidid"]}'
-
-
-def get_mission_desc(launch: dict) -> str:
-    if launch["missions"]:
-        if launch["missions"][0]["description"]:
-            return launch["missions"][0]["description"]
+def launch_matches_filter(launch: Launch, filter_arg: str) -> bool:
+    """Case-insensitive match of a `next` filter against the launch, vehicle, provider and mission names."""
+    if not filter_arg:
+        return True
+    filter_arg = filter_arg.lower()
+    names = (launch.name, launch.vehicle_name, launch.provider_name) + launch.mission_names
+    return any(filter_arg in name.lower() for name in names if name)